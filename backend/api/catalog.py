@@ -0,0 +1,144 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.dispatch import receiver
+from django.http import HttpResponse
+from rest_framework.exceptions import NotFound
+from rest_framework.renderers import JSONRenderer
+
+from core.cache import get_catalog_version
+from core.consts import SHOP_SUGGEST_CUTOFF
+from core.models import Group, Shop
+from core.shops import shop_index
+from core.signals import catalog_changed
+
+from .renderers import dumps
+from .serializers import GroupSerializer, ShopSerializer
+
+
+logger = logging.getLogger(__name__)
+
+CATALOG_SNAPSHOT_KEY = 'catalog:snapshot:{version}'
+
+_local = {'version': None, 'snapshot': None}
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='catalog')
+
+
+def render_items(data):
+    """Кодирует список и каждый элемент отдельно для выдачи по id."""
+
+    return dumps(data), {item['id']: dumps(item) for item in data}
+
+
+def build_catalog_snapshot():
+    """Собирает закодированный в JSON каталог проверенных магазинов."""
+
+    shops = ShopSerializer(
+        Shop.objects.filter(validation=True).prefetch_related('group'),
+        many=True,
+    ).data
+    groups = GroupSerializer(Group.objects.all(), many=True).data
+    shops_list, shops_items = render_items(shops)
+    groups_list, groups_items = render_items(groups)
+    return {
+        'shops': shops_list,
+        'shop_items': shops_items,
+        'groups': groups_list,
+        'group_items': groups_items,
+    }
+
+
+def rebuild_catalog_snapshot(version=None):
+    """Собирает и сохраняет снимок каталога для текущей версии."""
+
+    if version is None:
+        version = get_catalog_version()
+    snapshot = build_catalog_snapshot()
+    cache.set(
+        CATALOG_SNAPSHOT_KEY.format(version=version),
+        snapshot,
+        settings.CATALOG_SNAPSHOT_TIMEOUT,
+    )
+    with _lock:
+        _local.update(version=version, snapshot=snapshot)
+    return snapshot
+
+
+def get_catalog_snapshot():
+    """Снимок каталога: из памяти процесса, общего кэша или сборкой."""
+
+    version = get_catalog_version()
+    with _lock:
+        if _local['version'] == version:
+            return _local['snapshot']
+    snapshot = cache.get(CATALOG_SNAPSHOT_KEY.format(version=version))
+    if snapshot is None:
+        return rebuild_catalog_snapshot(version)
+    with _lock:
+        _local.update(version=version, snapshot=snapshot)
+    return snapshot
+
+
+def snapshot_list_response(part):
+    """Ответ со списком из снимка каталога без повторной сериализации."""
+
+    return HttpResponse(
+        get_catalog_snapshot()[part],
+        content_type=JSONRenderer.media_type,
+    )
+
+
+def snapshot_item_response(part, pk):
+    """Ответ с одним элементом снимка каталога."""
+
+    try:
+        content = get_catalog_snapshot()[part][int(pk)]
+    except (KeyError, TypeError, ValueError):
+        raise NotFound()
+    return HttpResponse(content, content_type=JSONRenderer.media_type)
+
+
+def autocomplete_response(query, limit):
+    """Подсказки магазинов из закодированного снимка каталога.
+
+    Если по префиксу найдено меньше limit магазинов, добавляются
+    магазины с похожими названиями, чтобы опечатка не приводила
+    к созданию дубля.
+    """
+
+    shop_index.ensure_fresh()
+    shop_ids = dict.fromkeys(shop_index.search(query, limit))
+    if len(shop_ids) < limit:
+        for shop_id in shop_index.similar(query, limit, SHOP_SUGGEST_CUTOFF):
+            if len(shop_ids) == limit:
+                break
+            shop_ids.setdefault(shop_id)
+    items = get_catalog_snapshot()['shop_items']
+    return HttpResponse(
+        b'[' + b','.join(
+            items[shop_id] for shop_id in shop_ids if shop_id in items
+        ) + b']',
+        content_type=JSONRenderer.media_type,
+    )
+
+
+def _rebuild_in_background():
+    try:
+        rebuild_catalog_snapshot()
+    except Exception:
+        logger.exception('Catalog snapshot rebuild failed')
+    finally:
+        connections.close_all()
+
+
+@receiver(catalog_changed)
+def schedule_catalog_rebuild(sender, **kwargs):
+    """После изменения каталога пересобирает снимок в фоне."""
+
+    if settings.CATALOG_SNAPSHOT_ASYNC:
+        _executor.submit(_rebuild_in_background)
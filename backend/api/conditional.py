@@ -0,0 +1,52 @@
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from core.cache import get_catalog_version, get_wallet_version
+
+
+def wallet_version(request):
+    """Версия списка карт текущего пользователя."""
+
+    return f'wallet-{request.user.pk}', get_wallet_version(request.user.pk)
+
+
+def catalog_version(request):
+    """Версия каталога магазинов и категорий."""
+
+    return 'catalog', get_catalog_version()
+
+
+def conditional_get(version_func):
+    """Поддержка ETag для GET-запросов вьюсета.
+
+    ETag строится из счётчика версии в кэше, поэтому ответ 304
+    отдается без выборки и сериализации записей из базы.
+    Last-Modified не отдается: у него точность в секунду, и после двух
+    изменений за одну секунду If-Modified-Since дал бы устаревший 304.
+    """
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return method(self, request, *args, **kwargs)
+
+            prefix, version = version_func(request)
+            url_digest = hashlib.md5(
+                request.get_full_path().encode()
+            ).hexdigest()[:12]
+            etag = quote_etag(f'{prefix}-{version}-{url_digest}')
+
+            response = get_conditional_response(request._request, etag=etag)
+            if response is None:
+                response = method(self, request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response['ETag'] = etag
+            return response
+
+        return wrapper
+
+    return decorator
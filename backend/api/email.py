@@ -1,12 +1,40 @@
+import copy
+
 from djoser import utils
 from djoser.conf import settings
 from djoser.email import ActivationEmail, PasswordResetEmail
 from templated_mail.mail import BaseEmailMessage
 
+from core.outbox import enqueue_emails
 from users.tokens import custom_token_generator
 
 
-class CustomActivationEmail(ActivationEmail):
+class OutboxMixin:
+    """Ставит письмо в очередь вместо отправки во время запроса."""
+
+    def send(self, to, *args, **kwargs):
+        self.render()
+        self.to = to
+        self.from_email = kwargs.pop('from_email', self.from_email)
+        enqueue_emails((self,))
+
+    def send_each(self, recipients, from_email=None):
+        """Ставит в очередь по отдельному письму каждому получателю.
+
+        Письмо рендерится один раз и попадает в очередь одним запросом.
+        """
+
+        self.render()
+        self.from_email = from_email or self.from_email
+        messages = []
+        for recipient in recipients:
+            message = copy.copy(self)
+            message.to = [recipient]
+            messages.append(message)
+        enqueue_emails(messages)
+
+
+class CustomActivationEmail(OutboxMixin, ActivationEmail):
     template_name = 'email/custom_activation.html'
 
     def get_context_data(self):
@@ -19,7 +47,7 @@ class CustomActivationEmail(ActivationEmail):
         return context
 
 
-class InvitationEmail(BaseEmailMessage):
+class InvitationEmail(OutboxMixin, BaseEmailMessage):
     template_name = "email/invitation.html"
 
     def get_context_data(self):
@@ -27,5 +55,5 @@ class InvitationEmail(BaseEmailMessage):
         return context
 
 
-class CustomPasswordResetEmail(PasswordResetEmail):
+class CustomPasswordResetEmail(OutboxMixin, PasswordResetEmail):
     template_name = "email/custom_password_reset.html"
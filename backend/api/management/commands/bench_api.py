@@ -0,0 +1,677 @@
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import (
+    CaptureQueriesContext,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from django.urls import reverse
+from djoser.utils import encode_uid
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.consts import EAN_13
+from core.dataset import DATASET_PASSWORD, seed_dataset
+from core.models import Card, Group, Shop, UserCards
+from users.authentication import token_cache
+from users.models import User
+from users.tokens import custom_token_generator
+
+
+BASELINE_PATH = os.path.join(
+    settings.BASE_DIR, 'benchmarks', 'api_baseline.json'
+)
+RUN_OPTIONS = (
+    'users',
+    'cards_per_user',
+    'shops',
+    'groups',
+    'share_ratio',
+    'seed',
+    'requests',
+    'warmup',
+)
+PERCENTILES = (50, 95, 99)
+LATENCY_METRICS = tuple(f'p{percent}_ms' for percent in PERCENTILES)
+# Хвосты на десятках запросов определяются единичными паузами машины,
+# поэтому для сравнения берется медиана, p95 и p99 только пишутся.
+GATED_LATENCY_METRICS = ('p50_ms',)
+BENCH_EMAIL = '{kind}{number}@bench.example.com'
+IMPORT_ROWS = 5
+
+
+def percentile(values, percent):
+    """Значение по методу ближайшего ранга."""
+
+    values = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def summarize(timings, queries, sizes, errors):
+    summary = {'requests': len(timings), 'errors': errors}
+    for percent, metric in zip(PERCENTILES, LATENCY_METRICS):
+        summary[metric] = round(percentile(timings, percent) * 1000, 3)
+    summary['queries'] = max(queries)
+    summary['bytes'] = max(sizes)
+    return summary
+
+
+class Command(BaseCommand):
+    """Команда для замера API на синтетических данных.
+
+    Данные создаются во временной тестовой базе, все действия
+    вьюсетов выполняются в процессе через тестовый клиент с
+    авторизацией по токену. Кэши работают как в продакшене, поэтому
+    повторные GET отдаются из них. Результат сравнивается с базовым
+    файлом; базовые задержки имеют смысл только для той же машины.
+    """
+
+    help = (
+        'Seed a synthetic dataset, drive every API action through the test '
+        'client and compare latency, queries and response size with the '
+        'baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--cards-per-user', type=int, default=20)
+        parser.add_argument('--shops', type=int, default=100)
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--share-ratio', type=float, default=0.2)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=30,
+            help='Number of requests per action',
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=3,
+            help='Number of unmeasured requests per action',
+        )
+        parser.add_argument(
+            '--output',
+            default='bench_api.json',
+            help='File for the results',
+        )
+        parser.add_argument(
+            '--baseline',
+            default=BASELINE_PATH,
+            help='Baseline file to compare with',
+        )
+        parser.add_argument(
+            '--update-baseline',
+            action='store_true',
+            help='Write the results to the baseline file',
+        )
+        parser.add_argument(
+            '--latency-tolerance',
+            type=float,
+            default=0.5,
+            help='Allowed relative latency growth',
+        )
+        parser.add_argument(
+            '--latency-floor',
+            type=float,
+            default=10.0,
+            help='Latency growth in ms that is never a regression',
+        )
+        parser.add_argument(
+            '--bytes-tolerance',
+            type=float,
+            default=0.1,
+            help='Allowed relative response size growth',
+        )
+        parser.add_argument(
+            '--query-tolerance',
+            type=int,
+            default=0,
+            help='Allowed number of extra queries',
+        )
+        parser.add_argument(
+            '--current-database',
+            action='store_true',
+            help=(
+                'Seed the current database in a transaction that is '
+                'rolled back'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['shops'] < 1:
+            raise CommandError('At least 2 users and 1 shop are required')
+        if options['requests'] < 1:
+            raise CommandError('At least 1 request per action is required')
+
+        with self.database(options['current_database']):
+            media_root = tempfile.mkdtemp()
+            try:
+                with override_settings(
+                    MEDIA_ROOT=media_root,
+                    BARCODE_CACHE_DIR=os.path.join(media_root, 'barcodes'),
+                    CATALOG_SNAPSHOT_ASYNC=False,
+                    THUMBNAILS_ASYNC=False,
+                    USAGE_BUFFER_ENABLED=False,
+                ):
+                    cache.clear()
+                    token_cache.clear()
+                    users = seed_dataset(
+                        options['users'],
+                        options['cards_per_user'],
+                        options['shops'],
+                        options['groups'],
+                        options['share_ratio'],
+                        options['seed'],
+                    )
+                    results = self.run_scenarios(
+                        users, options['requests'], options['warmup']
+                    )
+            finally:
+                shutil.rmtree(media_root, ignore_errors=True)
+
+        report = {
+            'options': {name: options[name] for name in RUN_OPTIONS},
+            'results': results,
+        }
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name}: p50 {result["p50_ms"]} ms, '
+                f'p95 {result["p95_ms"]} ms, p99 {result["p99_ms"]} ms, '
+                f'{result["queries"]} queries, {result["bytes"]} bytes'
+                + (f', {result["errors"]} errors' if result['errors'] else '')
+            )
+        self.write_report(report, options['output'])
+        if options['update_baseline']:
+            self.write_report(report, options['baseline'])
+            return
+        self.compare(report, options)
+
+    @contextmanager
+    def database(self, current):
+        """Временная тестовая база, удаляемая после замера.
+
+        В текущей базе замер идет в транзакции, которая откатывается;
+        обработчики on_commit при этом не вызываются.
+        """
+
+        if current:
+            with transaction.atomic():
+                yield
+                transaction.set_rollback(True)
+            return
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def write_report(self, report, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as report_file:
+            json.dump(report, report_file, indent=2, sort_keys=True)
+            report_file.write('\n')
+        self.stdout.write(f'Results written to {path}')
+
+    def compare(self, report, options):
+        """Сравнивает результаты с базовыми, при регрессии - ошибка."""
+
+        try:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+        except FileNotFoundError:
+            self.stdout.write(f'No baseline at {options["baseline"]}')
+            return
+        if baseline['options'] != report['options']:
+            self.stdout.write(
+                'Baseline options differ from this run, comparison skipped'
+            )
+            return
+
+        regressions = []
+        for name, result in report['results'].items():
+            if name not in baseline['results']:
+                self.stdout.write(f'{name}: not in the baseline')
+                continue
+            regressions.extend(
+                f'{name}: {message}'
+                for message in self.regressions(
+                    result, baseline['results'][name], options
+                )
+            )
+        if regressions:
+            raise CommandError(
+                f'{len(regressions)} regressions against the baseline:\n'
+                + '\n'.join(regressions)
+            )
+        self.stdout.write('No regressions against the baseline')
+
+    def regressions(self, result, base, options):
+        """Описания показателей, вышедших за допуски."""
+
+        for metric in GATED_LATENCY_METRICS:
+            limit = max(
+                base[metric] * (1 + options['latency_tolerance']),
+                base[metric] + options['latency_floor'],
+            )
+            if result[metric] > limit:
+                yield f'{metric} {result[metric]} > {limit:.3f}'
+        limit = base['queries'] + options['query_tolerance']
+        if result['queries'] > limit:
+            yield f'queries {result["queries"]} > {limit}'
+        limit = base['bytes'] * (1 + options['bytes_tolerance'])
+        if result['bytes'] > limit:
+            yield f'bytes {result["bytes"]} > {limit:.0f}'
+        if result['errors'] > base['errors']:
+            yield f'errors {result["errors"]} > {base["errors"]}'
+
+    def run_scenarios(self, users, count, warmup=0):
+        """Выполняет каждое действие count раз, возвращает сводку.
+
+        Первые warmup запросов прогревают кэши и не учитываются.
+        """
+
+        user = users.filter(is_active=True, cards__owner=True).first()
+        if user is None:
+            raise CommandError('The dataset has no active user with cards')
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}'
+        )
+        results = {}
+        for name, method, build in self.scenarios(
+            user, users.exclude(pk=user.pk)[:3]
+        ):
+            timings, queries, sizes, errors = [], [], [], 0
+            for number in range(warmup + count):
+                request = build(number)
+                request_client = request.get('client', client)
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = getattr(request_client, method)(
+                        request['url'],
+                        request.get('data'),
+                        format=request.get(
+                            'format', None if method == 'get' else 'json'
+                        ),
+                    )
+                    content = (
+                        b''.join(response.streaming_content)
+                        if response.streaming else response.content
+                    )
+                    elapsed = time.perf_counter() - started
+                if number < warmup:
+                    continue
+                timings.append(elapsed)
+                queries.append(len(captured))
+                sizes.append(len(content))
+                if response.status_code >= 400:
+                    errors += 1
+            results[f'{name} {method.upper()}'] = summarize(
+                timings, queries, sizes, errors
+            )
+        return results
+
+    def scenarios(self, user, friends):
+        """(маршрут, метод, построитель запроса по номеру повтора).
+
+        Подготовка данных для запроса идет в построителе и в замер
+        не попадает.
+        """
+
+        cards = list(
+            UserCards.objects.filter(user=user, owner=True)
+            .order_by('card_id')
+            .values_list('card_id', flat=True)
+        )
+        shops = list(
+            Shop.objects.filter(validation=True).values_list('pk', flat=True)
+        )
+        groups = list(Group.objects.values_list('pk', flat=True))
+        shop_names = list(
+            Shop.objects.order_by('pk').values_list('name', flat=True)[
+                :IMPORT_ROWS
+            ]
+        )
+        own_shop = Shop.objects.create(name='Bench Own Shop')
+        UserCards.objects.create(
+            user=user,
+            card=Card.objects.create(name='Bench Own Card', shop=own_shop),
+        )
+        inactive_client = APIClient()
+        inactive_client.force_authenticate(User.objects.create_user(
+            email=BENCH_EMAIL.format(kind='inactive', number=0),
+            password=DATASET_PASSWORD,
+        ))
+        guest_client = APIClient()
+
+        def url(name, **kwargs):
+            return reverse(f'api:{name}', kwargs=kwargs)
+
+        def card(number):
+            return cards[number % len(cards)]
+
+        def card_data(number):
+            return {
+                'name': f'Bench Card {number}',
+                'shop': shops[number % len(shops)] if shops else own_shop.pk,
+                'card_number': str(number),
+                'barcode_number': '4006381333931',
+                'encoding_type': EAN_13,
+            }
+
+        def favorite(number, favourite):
+            UserCards.objects.filter(user=user, card_id=card(number)).update(
+                favourite=not favourite
+            )
+            return {'url': url('card-favorite', pk=card(number))}
+
+        def import_file(number):
+            rows = '\n'.join(
+                f'Imported {number}-{row},{name},{number}{row},,,'
+                for row, name in enumerate(shop_names)
+            )
+            return {
+                'url': url('card-import'),
+                'data': {'file': SimpleUploadedFile(
+                    'cards.csv',
+                    ('name,shop,card_number,barcode_number,encoding_type,'
+                     f'favourite\n{rows}\n').encode(),
+                )},
+                'format': 'multipart',
+            }
+
+        def card_to_delete(number):
+            new_card = Card.objects.create(
+                name=f'Bench Deleted {number}', shop=own_shop
+            )
+            UserCards.objects.create(user=user, card=new_card)
+            return {'url': url('card-detail', pk=new_card.pk)}
+
+        def activation(number):
+            new_user = User.objects.create_user(
+                email=BENCH_EMAIL.format(kind='activation', number=number),
+                password=DATASET_PASSWORD,
+            )
+            activation_client = APIClient()
+            activation_client.force_authenticate(new_user)
+            return {
+                'url': url('user-activation'),
+                'data': {
+                    'uid': encode_uid(new_user.pk),
+                    'token': custom_token_generator.make_token(new_user),
+                },
+                'client': activation_client,
+            }
+
+        def password_reset_confirm(number):
+            user.refresh_from_db()
+            return {
+                'url': url('user-reset-password-confirm'),
+                'data': {
+                    'uid': encode_uid(user.pk),
+                    'token': default_token_generator.make_token(user),
+                    'new_password': DATASET_PASSWORD,
+                },
+                'client': guest_client,
+            }
+
+        return (
+            ('card-list', 'get', lambda number: {'url': url('card-list')}),
+            (
+                'card-favorites',
+                'get',
+                lambda number: {'url': url('card-favorites')},
+            ),
+            ('card-sync', 'get', lambda number: {'url': url('card-sync')}),
+            (
+                'card-export',
+                'get',
+                lambda number: {'url': url('card-export')},
+            ),
+            (
+                'card-barcodes',
+                'get',
+                lambda number: {
+                    'url': url('card-barcodes'),
+                    'data': {'file_format': 'svg'},
+                },
+            ),
+            (
+                'card-detail',
+                'get',
+                lambda number: {'url': url('card-detail', pk=card(number))},
+            ),
+            (
+                'card-barcode',
+                'get',
+                lambda number: {'url': url(
+                    'card-barcode', pk=card(number), file_format='svg'
+                )},
+            ),
+            (
+                'card-detail',
+                'put',
+                lambda number: {
+                    'url': url('card-detail', pk=card(number)),
+                    'data': card_data(number),
+                },
+            ),
+            (
+                'card-detail',
+                'patch',
+                lambda number: {
+                    'url': url('card-detail', pk=card(number)),
+                    'data': {'card_number': f'{number}0'},
+                },
+            ),
+            ('card-favorite', 'post', lambda number: favorite(number, True)),
+            (
+                'card-favorite',
+                'delete',
+                lambda number: favorite(number, False),
+            ),
+            (
+                'card-statistics',
+                'patch',
+                lambda number: {
+                    'url': url('card-statistics', pk=card(number)),
+                    'data': {'usage_counter': 1000 + number},
+                },
+            ),
+            (
+                'card-bulk-statistics',
+                'patch',
+                lambda number: {
+                    'url': url('card-bulk-statistics'),
+                    'data': {
+                        card(number + shift): 2000 + number
+                        for shift in range(5)
+                    },
+                },
+            ),
+            (
+                'card-share',
+                'post',
+                lambda number: {
+                    'url': url('card-share', pk=card(number)),
+                    'data': {
+                        'email': BENCH_EMAIL.format(
+                            kind='invite', number=number
+                        ),
+                    },
+                },
+            ),
+            (
+                'card-share-bulk',
+                'post',
+                lambda number: {
+                    'url': url('card-share-bulk', pk=card(number)),
+                    'data': {'emails': [
+                        *(friend.email for friend in friends),
+                        BENCH_EMAIL.format(kind='invite', number=number),
+                    ]},
+                },
+            ),
+            (
+                'card-list',
+                'post',
+                lambda number: {
+                    'url': url('card-list'), 'data': card_data(number)
+                },
+            ),
+            (
+                'card-create-with-new-shop',
+                'post',
+                lambda number: {
+                    'url': url('card-create-with-new-shop'),
+                    'data': {
+                        'name': f'Bench Card {number}',
+                        'shop': {'name': f'Bench Shop {number}'},
+                        'card_number': str(number),
+                    },
+                },
+            ),
+            ('card-import', 'post', import_file),
+            ('card-detail', 'delete', card_to_delete),
+            ('shop-list', 'get', lambda number: {'url': url('shop-list')}),
+            (
+                'shop-detail',
+                'get',
+                lambda number: {
+                    'url': url('shop-detail', pk=shops[number % len(shops)])
+                    if shops else url('shop-list'),
+                },
+            ),
+            (
+                'shop-autocomplete',
+                'get',
+                lambda number: {
+                    'url': url('shop-autocomplete'),
+                    'data': {'q': 'shop'},
+                },
+            ),
+            (
+                'shop-detail',
+                'patch',
+                lambda number: {
+                    'url': url('shop-detail', pk=own_shop.pk),
+                    'data': {'name': f'Bench Own Shop {number}'},
+                },
+            ),
+            ('group-list', 'get', lambda number: {'url': url('group-list')}),
+            (
+                'group-detail',
+                'get',
+                lambda number: {
+                    'url': url('group-detail', pk=groups[number % len(groups)])
+                    if groups else url('group-list'),
+                },
+            ),
+            ('user-list', 'get', lambda number: {'url': url('user-list')}),
+            (
+                'user-detail',
+                'get',
+                lambda number: {'url': url('user-detail', id=user.pk)},
+            ),
+            (
+                'user-detail',
+                'patch',
+                lambda number: {
+                    'url': url('user-detail', id=user.pk),
+                    'data': {'name': 'Bench'},
+                },
+            ),
+            ('user-me', 'get', lambda number: {'url': url('user-me')}),
+            (
+                'user-me',
+                'patch',
+                lambda number: {
+                    'url': url('user-me'), 'data': {'name': 'Bench'}
+                },
+            ),
+            (
+                'user-list',
+                'post',
+                lambda number: {
+                    'url': url('user-list'),
+                    'data': {
+                        'email': BENCH_EMAIL.format(
+                            kind='signup', number=number
+                        ),
+                        'name': 'Bench',
+                        'password': DATASET_PASSWORD,
+                        'phone_number': '9123456789',
+                    },
+                    'client': guest_client,
+                },
+            ),
+            (
+                'user-pre-check-users',
+                'post',
+                lambda number: {
+                    'url': url('user-pre-check-users'),
+                    'data': {
+                        'email': BENCH_EMAIL.format(
+                            kind='precheck', number=number
+                        ),
+                        'password': DATASET_PASSWORD,
+                    },
+                    'client': guest_client,
+                },
+            ),
+            ('user-activation', 'post', activation),
+            (
+                'user-resend-activation',
+                'post',
+                lambda number: {
+                    'url': url('user-resend-activation'),
+                    'client': inactive_client,
+                },
+            ),
+            (
+                'user-reset-password',
+                'post',
+                lambda number: {
+                    'url': url('user-reset-password'),
+                    'data': {
+                        'email': user.email,
+                        'phone_last_digits': user.phone_number[-4:],
+                    },
+                    'client': guest_client,
+                },
+            ),
+            ('user-reset-password-confirm', 'post', password_reset_confirm),
+            (
+                'user-set-password',
+                'post',
+                lambda number: {
+                    'url': url('user-set-password'),
+                    'data': {
+                        'new_password': DATASET_PASSWORD,
+                        'current_password': DATASET_PASSWORD,
+                    },
+                },
+            ),
+        )
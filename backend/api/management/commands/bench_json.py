@@ -0,0 +1,73 @@
+import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from api.renderers import FastJSONRenderer, orjson
+from api.serializers import CardsListSerializer, ShopSerializer
+from core.models import Shop, UserCards
+
+
+class Command(BaseCommand):
+    """Команда для сравнения стандартного и быстрого кодирования JSON."""
+
+    help = (
+        'Render card lists and the shop catalog with both JSON renderers, '
+        'check that the output is identical and compare timings'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=1000,
+            help='Number of user cards to render',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Number of renders per renderer',
+        )
+
+    def payloads(self, limit):
+        request = APIRequestFactory().get('/api/cards/')
+        context = {'request': request}
+        cards = (
+            UserCards.objects.select_related('card', 'card__shop')
+            .prefetch_related('card__shop__group')[:limit]
+        )
+        return {
+            'cards': CardsListSerializer(
+                cards, many=True, context=context
+            ).data,
+            'shops': ShopSerializer(
+                Shop.objects.prefetch_related('group'),
+                many=True,
+                context=context,
+            ).data,
+        }
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stdout.write(
+                'orjson is not installed, FastJSONRenderer falls back to json'
+            )
+        standard, fast = JSONRenderer(), FastJSONRenderer()
+        for name, data in self.payloads(options['limit']).items():
+            expected = standard.render(data)
+            if fast.render(data) != expected:
+                raise CommandError(f'{name}: renderers output differs')
+            times = [
+                timeit.timeit(
+                    lambda: renderer.render(data), number=options['repeat']
+                ) / options['repeat']
+                for renderer in (standard, fast)
+            ]
+            self.stdout.write(
+                f'{name}: {len(data)} items, {len(expected)} bytes, '
+                f'json {times[0] * 1000:.2f} ms, '
+                f'fast {times[1] * 1000:.2f} ms, '
+                f'x{times[0] / max(times[1], 1e-9):.1f}'
+            )
@@ -0,0 +1,278 @@
+"""Диагностика запросов: метрики, поиск N+1 и профилирование.
+
+Запросы к базе запоминаются вместе с местом вызова в коде проекта и
+временем выполнения и сводятся к «форме» без значений параметров.
+Форма, повторенная за один HTTP-запрос не меньше N_PLUS_ONE_THRESHOLD
+раз, попадает в лог. Запрос сотрудника с заголовком
+REQUEST_PROFILE_HEADER выполняется под cProfile, профиль сохраняется
+и доступен в админке. Время каждого запроса и его обращения к базе
+попадают в метрики Prometheus по действию вьюсета.
+"""
+
+import cProfile
+import logging
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.exceptions import AuthenticationFailed
+
+from core.metrics import db_queries, db_query_time, request_latency
+from core.profiling import save_profile
+from users.authentication import CustomTokenAuthentication
+
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+SQL_PATTERNS = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+)
+
+
+def fingerprint(sql):
+    """Форма запроса: литералы и списки параметров заменены на ?."""
+
+    for pattern, replacement in SQL_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def call_site():
+    """Ближайший к запросу кадр стека из кода проекта."""
+
+    base_dir = str(settings.BASE_DIR)
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if (
+            filename.startswith(base_dir)
+            and filename != __file__
+            and 'site-packages' not in filename
+        ):
+            return (
+                f'{os.path.relpath(filename, base_dir)}:{frame.f_lineno} '
+                f'in {frame.f_code.co_name}'
+            )
+        frame = frame.f_back
+    return 'unknown'
+
+
+class QueryRecorder:
+    """Записывает запросы ко всем базам внутри блока with."""
+
+    def __init__(self):
+        self.queries = []
+        self.durations = []
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        site = call_site()
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, site))
+            self.durations.append(time.perf_counter() - started)
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __len__(self):
+        return len(self.queries)
+
+    def timed(self):
+        """[(sql, место вызова, секунды)] в порядке выполнения."""
+
+        return [
+            (sql, site, seconds)
+            for (sql, site), seconds in zip(self.queries, self.durations)
+        ]
+
+    def repeated(self, threshold):
+        """[(форма, число повторов, места вызова)] от частых к редким."""
+
+        shapes = defaultdict(list)
+        for sql, site in self.queries:
+            shapes[fingerprint(sql)].append(site)
+        return sorted(
+            (
+                (shape, len(sites), sorted(set(sites)))
+                for shape, sites in shapes.items()
+                if len(sites) >= threshold
+            ),
+            key=lambda item: -item[1],
+        )
+
+
+class QueryInspectorMiddleware:
+    """Пишет в лог повторяющиеся формы запросов для каждого запроса.
+
+    Включается настройкой N_PLUS_ONE_DETECTION, в продакшене
+    отключается при загрузке и ничего не стоит.
+    """
+
+    def __init__(self, get_response):
+        if not settings.N_PLUS_ONE_DETECTION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        for shape, count, sites in recorder.repeated(
+                settings.N_PLUS_ONE_THRESHOLD
+        ):
+            logger.warning(
+                'Repeated query %dx on %s %s: %s\n  from %s',
+                count, request.method, request.path, shape,
+                '\n  from '.join(sites),
+            )
+        return response
+
+
+def staff_user(request):
+    """Сотрудник из сессии или токена запроса, иначе None."""
+
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated and user.is_staff:
+        return user
+    try:
+        result = CustomTokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    if result is not None and result[0].is_active and result[0].is_staff:
+        return result[0]
+    return None
+
+
+class RequestProfilerMiddleware:
+    """Профилирует запросы сотрудников с заголовком профилирования.
+
+    Без заголовка REQUEST_PROFILE_HEADER запрос проходит без
+    изменений. С ним и токеном или сессией сотрудника запрос
+    выполняется под cProfile с записью всех запросов к базе, а id
+    сохраненного профиля возвращается в заголовке X-Profile-Id. Для
+    потоковых ответов профиль покрывает только построение ответа.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if settings.REQUEST_PROFILE_HEADER not in request.headers:
+            return self.get_response(request)
+        user = staff_user(request)
+        if user is None:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as error:
+            logger.warning('Request profiling is unavailable: %s', error)
+            return self.get_response(request)
+        try:
+            with QueryRecorder() as recorder:
+                started = time.perf_counter()
+                response = self.get_response(request)
+                duration = time.perf_counter() - started
+        finally:
+            profiler.disable()
+
+        profile = save_profile(
+            profiler, recorder.timed(), request, response, user, duration
+        )
+        response[PROFILE_ID_HEADER] = str(profile.pk)
+        return response
+
+
+def view_label(request):
+    """Вьюсет и действие запроса, например CardViewSet.list."""
+
+    match = request.resolver_match
+    if match is None:
+        return 'unmatched'
+    view_class = getattr(match.func, 'cls', None)
+    if view_class is None:
+        return match.view_name
+    actions = getattr(match.func, 'actions', None)
+    if actions:
+        method = request.method.lower()
+        return f'{view_class.__name__}.{actions.get(method, method)}'
+    return view_class.__name__
+
+
+class QueryCounter:
+    """Число и суммарное время запросов ко всем базам в блоке with."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+
+class MetricsMiddleware:
+    """Записывает время запроса и обращения к базе в метрики.
+
+    Стоит первым, чтобы время включало остальные middleware. Для
+    потоковых ответов учитывается только построение ответа.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryCounter() as queries:
+            started = time.perf_counter()
+            response = self.get_response(request)
+            duration = time.perf_counter() - started
+        view = view_label(request)
+        request_latency.observe(
+            duration,
+            view=view,
+            method=request.method,
+            status=response.status_code,
+        )
+        if queries.count:
+            db_queries.inc(queries.count, view=view)
+            db_query_time.inc(queries.seconds, view=view)
+        return response
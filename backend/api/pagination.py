@@ -0,0 +1,125 @@
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+from core.consts import WALLET_MAX_PAGE_SIZE, WALLET_PAGE_SIZE
+
+
+class WalletCursorPagination(CursorPagination):
+    """Курсорная пагинация списка карт по ключу (pub_date, id).
+
+    Позиция курсора содержит обе части ключа, поэтому она уникальна:
+    смещение (offset) не используется, страница всегда выбирается
+    по индексу, а появление новых карт не сдвигает уже выданные курсоры.
+    """
+
+    ordering = ('-pub_date', '-id')
+    page_size = WALLET_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = WALLET_MAX_PAGE_SIZE
+    position_separator = '|'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            reverse, current_position = False, None
+        else:
+            reverse, current_position = (
+                self.cursor.reverse, self.cursor.position
+            )
+
+        if reverse:
+            queryset = queryset.order_by(
+                *(order.lstrip('-') for order in self.ordering)
+            )
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            queryset = self.filter_by_position(
+                queryset, current_position, reverse
+            )
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+
+        following_position = None
+        has_following_position = len(results) > len(self.page)
+        if has_following_position:
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering
+            )
+        self.set_page_positions(
+            reverse,
+            current_position,
+            has_following_position,
+            following_position,
+        )
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def filter_by_position(self, queryset, position, reverse):
+        """Оставляет записи строго после позиции в порядке обхода."""
+
+        pub_date, pk = self.decode_position(position)
+        lookup = 'gt' if reverse else 'lt'
+        return queryset.filter(
+            Q(**{f'pub_date__{lookup}': pub_date})
+            | Q(pub_date=pub_date, **{f'id__{lookup}': pk})
+        )
+
+    def set_page_positions(
+            self,
+            reverse,
+            current_position,
+            has_following_position,
+            following_position,
+    ):
+        """Определяет позиции для ссылок на соседние страницы."""
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = current_position is not None
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+    def decode_position(self, position):
+        """Разбирает позицию курсора на дату добавления и id."""
+
+        try:
+            pub_date, pk = position.rsplit(self.position_separator, 1)
+            pub_date = parse_datetime(pub_date)
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if pub_date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return pub_date, pk
+
+    def _get_position_from_instance(self, instance, ordering):
+        if isinstance(instance, dict):
+            pub_date, pk = instance['pub_date'], instance['id']
+        else:
+            pub_date, pk = instance.pub_date, instance.pk
+        return f'{pub_date.isoformat()}{self.position_separator}{pk}'
@@ -1,39 +1,50 @@
-from django.shortcuts import get_object_or_404
 from django.utils.encoding import force_str
 from django.utils.http import urlsafe_base64_decode
 from rest_framework import permissions, serializers
 
 from core.consts import ErrorMessage
-from core.models import Card, UserCards
+from core.models import UserCards
+from core.shops import is_shop_creator
 
 
 class IsCardsUser(permissions.BasePermission):
-    """Разрешения: объект можно читать, редактировать может только автор."""
+    """Разрешения: объект можно читать, редактировать может только автор.
+
+    Если карта выбрана с пометкой is_owner, как во вьюсете карт,
+    проверка обходится без запросов к базе.
+    """
 
     def has_permission(self, request, view):
         return request.user.is_authenticated
 
     def has_object_permission(self, request, view, obj):
-        user = request.user
+        if not hasattr(obj, 'is_owner'):
+            obj.is_owner = (
+                UserCards.objects.filter(user=request.user, card=obj)
+                .values_list('owner', flat=True)
+                .first()
+            )
+        if obj.is_owner is None:
+            return False
         if request.method == 'PATCH':
-            user_card = get_object_or_404(UserCards, user=user, card=obj)
-            return user_card.owner
-        return UserCards.objects.filter(user=user, card=obj).exists
+            return obj.is_owner
+        return True
 
 
 class IsShopCreatorOrReadOnly(permissions.IsAuthenticated):
-    """Разрешения: магазины можно читать, редактировать может только автор."""
+    """Разрешения: магазины можно читать, редактировать может только автор.
+
+    Магазин, к которому привязаны карты других владельцев,
+    не редактируется никем из них.
+    """
 
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return True
         if request.method == 'PATCH':
-            user = request.user
-            card = Card.objects.get(shop=obj)
-            user_card = get_object_or_404(UserCards, user=user, card=card)
             return (
-                user_card.owner
-                and not obj.validation
+                not obj.validation
+                and is_shop_creator(obj, request.user)
             )
         return False
 
@@ -0,0 +1,66 @@
+"""Быстрое кодирование ответов API в JSON.
+
+Если установлен orjson, ответы кодируются им, иначе - стандартным
+рендерером DRF. Результат побайтно совпадает с выводом JSONRenderer
+при настройках DRF по умолчанию: компактные разделители, символы
+вне ASCII без экранирования, даты в формате ECMA 262. Единственное
+отличие: NaN и бесконечность кодируются как null, а не ошибкой.
+"""
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    # Даты передаются кодировщику DRF: orjson пишет UTC как +00:00.
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+_encoder = JSONEncoder()
+
+
+def dumps(data):
+    """Кодирует данные в компактный JSON, как JSONRenderer."""
+
+    if orjson is None:
+        return JSONRenderer().render(data)
+    try:
+        content = orjson.dumps(
+            data, default=_encoder.default, option=ORJSON_OPTIONS
+        )
+    except orjson.JSONEncodeError:
+        # Целые длиннее 64 бит и другие случаи, которых нет в orjson.
+        return JSONRenderer().render(data)
+    if b'\xe2\x80' in content:
+        content = content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(
+            b'\xe2\x80\xa9', b'\\u2029'
+        )
+    return content
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer на orjson с откатом на стандартный json.
+
+    Отступы по запросу клиента и нестандартные настройки DRF
+    обрабатываются родительским классом.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or not self.compact
+            or self.ensure_ascii
+            or not self.strict
+            or self.encoder_class is not JSONEncoder
+            or self.get_indent(accepted_media_type, renderer_context or {})
+        ):
+            return super().render(
+                data, accepted_media_type, renderer_context
+            )
+        return dumps(data)
@@ -1,7 +1,9 @@
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import NumericPasswordValidator
+from django.core import signing
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
+from django.urls import reverse
 from djoser import utils
 from djoser.conf import settings
 from djoser.serializers import (
@@ -10,15 +12,28 @@ from djoser.serializers import (
     UserCreateSerializer,
     UserSerializer,
 )
-from rest_framework import serializers
+from rest_framework import exceptions, serializers
 
+from core.barcodes import BARCODE_FORMATS, barcode_digest
 from core.consts import (
+    AUTOCOMPLETE_LIMIT,
+    BARCODE_SCALE,
     FIELD_MASK_WITH_DIGITS,
+    IMPORT_CSV,
+    IMPORT_FORMATS,
+    MAX_AUTOCOMPLETE_LIMIT,
+    MAX_BARCODE_SCALE,
+    MAX_BULK_STATISTICS_CARDS,
     MAX_LENGTH_SHOP_NAME,
     MAX_NUM_CARD_USE_BY_USER,
+    MAX_SHARE_RECIPIENTS,
     ErrorMessage,
 )
+from core.images import ImageError, normalize_upload, thumbnail_urls
+from core.importer import guess_import_format
 from core.models import Card, Group, Shop, UserCards
+from core.shops import is_shop_creator, match_shop
+from core.sync import parse_sync_token
 from users.consts import MIN_PASSWORD_LENGTH
 from users.models import User
 from users.passwordvalidators import (
@@ -45,10 +60,11 @@ class ShopSerializer(serializers.ModelSerializer):
 
     group = GroupSerializer(many=True)
     logo = serializers.SerializerMethodField(read_only=True)
+    logo_thumbnails = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Shop
-        fields = '__all__'
+        exclude = ('normalized_name',)
 
     def get_logo(self, obj):
         """Возвращает относительный путь изображения."""
@@ -57,12 +73,19 @@ class ShopSerializer(serializers.ModelSerializer):
             return obj.logo.url
         return None
 
+    def get_logo_thumbnails(self, obj):
+        """Пути уменьшенных копий логотипа по размерам и форматам."""
+
+        return thumbnail_urls(obj.logo)
+
 
 class CardSerializer(serializers.ModelSerializer):
     """Сериализатор отображения карт."""
 
     shop = ShopSerializer()
     image = serializers.SerializerMethodField(read_only=True)
+    image_thumbnails = serializers.SerializerMethodField(read_only=True)
+    barcode = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Card
@@ -75,6 +98,25 @@ class CardSerializer(serializers.ModelSerializer):
             return obj.image.url
         return None
 
+    def get_image_thumbnails(self, obj):
+        """Пути уменьшенных копий изображения по размерам и форматам."""
+
+        return thumbnail_urls(obj.image)
+
+    def get_barcode(self, obj):
+        """Относительный путь SVG штрих-кода с хэшем содержимого.
+
+        По хэшу в параметре v ответ кэшируется клиентом бессрочно.
+        """
+
+        if not obj.barcode_number:
+            return None
+        url = reverse(
+            'api:card-barcode', kwargs={'pk': obj.pk, 'file_format': 'svg'}
+        )
+        digest = barcode_digest(obj.encoding_type, obj.barcode_number)
+        return f'{url}?v={digest}'
+
 
 class CardEditSerializer(serializers.ModelSerializer):
     """Сериализатор редактирования карты."""
@@ -89,6 +131,14 @@ class CardEditSerializer(serializers.ModelSerializer):
         model = Card
         exclude = ('users',)
 
+    def validate_image(self, value):
+        """Фото поворачивается, уменьшается и очищается от EXIF."""
+
+        try:
+            return normalize_upload(value)
+        except ImageError:
+            raise serializers.ValidationError(ErrorMessage.INCORRECT_IMAGE)
+
     def validate(self, data):
         """Проверка наличия номера карты и/или штрих-кода."""
 
@@ -147,17 +197,42 @@ class ShopCreateSerializer(serializers.ModelSerializer):
         return ShopSerializer(instance).data
 
 
+class ShopAutocompleteSerializer(serializers.Serializer):
+    """Параметры подсказок по названию магазина."""
+
+    q = serializers.CharField(max_length=MAX_LENGTH_SHOP_NAME)
+    limit = serializers.IntegerField(
+        min_value=1,
+        max_value=MAX_AUTOCOMPLETE_LIMIT,
+        default=AUTOCOMPLETE_LIMIT,
+    )
+
+
 class CardShopCreateSerializer(CardEditSerializer):
-    """Сериализатор для создания карты с новым магазином."""
+    """Сериализатор для создания карты с новым магазином.
+
+    Если магазин с тем же нормализованным названием уже есть, карта
+    привязывается к нему. Категории пользователя добавляются только
+    к непроверенному магазину, автор которого - сам пользователь;
+    у чужого или проверенного магазина они не меняются.
+    """
 
     shop = ShopCreateSerializer()
 
     def create(self, validated_data):
         shop_name = validated_data.pop('shop')
-        shop = Shop.objects.create(name=shop_name['name'])
-        if 'group' in shop_name:
-            groups = shop_name['group']
-            shop.group.set(groups)
+        groups = shop_name.get('group')
+        shop = match_shop(shop_name['name'])
+        if shop is None:
+            shop = Shop.objects.create(name=shop_name['name'])
+            if groups:
+                shop.group.set(groups)
+        elif (
+                groups
+                and not shop.validation
+                and is_shop_creator(shop, self.context['request'].user)
+        ):
+            shop.group.add(*groups)
         card = Card.objects.create(shop=shop, **validated_data)
         return card
 
@@ -171,6 +246,54 @@ class StatisticsSerializer(serializers.Serializer):
     )
 
 
+class BulkStatisticsSerializer(serializers.Serializer):
+    """Сериализатор пакетного обновления статистики {id карты: счётчик}."""
+
+    usage_counters = serializers.DictField(
+        child=serializers.IntegerField(
+            min_value=1,
+            max_value=MAX_NUM_CARD_USE_BY_USER
+        ),
+        allow_empty=False,
+    )
+
+    def to_internal_value(self, data):
+        return super().to_internal_value({'usage_counters': data})
+
+    def validate_usage_counters(self, value):
+        if len(value) > MAX_BULK_STATISTICS_CARDS:
+            raise serializers.ValidationError(ErrorMessage.TOO_MANY_CARDS)
+        try:
+            return {
+                int(card_id): counter for card_id, counter in value.items()
+            }
+        except ValueError:
+            raise serializers.ValidationError(ErrorMessage.INCORRECT_CARD_ID)
+
+
+class SyncQuerySerializer(serializers.Serializer):
+    """Параметры синхронизации списка карт."""
+
+    since = serializers.CharField(required=False)
+
+    def validate_since(self, value):
+        try:
+            return parse_sync_token(value)
+        except signing.BadSignature:
+            raise serializers.ValidationError(
+                ErrorMessage.INCORRECT_SYNC_TOKEN
+            )
+
+
+class WalletSyncSerializer(serializers.Serializer):
+    """Изменения списка карт с момента прошлой синхронизации."""
+
+    token = serializers.CharField()
+    full = serializers.BooleanField()
+    cards = CardsListSerializer(many=True)
+    deleted = serializers.ListField(child=serializers.IntegerField())
+
+
 class CustomUserCreateSerializer(UserCreateSerializer):
     """Сериализатор регистрации пользователей."""
 
@@ -203,6 +326,80 @@ class EmailSerializer(serializers.Serializer):
     email = serializers.EmailField()
 
 
+class BulkEmailSerializer(serializers.Serializer):
+    """Сериализатор списка получателей карты."""
+
+    emails = serializers.ListField(
+        child=serializers.EmailField(),
+        allow_empty=False,
+    )
+
+    def validate_emails(self, value):
+        emails = tuple(dict.fromkeys(value))
+        if len(emails) > MAX_SHARE_RECIPIENTS:
+            raise serializers.ValidationError(
+                ErrorMessage.TOO_MANY_RECIPIENTS
+            )
+        return emails
+
+
+class BarcodeSerializer(serializers.Serializer):
+    """Параметры отрисовки штрих-кода."""
+
+    scale = serializers.IntegerField(
+        min_value=1,
+        max_value=MAX_BARCODE_SCALE,
+        default=BARCODE_SCALE,
+    )
+    v = serializers.CharField(required=False)
+
+
+class BarcodeBatchSerializer(serializers.Serializer):
+    """Параметры пакетной отрисовки штрих-кодов списка карт."""
+
+    file_format = serializers.ChoiceField(
+        choices=BARCODE_FORMATS,
+        default='svg',
+    )
+    scale = serializers.IntegerField(
+        min_value=1,
+        max_value=MAX_BARCODE_SCALE,
+        default=BARCODE_SCALE,
+    )
+
+
+class CardImportSerializer(serializers.Serializer):
+    """Сериализатор файла импорта карт."""
+
+    file = serializers.FileField()
+    format = serializers.ChoiceField(choices=IMPORT_FORMATS, required=False)
+
+    def validate(self, data):
+        if 'format' not in data:
+            data['format'] = guess_import_format(data['file'].name)
+        return data
+
+
+class CardExportSerializer(serializers.Serializer):
+    """Параметры выгрузки списка карт."""
+
+    file_format = serializers.ChoiceField(
+        choices=IMPORT_FORMATS,
+        default=IMPORT_CSV,
+    )
+    user = serializers.PrimaryKeyRelatedField(
+        queryset=User.objects.all(),
+        required=False,
+    )
+
+    def to_internal_value(self, data):
+        # Проверка прав до поиска пользователя: иначе по разнице
+        # 400 и 403 можно перебирать существующие id.
+        if 'user' in data and not self.context['request'].user.is_staff:
+            raise exceptions.PermissionDenied()
+        return super().to_internal_value(data)
+
+
 class UserPreCheckSerializer(serializers.ModelSerializer):
     """Сериализатор для проверки почты и пароля."""
 
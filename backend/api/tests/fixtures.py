@@ -1,21 +1,29 @@
 import shutil
 import tempfile
+from io import StringIO
 
-from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import override_settings
 from django.urls import reverse
 from rest_framework.test import APIClient, APITestCase
 
 from core.models import Card, Group, Shop, UserCards
+from users.authentication import token_cache
 
 
-TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
 User = get_user_model()
 
 
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class APITests(APITestCase):
-    """Родительский класс с тестовыми данными и константами."""
+    """Родительский класс с тестовыми данными и константами.
+
+    Загрузки тестов пишутся во временный MEDIA_ROOT, а не в static/media.
+    """
 
     @classmethod
     def setUpClass(cls):
@@ -105,6 +113,8 @@ class APITests(APITestCase):
         cls.GROUP_LIST_URL = reverse('api:group-list')
 
     def setUp(self):
+        cache.clear()
+        token_cache.clear()
         self.guest_client = APIClient()
         self.auth_client = APIClient()
         self.inactive_auth_client = APIClient()
@@ -113,6 +123,12 @@ class APITests(APITestCase):
             user=self.unactivated_user
         )
 
+    @staticmethod
+    def send_outbox():
+        """Отправляет письма из очереди."""
+
+        call_command('send_outbox', stdout=StringIO())
+
     @classmethod
     def tearDownClass(cls):
         super().tearDownClass()
@@ -1,12 +1,119 @@
+import csv
+import fcntl
+import json
+import os
+import pstats
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core import mail
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from django.utils.translation import gettext_lazy
+from PIL import Image
 from rest_framework import status
 from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import (
+    AuthenticationFailed,
+    ErrorDetail,
+    ParseError,
+)
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient
 
-from core.models import Card, UserCards
-
+from backend.settings import env_bool
+from core import images
+from core.barcodes import (
+    BarcodeError,
+    barcode_digest,
+    code128_values,
+    ean_check_digit,
+    encode_barcode,
+    encode_ean13,
+    encode_upc_e,
+    upc_e_to_upc_a,
+)
+from core.cache import get_catalog_version, wallet_cache_stats
+from core.checks import check_shared_cache
+from core.consts import (
+    CODE39,
+    EAN_13,
+    MAX_SHARE_RECIPIENTS,
+    OUTBOX_FAILED,
+    OUTBOX_PENDING,
+    OUTBOX_SENT,
+    ErrorMessage,
+    QR_код,
+)
+from core.dataset import DATASET_EPOCH, DATASET_PASSWORD, copy_value
+from core.images import (
+    generate_thumbnails,
+    pool_context,
+    shutdown_executor,
+    thumbnail_name,
+)
+from core.importer import CardImporter
+from core.metrics import (
+    CONTENT_TYPE,
+    MetricsFile,
+    read_entries,
+    registry,
+    request_latency,
+)
+from core.models import (
+    Blob,
+    Card,
+    Group,
+    OutboxEmail,
+    RequestProfile,
+    Shop,
+    Tombstone,
+    UserCards,
+)
+from core.outbox import enqueue_emails, send_pending
+from core.profiling import artifact_path
+from core.qr import QRCodeError, encode_qr
+from core.shops import ShopIndex, match_shop
+from core.storage import BLOB_DIR, blob_storage
+from core.sync import make_sync_token
+from core.text import search_key
+from core.usage import UsageBuffer
+from users.authentication import CustomTokenAuthentication, token_cache
+
+from ..middleware import (
+    MetricsMiddleware,
+    QueryInspectorMiddleware,
+    QueryRecorder,
+    RequestProfilerMiddleware,
+    fingerprint,
+)
+from ..parsers import FastJSONParser
+from ..renderers import FastJSONRenderer
+from ..serializers import CardsListSerializer, GroupSerializer, ShopSerializer
+from ..wallet import serialize_wallet, wallet_rows
 from .fixtures import APIShopEditTests, APITests
 
 
@@ -70,7 +177,61 @@ class EndpointsTestCase(APITests):
 
         response = self.auth_client.get(self.CARDS_URL)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), self.CARDS_USER_HAVE)
+        self.assertEqual(len(response.data['results']), self.CARDS_USER_HAVE)
+
+    def collect_pages(self, url):
+        """Проходит по всем страницам списка и собирает id карт."""
+
+        cards_ids = []
+        while url:
+            response = self.auth_client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            cards_ids += [
+                user_card['card']['id']
+                for user_card in response.data['results']
+            ]
+            url = response.data['next']
+        return cards_ids
+
+    def test_cards_list_pagination(self):
+        """Курсорная пагинация выдает все карты без повторов."""
+
+        cards_ids = self.collect_pages(self.CARDS_URL + '?page_size=4')
+        self.assertEqual(len(cards_ids), self.CARDS_USER_HAVE)
+        self.assertEqual(len(set(cards_ids)), self.CARDS_USER_HAVE)
+        expected_ids = list(
+            UserCards.objects.filter(user=self.user)
+            .order_by('-pub_date', '-id')
+            .values_list('card_id', flat=True)
+        )
+        self.assertEqual(cards_ids, expected_ids)
+
+    def test_cards_list_cursor_stable_on_new_card(self):
+        """Новая карта не сдвигает уже выданный курсор."""
+
+        response = self.auth_client.get(self.CARDS_URL + '?page_size=4')
+        first_page = [
+            user_card['card']['id'] for user_card in response.data['results']
+        ]
+        next_url = response.data['next']
+        UserCards.objects.create(
+            user=self.user,
+            card=Card.objects.exclude(users=self.user).first(),
+        )
+        rest_ids = self.collect_pages(next_url)
+        self.assertEqual(
+            len(first_page) + len(rest_ids), self.CARDS_USER_HAVE
+        )
+        self.assertFalse(set(first_page) & set(rest_ids))
+
+    def test_cards_list_previous_page(self):
+        """Ссылка на предыдущую страницу возвращает ту же страницу."""
+
+        response = self.auth_client.get(self.CARDS_URL + '?page_size=4')
+        first_page = response.data['results']
+        response = self.auth_client.get(response.data['next'])
+        response = self.auth_client.get(response.data['previous'])
+        self.assertEqual(response.data['results'], first_page)
 
     def test_cards_list_fields(self):
         """Проверка полей в card-list."""
@@ -92,7 +253,7 @@ class EndpointsTestCase(APITests):
         expected_group_fields = [
             'id', 'name',
         ]
-        for card_data in response.data:
+        for card_data in response.data['results']:
             self.assertTrue(
                 all(field in card_data
                     for field in expected_fields))
@@ -301,7 +462,7 @@ class EndpointsTestCase(APITests):
             self.CARDS_URL + 'favorites/'
         )
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), self.CARDS_USER_FAV)
+        self.assertEqual(len(response.data['results']), self.CARDS_USER_FAV)
 
     def test_cards_favorite_add_remove(self):
         """Проверка добавления и удаления карты из избранного."""
@@ -330,13 +491,13 @@ class EndpointsTestCase(APITests):
         """Проверка выдачи списка проверенных магазинов гостю."""
 
         response = self.guest_client.get(reverse('api:shop-list'))
-        self.assertEqual(len(response.data), self.SHOPS_VERIFY)
+        self.assertEqual(len(response.json()), self.SHOPS_VERIFY)
 
     def test_group_list_accessibility_for_guest(self):
         """Проверка выдачи списка категорий гостю."""
 
         response = self.guest_client.get(reverse('api:group-list'))
-        self.assertEqual(len(response.data), self.GROUPS)
+        self.assertEqual(len(response.json()), self.GROUPS)
 
     def test_card_share(self):
         """Проверка возможности поделиться картой внутри приложения."""
@@ -395,6 +556,9 @@ class EndpointsTestCase(APITests):
         email = self.EMAIL_NOT_OF_A_USER
         response = self.auth_client.post(url, {'email': email}, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(mail.outbox), 0, 'Письмо отправлено в запросе.')
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+        self.send_outbox()
         self.assertEqual(
             len(mail.outbox),
             1,
@@ -405,92 +569,2792 @@ class EndpointsTestCase(APITests):
             mail.outbox[0].subject
         )
         self.assertIn(email, mail.outbox[0].recipients())
-        context = mail.outbox[0].get_context_data()
-        self.assertEqual(context['card'], self.card_user_own)
+        self.assertIn(str(self.card_user_own.shop), mail.outbox[0].body)
 
 
-class ShopEditTestCase(APIShopEditTests):
-    """Проверка редактирования неверифицированного магазина."""
+class ShareBulkTestCase(APITests):
+    """Проверка добавления карты в списки нескольких друзей."""
 
-    def test_unvalidated_shop_edit(self):
-        """Пользователь, создавший магазин, может его редактировать."""
-        response = self.auth_client.patch(
-            reverse(
-                'api:shop-detail',
-                kwargs={'pk': f'{self.shop_unvalidated.id}'},
-            ),
+    def setUp(self):
+        super().setUp()
+        self.url = reverse(
+            'api:card-share-bulk', args=(self.card_user_own.id,)
+        )
+
+    def share(self, emails):
+        return self.auth_client.post(
+            self.url, {'emails': emails}, format='json'
+        )
+
+    def test_share_bulk_statuses(self):
+        """Для каждого получателя возвращается свой статус."""
+
+        UserCards.objects.create(
+            user=self.unactivated_user, card=self.card_user_own
+        )
+        unknown = ('first@example.com', 'second@example.com')
+        response = self.share((
+            self.another_user.email,
+            self.unactivated_user.email,
+            self.user.email,
+            *unknown,
+            unknown[0],
+        ))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            {email: item['status'] for email, item in response.data.items()},
             {
-                'name': 'New shop name',
-                'group': f'{self.group.id}'
+                self.another_user.email: 'shared',
+                self.unactivated_user.email: 'already_shared',
+                self.user.email: 'self',
+                unknown[0]: 'invited',
+                unknown[1]: 'invited',
             }
         )
+        user_card = UserCards.objects.get(
+            user=self.another_user, card=self.card_user_own
+        )
+        self.assertFalse(user_card.owner)
+        self.assertEqual(user_card.shared_by, self.user)
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.send_outbox()
+        self.assertEqual(
+            sorted(message.to for message in mail.outbox),
+            [[email] for email in unknown],
+        )
+
+    def test_share_bulk_constant_queries(self):
+        """Количество запросов не зависит от количества получателей."""
+
+        users = User.objects.bulk_create(
+            User(
+                email=f'friend{num}@example.com',
+                phone_number=f'+7988888888{num}',
+            )
+            for num in range(6)
+        )
+        query_counts = []
+        for emails in (
+            (users[0].email, 'invite0@example.com'),
+            (
+                *(user.email for user in users[1:]),
+                *(f'invite{num}@example.com' for num in range(1, 6)),
+            ),
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.share(emails)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_share_bulk_invalidates_recipient_wallet(self):
+        """Карта сразу видна в списке получателя."""
+
+        client = APIClient()
+        client.force_authenticate(user=self.another_user)
+        self.assertEqual(client.get(self.CARDS_URL).data['results'], [])
+        self.share((self.another_user.email,))
+        response = client.get(self.CARDS_URL)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_share_bulk_foreign_card(self):
+        """Нельзя поделиться картой не из своего списка."""
+
+        foreign_card = Card.objects.exclude(users=self.user).first()
+        response = self.auth_client.post(
+            reverse('api:card-share-bulk', args=(foreign_card.id,)),
+            {'emails': [self.another_user.email]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_share_bulk_validation(self):
+        """Пустой, слишком длинный и некорректный списки отклоняются."""
+
+        too_many = [
+            f'user{num}@example.com'
+            for num in range(MAX_SHARE_RECIPIENTS + 1)
+        ]
+        for emails in ([], too_many, ['not-an-email']):
+            with self.subTest(emails=emails[:1]):
+                response = self.share(emails)
+                self.assertEqual(
+                    response.status_code, status.HTTP_400_BAD_REQUEST
+                )
+
+
+class CardImportTestCase(APITests):
+    """Проверка импорта карт из файлов."""
+
+    CSV = (
+        'name,shop,card_number,barcode_number,encoding_type,favourite\n'
+        'Imported one,  test SHOP #0 ,111,,,да\n'
+        'Imported two,Unknown shop,222,,,\n'
+        'Imported three,Test Shop #1,,,,\n'
+        'Imported four,Test Shop #1,,444,code128,\n'
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('api:card-import')
+
+    def upload(self, name, content, **data):
+        return self.auth_client.post(
+            self.url,
+            {'file': SimpleUploadedFile(name, content.encode()), **data},
+            format='multipart',
+        )
+
+    def imported(self):
+        return UserCards.objects.filter(
+            user=self.user, card__name__startswith='Imported'
+        )
+
+    def test_import_csv(self):
+        """Карты создаются, ошибочные строки попадают в отчет."""
+
+        response = self.upload('wallet.csv', self.CSV)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.shop_unvalidated.refresh_from_db()
-        self.assertEqual(self.shop_unvalidated.name, 'New shop name')
-        group = self.shop_unvalidated.group.all()[0]
-        self.assertEqual(group, self.group)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['failed'], 2)
+        self.assertEqual(
+            [(error['line'], list(error['errors']))
+             for error in response.data['errors']],
+            [(3, ['shop']), (4, ['card'])],
+        )
+        first = self.imported().get(card__card_number='111')
+        self.assertEqual(first.card.shop, self.shop)
+        self.assertTrue(first.owner)
+        self.assertTrue(first.favourite)
+        self.assertEqual(
+            self.imported().get(card__barcode_number='444')
+            .card.encoding_type,
+            'code128',
+        )
 
-    def test_unvalidated_friends_shop_not_edit(self):
-        """Пользователь не может редактировать магазин расшаренной карты."""
+    def test_shop_names_matched_like_card_creation(self):
+        """Названия сравниваются по тому же ключу, что и при создании."""
 
-        response = self.auth_client.patch(
-            reverse(
-                'api:shop-detail',
-                kwargs={'pk': f'{self.shop_unvalidated_from_friends_card.id}'},
+        Shop.objects.create(name='Пятерочка', validation=False)
+        shop = Shop.objects.create(name='Пятёрочка', validation=True)
+        content = (
+            'name,shop,card_number\n'
+            'Imported one,пятерочка,111\n'
+            'Imported two,Pyaterochka,222\n'
+            'Imported three,ПЯТЁРОЧКА!,333\n'
+        )
+        response = self.upload('wallet.csv', content)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(
+            set(self.imported().values_list('card__shop', flat=True)),
+            {shop.id},
+        )
+        self.assertEqual(match_shop('Pyaterochka'), shop)
+
+    def test_import_jsonl(self):
+        """JSON Lines читается построчно, битые строки в отчете."""
+
+        content = '\n'.join((
+            json.dumps({'name': 'Imported one', 'shop': self.shop.name,
+                        'card_number': '111'}),
+            '{broken',
+            '',
+            '[1, 2]',
+            json.dumps({'name': 'Imported two', 'shop': self.shop.name,
+                        'barcode_number': '222', 'favourite': True}),
+        ))
+        response = self.upload('wallet.jsonl', content)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(
+            [error['line'] for error in response.data['errors']], [2, 4]
+        )
+        self.assertTrue(
+            self.imported().get(card__barcode_number='222').favourite
+        )
+
+    def test_reimport_skips_existing(self):
+        """Повторный импорт не создает дубликатов."""
+
+        self.upload('wallet.csv', self.CSV)
+        response = self.upload('wallet.txt', self.CSV, format='csv')
+        self.assertEqual(response.data['created'], 0)
+        self.assertEqual(response.data['skipped'], 2)
+        self.assertEqual(self.imported().count(), 2)
+
+    def test_import_invalidates_wallet_cache(self):
+        """После импорта список карт отдается заново."""
+
+        self.auth_client.get(self.CARDS_URL)
+        self.upload('wallet.csv', self.CSV)
+        response = self.auth_client.get(self.CARDS_URL)
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+    def test_import_is_streamed_in_chunks(self):
+        """Строки пишутся пачками по мере чтения файла."""
+
+        def rows():
+            for num in range(7):
+                if num == 5:
+                    self.assertEqual(self.imported().count(), 4)
+                yield num + 2, {
+                    'name': f'Imported {num}',
+                    'shop': self.shop.name,
+                    'card_number': f'9{num}',
+                }
+
+        report = CardImporter(self.user, chunk_size=2).run(rows())
+        self.assertEqual(report['created'], 7)
+        self.assertEqual(self.imported().count(), 7)
+
+    def test_import_command(self):
+        """Команда импортирует карты из файла."""
+
+        with tempfile.NamedTemporaryFile(
+            'w', suffix='.csv', encoding='utf-8-sig', delete=False
+        ) as file:
+            file.write(self.CSV)
+        self.addCleanup(os.remove, file.name)
+        stdout, stderr = StringIO(), StringIO()
+        call_command(
+            'import_cards', file.name, user=self.user.email,
+            stdout=stdout, stderr=stderr,
+        )
+        self.assertIn('Created 2, skipped 0, failed 2', stdout.getvalue())
+        self.assertEqual(self.imported().count(), 2)
+
+
+class CardExportTestCase(APITests):
+    """Проверка потоковой выгрузки списка карт."""
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('api:card-export')
+
+    def export(self, client=None, **params):
+        response = (client or self.auth_client).get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_csv(self):
+        """CSV содержит заголовок и все карты пользователя."""
+
+        rows = list(csv.DictReader(StringIO(self.export())))
+        self.assertEqual(len(rows), self.CARDS_USER_HAVE)
+        self.assertEqual(
+            {row['card_number'] for row in rows},
+            set(
+                UserCards.objects.filter(user=self.user)
+                .values_list('card__card_number', flat=True)
             ),
+        )
+        self.assertEqual(rows[0]['shop'], self.shop.name)
+
+    def test_export_jsonl_round_trip(self):
+        """Выгрузку JSON Lines можно загрузить обратно импортом."""
+
+        content = self.export(file_format='jsonl')
+        lines = content.splitlines()
+        self.assertEqual(len(lines), self.CARDS_USER_HAVE)
+        self.assertEqual(
+            sum(json.loads(line)['favourite'] for line in lines),
+            self.CARDS_USER_FAV,
+        )
+
+        client = APIClient()
+        client.force_authenticate(user=self.another_user)
+        response = client.post(
+            reverse('api:card-import'),
+            {'file': SimpleUploadedFile('wallet.jsonl', content.encode())},
+            format='multipart',
+        )
+        self.assertEqual(response.data['created'], self.CARDS_USER_HAVE)
+        self.assertEqual(
+            UserCards.objects.filter(
+                user=self.another_user, favourite=True
+            ).count(),
+            self.CARDS_USER_FAV,
+        )
+
+    def test_export_other_user(self):
+        """Список другого пользователя выгружает только администратор."""
+
+        missing_pk = User.objects.aggregate(Max('pk'))['pk__max'] + 1
+        for user_id in (self.another_user.pk, missing_pk, 'abc'):
+            with self.subTest(user=user_id):
+                response = self.auth_client.get(self.url, {'user': user_id})
+                self.assertEqual(
+                    response.status_code, status.HTTP_403_FORBIDDEN
+                )
+
+        staff = User.objects.create_user(
+            email='staff@example.com',
+            password='StaffPass1',
+            phone_number='+79777777777',
+            is_staff=True,
+        )
+        client = APIClient()
+        client.force_authenticate(user=staff)
+        rows = self.export(client, user=self.user.pk).splitlines()
+        self.assertEqual(len(rows), self.CARDS_USER_HAVE + 1)
+
+    def test_export_unauthorized(self):
+        """Выгрузка недоступна без авторизации."""
+
+        response = self.guest_client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ShopAutocompleteTestCase(APITests):
+    """Проверка подсказок по названию магазина."""
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('api:shop-autocomplete')
+        self.pyaterochka = Shop.objects.create(
+            name='Пятёрочка', validation=True
+        )
+        self.cosmetic = Shop.objects.create(
+            name='Магнит Косметик', validation=True
+        )
+        self.lenta = Shop.objects.create(name='Lenta', validation=True)
+        Shop.objects.create(name='Пятёрочка у дома', validation=False)
+
+    def suggest(self, query, **params):
+        response = self.guest_client.get(self.url, {'q': query, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [shop['id'] for shop in response.json()]
+
+    def test_autocomplete_matches(self):
+        """Регистр, ё/е и письменность названия не важны."""
+
+        cases = (
+            ('пят', [self.pyaterochka.id]),
+            ('ПЯТЕР', [self.pyaterochka.id]),
+            ('Pyaterochka', [self.pyaterochka.id]),
+            ('лен', [self.lenta.id]),
+            ('LEN', [self.lenta.id]),
+            ('косм', [self.cosmetic.id]),
+            ('магнит к', [self.cosmetic.id]),
+            ('нет такого', []),
+        )
+        for query, expected in cases:
+            with self.subTest(query=query):
+                self.assertEqual(self.suggest(query), expected)
+
+    def test_autocomplete_payload_and_limit(self):
+        """Подсказки - данные магазинов, их количество ограничено."""
+
+        response = self.guest_client.get(self.url, {'q': 'пят'})
+        self.assertEqual(
+            response.json(), [ShopSerializer(self.pyaterochka).data]
+        )
+        self.assertEqual(
+            len(self.suggest('test shop')), self.SHOPS_VERIFY
+        )
+        self.assertEqual(len(self.suggest('test shop', limit=2)), 2)
+
+    def test_autocomplete_follows_shop_changes(self):
+        """Индекс обновляется при изменении магазинов."""
+
+        self.assertEqual(self.suggest('lenta'), [self.lenta.id])
+        self.lenta.name = 'Лента'
+        self.lenta.save()
+        self.assertEqual(self.suggest('лент'), [self.lenta.id])
+        self.lenta.validation = False
+        self.lenta.save()
+        self.assertEqual(self.suggest('lenta'), [])
+        new_shop = Shop.objects.create(name='Лента плюс', validation=True)
+        self.assertEqual(self.suggest('lenta'), [new_shop.id])
+
+    def test_autocomplete_validation(self):
+        """Пустой запрос и неверный лимит отклоняются."""
+
+        for params in ({}, {'q': ''}, {'q': 'a', 'limit': 0}):
+            with self.subTest(params=params):
+                response = self.guest_client.get(self.url, params)
+                self.assertEqual(
+                    response.status_code, status.HTTP_400_BAD_REQUEST
+                )
+
+    def test_search_speed(self):
+        """Поиск по индексу в тысячи магазинов занимает доли миллисекунды."""
+
+        index = ShopIndex()
+        index.entries = sorted(
+            entry
+            for shop_id in range(10000)
+            for entry in index.shop_entries(
+                shop_id, f'Магазин номер {shop_id} shop'
+            )
+        )
+        started = time.perf_counter()
+        for _ in range(1000):
+            self.assertEqual(len(index.search('магазин номер 12', 10)), 10)
+        elapsed = (time.perf_counter() - started) / 1000
+        self.assertLess(elapsed, 0.001)
+
+
+class ShopDeduplicationTestCase(APITests):
+    """Проверка поиска существующего магазина при создании карты."""
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('api:card-create-with-new-shop')
+        self.pyaterochka = Shop.objects.create(
+            name='Пятёрочка', validation=True
+        )
+        self.crossroads = Shop.objects.create(
+            name='Перекрёсток', validation=True
+        )
+
+    def create_card(self, shop_name, **shop):
+        return self.auth_client.post(
+            self.url,
             {
-                'name': 'New shop name',
-                'group': f'{self.group.id}'
-            }
+                'shop': {'name': shop_name, **shop},
+                'name': 'Card',
+                'card_number': '157',
+            },
+            format='json',
         )
-        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
-    def test_validated_shop_not_edit(self):
-        """Пользователь не может редактировать предустановленный магазин."""
+    def test_normalized_name(self):
+        """Разные написания дают один нормализованный ключ."""
+
+        for name in ('Пятёрочка', ' пятерочка ', 'Pyaterochka', 'PYATEROCHKA'):
+            with self.subTest(name=name):
+                self.assertEqual(search_key(name), 'pyaterochka')
+        self.assertEqual(self.pyaterochka.normalized_name, 'pyaterochka')
+
+    def test_reuse_validated_shop(self):
+        """Совпадающее название привязывает карту к магазину."""
+
+        cases = (
+            ('пятерочка ', self.pyaterochka),
+            ('Pyaterochka', self.pyaterochka),
+            ('Перекресток', self.crossroads),
+        )
+        shops_count = Shop.objects.count()
+        for name, shop in cases:
+            with self.subTest(name=name):
+                response = self.create_card(name)
+                self.assertEqual(
+                    response.status_code, status.HTTP_201_CREATED
+                )
+                self.assertEqual(response.data['shop']['id'], shop.id)
+        self.assertEqual(Shop.objects.count(), shops_count)
+
+    def test_reuse_unvalidated_shop(self):
+        """Непроверенный магазин переиспользуется при точном совпадении."""
+
+        first = self.create_card('Local Store', group=[self.group.id])
+        second = self.create_card('local  store!')
+        self.assertEqual(
+            first.data['shop']['id'], second.data['shop']['id']
+        )
+        self.assertEqual(
+            Shop.objects.filter(normalized_name='local store').count(), 1
+        )
+
+    def test_similar_name_not_reused(self):
+        """Похожее название не подменяет магазин, а есть в подсказках."""
+
+        shop_10 = Shop.objects.create(name='Shop 10', validation=True)
+        response = self.create_card('Shop 11', group=[self.group.id])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        shop = Shop.objects.get(pk=response.data['shop']['id'])
+        self.assertNotEqual(shop, shop_10)
+        self.assertEqual(list(shop.group.all()), [self.group])
+        response = self.create_card('Перекрсток')
+        self.assertNotEqual(response.data['shop']['id'], self.crossroads.id)
+        response = self.guest_client.get(
+            reverse('api:shop-autocomplete'), {'q': 'Перекрсток'}
+        )
+        self.assertEqual(
+            [shop['id'] for shop in response.json()], [self.crossroads.id]
+        )
+
+    def test_groups_added_to_unvalidated_shop(self):
+        """Категории пользователя дополняют только непроверенный магазин."""
+
+        group = Group.objects.create(name='Another group')
+        first = self.create_card('Local Store', group=[self.group.id])
+        self.create_card('local store', group=[group.id])
+        self.create_card('Пятёрочка', group=[group.id])
+        shop = Shop.objects.get(pk=first.data['shop']['id'])
+        self.assertEqual(set(shop.group.all()), {self.group, group})
+        self.assertFalse(self.pyaterochka.group.exists())
+
+    def test_groups_not_added_by_another_user(self):
+        """Чужие категории не меняют непроверенный магазин автора."""
+
+        group = Group.objects.create(name='Another group')
+        shop_id = self.create_card(
+            'Local Store', group=[self.group.id]
+        ).data['shop']['id']
+        client = APIClient()
+        client.force_authenticate(user=self.another_user)
+        response = client.post(
+            self.url,
+            {
+                'shop': {'name': 'local store', 'group': [group.id]},
+                'name': 'Card',
+                'card_number': '158',
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['shop']['id'], shop_id)
+        self.assertEqual(
+            list(Shop.objects.get(pk=shop_id).group.all()), [self.group]
+        )
 
+    def test_new_shop_created(self):
+        """Непохожее название создает новый магазин."""
+
+        response = self.create_card('Совсем новый')
+        shop = Shop.objects.get(pk=response.data['shop']['id'])
+        self.assertFalse(shop.validation)
+        self.assertEqual(shop.normalized_name, 'sovsem novyy')
+
+    def test_shared_shop_not_editable(self):
+        """Магазин с картами нескольких владельцев не редактируется."""
+
+        shop_id = self.create_card('Local Store').data['shop']['id']
+        client = APIClient()
+        client.force_authenticate(user=self.another_user)
+        response = client.post(
+            self.url,
+            {
+                'shop': {'name': 'Local Store'},
+                'name': 'Card',
+                'card_number': '158',
+            },
+            format='json',
+        )
+        self.assertEqual(response.data['shop']['id'], shop_id)
         response = self.auth_client.patch(
+            reverse('api:shop-detail', kwargs={'pk': shop_id}),
+            {'name': 'Renamed'},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class WalletCacheTestCase(APITests):
+    """Проверка кэширования списка карт пользователя."""
+
+    def assert_cache_status(self, expected, url=None):
+        response = self.auth_client.get(url or self.CARDS_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Cache'], expected)
+        return response
+
+    def test_wallet_cached(self):
+        """Повторный запрос списка карт отдается из кэша."""
+
+        wallet_cache_stats.reset()
+        first = self.assert_cache_status('MISS')
+        second = self.assert_cache_status('HIT')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(wallet_cache_stats.hits, 1)
+        self.assertEqual(wallet_cache_stats.misses, 1)
+
+    def test_wallet_cache_is_per_user(self):
+        """Кэш одного пользователя не выдается другому."""
+
+        self.assert_cache_status('MISS')
+        another_client = APIClient()
+        another_client.force_authenticate(user=self.another_user)
+        response = another_client.get(self.CARDS_URL)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'], [])
+
+    def test_wallet_cache_invalidated_by_user_card(self):
+        """Изменение карты пользователя сбрасывает кэш."""
+
+        url = self.CARDS_URL + 'favorites/'
+        self.assert_cache_status('MISS', url)
+        self.assert_cache_status('HIT', url)
+        self.auth_client.post(
             reverse(
-                'api:shop-detail',
-                kwargs={'pk': f'{self.shop_validated.id}'},
-            ),
-            {
-                'name': 'New shop name',
-                'group': f'{self.group.id}'
+                'api:card-favorite',
+                kwargs={'pk': self.card_user_not_fav.pk}
+            )
+        )
+        response = self.assert_cache_status('MISS', url)
+        self.assertEqual(
+            len(response.data['results']), self.CARDS_USER_FAV + 1
+        )
+
+    def test_wallet_cache_invalidated_by_card(self):
+        """Изменение карты сбрасывает кэш ее пользователей."""
+
+        self.assert_cache_status('MISS')
+        self.card.name = 'Renamed card'
+        self.card.save()
+        response = self.assert_cache_status('MISS')
+        names = [
+            user_card['card']['name'] for user_card in response.data['results']
+        ]
+        self.assertIn('Renamed card', names)
+
+    def test_wallet_cache_invalidated_by_shop_for_every_holder(self):
+        """Изменение магазина сбрасывает кэш всех владельцев его карт."""
+
+        UserCards.objects.create(user=self.another_user, card=self.card)
+        another_client = APIClient()
+        another_client.force_authenticate(user=self.another_user)
+        self.assert_cache_status('MISS')
+        another_client.get(self.CARDS_URL)
+        self.shop.name = 'Renamed shop'
+        self.shop.save()
+        self.assert_cache_status('MISS')
+        response = another_client.get(self.CARDS_URL)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(
+            response.data['results'][0]['card']['shop']['name'],
+            'Renamed shop'
+        )
+
+    def test_wallet_cache_invalidated_by_shop_groups(self):
+        """Изменение категорий магазина сбрасывает кэш."""
+
+        self.assert_cache_status('MISS')
+        self.shop.group.add(Group.objects.create(name='New group'))
+        self.assert_cache_status('MISS')
+        self.assert_cache_status('HIT')
+        self.group.shop_set.clear()
+        self.assert_cache_status('MISS')
+
+    def test_wallet_cache_not_invalidated_by_other_shop(self):
+        """Изменение чужого магазина не сбрасывает кэш."""
+
+        self.assert_cache_status('MISS')
+        shop = Shop.objects.exclude(pk=self.shop.pk).first()
+        shop.name = 'Other shop'
+        shop.save()
+        self.assert_cache_status('HIT')
+
+    def test_process_local_cache_reported(self):
+        """check --deploy предупреждает о кэше в памяти процесса."""
+
+        locmem = {
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
             }
+        }
+        shared = {
+            'default': {
+                'BACKEND': (
+                    'django.core.cache.backends.filebased.FileBasedCache'
+                ),
+                'LOCATION': tempfile.gettempdir(),
+            }
+        }
+        with override_settings(CACHES=locmem):
+            self.assertEqual(
+                [warning.id for warning in check_shared_cache(None)],
+                ['core.W001'],
+            )
+        with override_settings(CACHES=shared):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+class ConditionalGetTestCase(APITests):
+    """Проверка условных GET-запросов (ETag)."""
+
+    def setUp(self):
+        super().setUp()
+        token = Token.objects.create(user=self.user)
+        self.token_client = APIClient()
+        self.token_client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+
+    def assert_not_modified(self, client, url, max_queries):
+        response = client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+        with CaptureQueriesContext(connection) as queries:
+            not_modified = client.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag']
+            )
+        self.assertLessEqual(len(queries), max_queries)
+        self.assertEqual(
+            not_modified.status_code, status.HTTP_304_NOT_MODIFIED
         )
-        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        return response['ETag']
 
+    def test_cards_list_not_modified(self):
+        """Неизменный список карт отдается с кодом 304 за один запрос."""
 
-class CustomizedDjoserTestCase(APITests):
-    """Проверка кастомизированных ручек Djoser."""
+        self.assert_not_modified(self.token_client, self.CARDS_URL, 1)
 
-    def test_unactivated_user_can_login(self):
-        """Неактивированный пользователь может залогиниться."""
+    def test_card_detail_not_modified(self):
+        """Неизменная карта отдается с кодом 304 за один запрос."""
 
-        response = self.client.post(
-            reverse('api:login'),
-            {'email': self.unactivated_user.email,
-             'password': 'TestPass2'}
+        self.assert_not_modified(self.token_client, self.CARD_DETAIL_URL, 1)
+
+    def test_cards_favorites_not_modified(self):
+        """Неизменный список избранного отдается с кодом 304."""
+
+        self.assert_not_modified(
+            self.token_client, self.CARDS_URL + 'favorites/', 1
+        )
+
+    def test_shops_and_groups_not_modified(self):
+        """Каталог отдается с кодом 304 без запросов к базе."""
+
+        for url in (
+            reverse('api:shop-list'),
+            reverse('api:shop-detail', kwargs={'pk': self.shop.pk}),
+            self.GROUP_LIST_URL,
+            reverse('api:group-detail', kwargs={'pk': self.group.pk}),
+        ):
+            with self.subTest(url=url):
+                self.assert_not_modified(self.guest_client, url, 0)
+
+    def test_cards_etag_changes_after_update(self):
+        """После изменения карты старый ETag не подходит."""
+
+        etag = self.assert_not_modified(self.token_client, self.CARDS_URL, 1)
+        self.card.name = 'Renamed card'
+        self.card.save()
+        response = self.token_client.get(
+            self.CARDS_URL, HTTP_IF_NONE_MATCH=etag
         )
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
 
-    def test_password_recovery(self):
-        """Пользователь может запросить восстановление пароля."""
+    def test_catalog_etag_changes_after_update(self):
+        """После изменения категории старый ETag не подходит."""
 
-        users_phone = self.user.phone_number
-        response = self.client.post(
-            reverse('api:user-reset-password'),
-            {
-                'email': self.user.email,
-                'phone_last_digits': users_phone[-4:]
-            },
-            format='json'
+        etag = self.assert_not_modified(
+            self.guest_client, self.GROUP_LIST_URL, 0
+        )
+        Group.objects.create(name='New group')
+        response = self.guest_client.get(
+            self.GROUP_LIST_URL, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()), self.GROUPS + 1)
+
+    def test_if_modified_since_ignored(self):
+        """If-Modified-Since не дает 304 после изменения в ту же секунду."""
+
+        since = http_date(time.time() + 1)
+        Group.objects.create(name='New group')
+        response = self.guest_client.get(
+            self.GROUP_LIST_URL, HTTP_IF_MODIFIED_SINCE=since
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()), self.GROUPS + 1)
+
+
+class CatalogSnapshotTestCase(APITests):
+    """Проверка снимка каталога магазинов и категорий."""
+
+    def test_snapshot_matches_serializers(self):
+        """Снимок совпадает с выдачей сериализаторов."""
+
+        shops = ShopSerializer(
+            Shop.objects.filter(validation=True), many=True
+        ).data
+        response = self.guest_client.get(reverse('api:shop-list'))
+        self.assertEqual(response.json(), shops)
+        groups = GroupSerializer(Group.objects.all(), many=True).data
+        response = self.guest_client.get(self.GROUP_LIST_URL)
+        self.assertEqual(response.json(), groups)
+
+    def test_snapshot_served_without_queries(self):
+        """Собранный снимок отдается без запросов к базе."""
+
+        self.guest_client.get(reverse('api:shop-list'))
+        with self.assertNumQueries(0):
+            self.guest_client.get(reverse('api:shop-list'))
+            self.guest_client.get(self.GROUP_LIST_URL)
+            self.guest_client.get(
+                reverse('api:shop-detail', kwargs={'pk': self.shop.pk})
+            )
+
+    def test_snapshot_built_without_n_plus_one(self):
+        """Сборка снимка не зависит от количества магазинов."""
+
+        with self.assertNumQueries(3):
+            self.guest_client.get(reverse('api:shop-list'))
+
+    def test_snapshot_detail(self):
+        """Магазин и категория выдаются по id, непроверенный - 404."""
+
+        response = self.guest_client.get(
+            reverse('api:shop-detail', kwargs={'pk': self.shop.pk})
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), ShopSerializer(self.shop).data)
+        response = self.guest_client.get(
+            reverse('api:group-detail', kwargs={'pk': self.group.pk})
+        )
+        self.assertEqual(response.json(), GroupSerializer(self.group).data)
+        unvalidated = Shop.objects.filter(validation=False).first()
+        response = self.guest_client.get(
+            reverse('api:shop-detail', kwargs={'pk': unvalidated.pk})
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_snapshot_updated_after_change(self):
+        """После изменения магазина выдается новый снимок."""
+
+        self.guest_client.get(reverse('api:shop-list'))
+        self.shop.name = 'Renamed shop'
+        self.shop.save()
+        response = self.guest_client.get(
+            reverse('api:shop-detail', kwargs={'pk': self.shop.pk})
+        )
+        self.assertEqual(response.json()['name'], 'Renamed shop')
+
+    def test_snapshot_rebuild_scheduled_on_commit(self):
+        """Изменение каталога запускает фоновую пересборку снимка."""
+
+        with mock.patch('api.catalog._executor') as executor:
+            with self.captureOnCommitCallbacks(execute=True):
+                Group.objects.create(name='New group')
+        executor.submit.assert_called_once()
+
+
+class TokenCacheTestCase(APITests):
+    """Проверка кэширования токенов авторизации."""
+
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=self.user)
+        self.token_client = APIClient()
+        self.token_client.credentials(
+            HTTP_AUTHORIZATION=f'Token {self.token}'
         )
+        self.authentication = CustomTokenAuthentication()
+
+    def test_token_lookup_cached(self):
+        """Повторная проверка токена не обращается к базе."""
+
+        with self.assertNumQueries(1):
+            user, _ = self.authentication.authenticate_credentials(
+                self.token.key
+            )
+        with self.assertNumQueries(0):
+            cached_user, token = self.authentication.authenticate_credentials(
+                self.token.key
+            )
+        self.assertEqual(cached_user, user)
+        self.assertEqual(token, self.token)
+
+    def test_shared_tier_used_after_local_miss(self):
+        """Токен находится в общем кэше при пустом кэше процесса."""
+
+        self.authentication.authenticate_credentials(self.token.key)
+        token_cache.clear()
+        with self.assertNumQueries(0):
+            self.authentication.authenticate_credentials(self.token.key)
+
+    @override_settings(TOKEN_CACHE_ENABLED=False)
+    def test_token_cache_disabled(self):
+        """Без кэша токен каждый раз читается из базы."""
+
+        self.authentication.authenticate_credentials(self.token.key)
+        with self.assertNumQueries(1):
+            self.authentication.authenticate_credentials(self.token.key)
+
+    def test_logout_evicts_token(self):
+        """После выхода токен сразу перестает работать."""
+
+        me_url = reverse('api:user-me')
+        response = self.token_client.get(me_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.token_client.post('/api/v1/auth/token/logout/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.token_client.get(me_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_change_evicts_token(self):
+        """Смена пароля сбрасывает кэш токена."""
+
+        self.authentication.authenticate_credentials(self.token.key)
+        self.user.set_password('NewPass123')
+        self.user.save()
+        self.assertIsNone(token_cache.get(self.token.key))
+
+    def test_deactivation_evicts_token(self):
+        """Деактивация пользователя сбрасывает кэш токена."""
+
+        self.authentication.authenticate_credentials(self.token.key)
+        self.user.is_active = False
+        self.user.save(update_fields=('is_active',))
+        self.assertIsNone(token_cache.get(self.token.key))
+        user, _ = self.authentication.authenticate_credentials(
+            self.token.key
+        )
+        self.assertFalse(user.is_active)
+
+    def test_cached_user_has_no_password(self):
+        """В кэш попадают id и флаги, остальные поля читаются лениво."""
+
+        self.user.is_staff = True
+        self.user.save()
+        self.authentication.authenticate_credentials(self.token.key)
+        cached = token_cache.get(self.token.key)
+        self.assertNotIn(self.user.password, repr(cached))
+        with self.assertNumQueries(0):
+            user, token = self.authentication.authenticate_credentials(
+                self.token.key
+            )
+            self.assertEqual(user.pk, self.user.pk)
+            self.assertEqual(user.email, self.user.email)
+            self.assertTrue(user.is_active)
+            self.assertTrue(user.is_staff)
+            self.assertFalse(user.is_superuser)
+            self.assertEqual(token.created, self.token.created)
+            self.assertIs(token.user, user)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.name, self.user.name)
+            self.assertEqual(user.phone_number, self.user.phone_number)
+            self.assertEqual(user.password, self.user.password)
+
+    def test_evict_during_lookup_not_cached(self):
+        """Токен, отозванный во время чтения из базы, не попадает в кэш."""
+
+        load_credentials = self.authentication.load_credentials
+
+        def load_and_logout(key):
+            credentials = load_credentials(key)
+            Token.objects.filter(key=key).delete()
+            return credentials
+
+        with mock.patch.object(
+            self.authentication, 'load_credentials', load_and_logout
+        ):
+            self.authentication.authenticate_credentials(self.token.key)
+        self.assertIsNone(token_cache.get(self.token.key))
+        token_cache.clear()
+        self.assertIsNone(token_cache.get(self.token.key))
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.token.key)
+
+    def test_login_keeps_token_cached(self):
+        """Обновление времени входа не сбрасывает кэш токена."""
+
+        self.authentication.authenticate_credentials(self.token.key)
+        self.user.save(update_fields=('last_login',))
+        self.assertIsNotNone(token_cache.get(self.token.key))
+
+
+class OutboxTestCase(APITests):
+    """Проверка очереди писем."""
+
+    def enqueue(self, count=1, subject='Тема'):
+        enqueue_emails(
+            EmailMultiAlternatives(
+                subject=subject,
+                body='Текст',
+                to=[f'outbox{number}@example.com'],
+            )
+            for number in range(count)
+        )
+
+    def test_duplicate_pending_email_not_queued(self):
+        """Одинаковое письмо не ставится в очередь дважды."""
+
+        self.enqueue()
+        self.enqueue()
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+    def test_batch_uses_one_connection(self):
+        """Пачка писем отправляется через одно соединение."""
+
+        self.enqueue(count=3)
+        with mock.patch(
+            'core.outbox.get_connection', wraps=get_connection
+        ) as connection:
+            self.assertEqual(send_pending(batch_size=2), 2)
+        connection.assert_called_once()
+        self.assertEqual(len(mail.outbox), 2)
+        self.send_outbox()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertFalse(
+            OutboxEmail.objects.filter(status=OUTBOX_PENDING).exists()
+        )
+
+    def test_failed_email_retried_with_backoff(self):
+        """Неотправленное письмо повторяется с нарастающей задержкой."""
+
+        self.enqueue()
+        with mock.patch.object(
+            EmailMultiAlternatives, 'send', side_effect=OSError('down')
+        ):
+            delays = []
+            for _ in range(2):
+                OutboxEmail.objects.update(next_attempt_at=timezone.now())
+                send_pending()
+                email = OutboxEmail.objects.get()
+                self.assertEqual(email.status, OUTBOX_PENDING)
+                delays.append(email.next_attempt_at - timezone.now())
+            self.assertGreater(delays[0].total_seconds(), 0)
+            self.assertGreater(delays[1], delays[0])
+
+            with self.assertLogs('core.outbox', level='ERROR'):
+                for _ in range(settings.EMAIL_OUTBOX_MAX_ATTEMPTS - 2):
+                    OutboxEmail.objects.update(next_attempt_at=timezone.now())
+                    send_pending()
+        email.refresh_from_db()
+        self.assertEqual(email.status, OUTBOX_FAILED)
+        self.assertEqual(email.attempts, settings.EMAIL_OUTBOX_MAX_ATTEMPTS)
+        self.assertEqual(email.last_error, 'down')
+
+    def test_sent_outside_transaction(self):
+        """Письма отправляются без открытой транзакции и блокировок."""
+
+        self.enqueue()
+        depth = len(connection.atomic_blocks)
+        depths = []
+
+        def send(message):
+            depths.append(len(connection.atomic_blocks))
+            return 1
+
+        with mock.patch.object(
+            EmailMultiAlternatives, 'send', autospec=True, side_effect=send
+        ):
+            self.assertEqual(send_pending(), 1)
+        self.assertEqual(depths, [depth])
+        self.assertEqual(OutboxEmail.objects.get().status, OUTBOX_SENT)
+
+    def test_connection_failure_retried(self):
+        """Если соединение не открылось, пачка повторяется позже."""
+
+        self.enqueue(count=2)
+        with mock.patch(
+            'django.core.mail.backends.locmem.EmailBackend.open',
+            side_effect=OSError('down'),
+        ), self.assertLogs('core.outbox', level='WARNING'):
+            self.assertEqual(send_pending(), 2)
+            self.assertEqual(send_pending(), 0)
+        for email in OutboxEmail.objects.all():
+            self.assertEqual(email.status, OUTBOX_PENDING)
+            self.assertEqual(email.attempts, 1)
+            self.assertEqual(email.last_error, 'down')
+            self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_recently_sent_duplicate_dropped(self):
+        """Повтор недавно отправленного письма не уходит получателю."""
+
+        self.enqueue()
+        self.send_outbox()
+        self.enqueue()
+        self.send_outbox()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+    def test_file_backend(self):
+        """Очередь работает с файловым бэкендом для отладки."""
+
+        with tempfile.TemporaryDirectory() as email_dir:
+            with override_settings(
+                EMAIL_BACKEND='django.core.mail.backends.filebased.'
+                              'EmailBackend',
+                EMAIL_FILE_PATH=email_dir,
+            ):
+                self.enqueue(count=2)
+                self.send_outbox()
+            self.assertEqual(len(os.listdir(email_dir)), 1)
         self.assertEqual(
-            response.status_code,
-            status.HTTP_204_NO_CONTENT,
-            'Не удалось отправить запрос на смену пароля.'
+            OutboxEmail.objects.filter(status=OUTBOX_SENT).count(), 2
+        )
+
+
+class BulkStatisticsTestCase(APITests):
+    """Проверка пакетного обновления счётчиков использования."""
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('api:card-bulk-statistics')
+        self.user_cards = list(
+            UserCards.objects.filter(user=self.user).order_by('card_id')
+        )
+
+    def test_bulk_statistics(self):
+        """Счётчики растут, меньшие значения и чужие карты не меняются."""
+
+        increased, decreased = self.user_cards[:2]
+        decreased.usage_counter = 50
+        decreased.save()
+        foreign_card = Card.objects.exclude(users=self.user).first()
+        response = self.auth_client.patch(
+            self.url,
+            {
+                increased.card_id: 10,
+                decreased.card_id: 20,
+                foreign_card.id: 30,
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data,
+            {
+                increased.card_id: {
+                    'status': 'updated', 'usage_counter': 10
+                },
+                decreased.card_id: {
+                    'status': 'stale', 'usage_counter': 50
+                },
+                foreign_card.id: {
+                    'status': 'not_found', 'usage_counter': None
+                },
+            }
+        )
+        increased.refresh_from_db()
+        decreased.refresh_from_db()
+        self.assertEqual(increased.usage_counter, 10)
+        self.assertEqual(decreased.usage_counter, 50)
+        self.assertFalse(
+            UserCards.objects.filter(card=foreign_card).exists()
+        )
+
+    def test_bulk_statistics_constant_queries(self):
+        """Количество запросов не зависит от количества карт."""
+
+        for count in (2, len(self.user_cards)):
+            with self.subTest(count=count):
+                with self.assertNumQueries(2):
+                    response = self.auth_client.patch(
+                        self.url,
+                        {
+                            user_card.card_id: 100 + count
+                            for user_card in self.user_cards[:count]
+                        },
+                        format='json',
+                    )
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_bulk_statistics_invalidates_wallet_cache(self):
+        """Пакетное обновление сбрасывает кэш списка карт."""
+
+        self.auth_client.get(self.CARDS_URL)
+        self.auth_client.patch(
+            self.url, {self.card.id: 1000}, format='json'
+        )
+        response = self.auth_client.get(self.CARDS_URL)
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+    def test_bulk_statistics_validation(self):
+        """Некорректные ключи и значения отклоняются."""
+
+        for data in ({'card': 1}, {self.card.id: 0}, {}, [1, 2]):
+            with self.subTest(data=data):
+                response = self.auth_client.patch(
+                    self.url, data, format='json'
+                )
+                self.assertEqual(
+                    response.status_code, status.HTTP_400_BAD_REQUEST
+                )
+
+
+@override_settings(
+    USAGE_BUFFER_ENABLED=True,
+    USAGE_BUFFER_FLUSH_EVENTS=3,
+    USAGE_BUFFER_FLUSH_INTERVAL=60 * 60,
+)
+class UsageBufferTestCase(APITests):
+    """Проверка отложенной записи счётчиков использования."""
+
+    def setUp(self):
+        super().setUp()
+        self.journal_dir = tempfile.mkdtemp()
+        self.buffer = UsageBuffer(self.journal_dir)
+        patcher = mock.patch('core.usage.usage_buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.journal_dir, True)
+        self.addCleanup(self.buffer.close)
+        self.user_cards = list(
+            UserCards.objects.filter(user=self.user).order_by('card_id')
+        )
+
+    def patch_statistics(self, card_id, value):
+        return self.auth_client.patch(
+            reverse('api:card-statistics', kwargs={'pk': card_id}),
+            {'usage_counter': value},
+            format='json',
+        )
+
+    def get_counter(self, user_card):
+        user_card.refresh_from_db()
+        return user_card.usage_counter
+
+    def test_buffered_until_flush_events(self):
+        """Счётчики пишутся в базу после USAGE_BUFFER_FLUSH_EVENTS."""
+
+        first, second, third = self.user_cards[:3]
+        response = self.patch_statistics(first.card_id, 10)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['usage_counter'], 10)
+        self.patch_statistics(second.card_id, 20)
+        self.assertEqual(self.get_counter(first), 0)
+        self.assertEqual(self.get_counter(second), 0)
+
+        self.patch_statistics(third.card_id, 30)
+        self.assertEqual(self.get_counter(first), 10)
+        self.assertEqual(self.get_counter(second), 20)
+        self.assertEqual(self.get_counter(third), 30)
+
+    def test_counters_never_decrease(self):
+        """Меньшее значение не затирает большее ни в буфере, ни в базе."""
+
+        first, second = self.user_cards[:2]
+        UserCards.objects.filter(pk=second.pk).update(usage_counter=200)
+        self.buffer.record_many({
+            (self.user.pk, first.card_id): 100,
+            (self.user.pk, second.card_id): 150,
+        })
+        self.buffer.record_many({(self.user.pk, first.card_id): 50})
+        self.buffer.flush()
+        self.assertEqual(self.get_counter(first), 100)
+        self.assertEqual(self.get_counter(second), 200)
+
+    def test_statuses_include_buffered_values(self):
+        """Меньшее значение отклоняется, даже если большее еще в буфере."""
+
+        user_card = self.user_cards[0]
+        url = reverse('api:card-bulk-statistics')
+        for value in (10, 20):
+            response = self.auth_client.patch(
+                url, {user_card.card_id: value}, format='json'
+            )
+            self.assertEqual(
+                response.data[user_card.card_id],
+                {'status': 'updated', 'usage_counter': value},
+            )
+        response = self.auth_client.patch(
+            url, {user_card.card_id: 15}, format='json'
+        )
+        self.assertEqual(
+            response.data[user_card.card_id],
+            {'status': 'stale', 'usage_counter': 20},
+        )
+        self.assertEqual(
+            self.patch_statistics(user_card.card_id, 15).status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
+        self.assertEqual(self.get_counter(user_card), 0)
+        self.buffer.flush()
+        self.assertEqual(self.get_counter(user_card), 20)
+
+    def test_close_flushes_buffer(self):
+        """При остановке буфер сбрасывается и журнал удаляется."""
+
+        self.buffer.record_many({(self.user.pk, self.card.id): 42})
+        self.buffer.close()
+        self.assertEqual(self.get_counter(self.user_cards[0]), 42)
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+    def test_recover_after_crash(self):
+        """Журнал упавшего процесса дописывается в базу."""
+
+        self.buffer.record_many({(self.user.pk, self.card.id): 42})
+        self.buffer._journal.close()
+        self.buffer._journal = None
+        self.buffer.pending.clear()
+        self.assertEqual(self.get_counter(self.user_cards[0]), 0)
+
+        recovered = UsageBuffer(self.journal_dir).recover()
+        self.assertEqual(recovered, 1)
+        self.assertEqual(self.get_counter(self.user_cards[0]), 42)
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+    def test_recover_skips_live_journal(self):
+        """Журнал работающего процесса не трогается."""
+
+        self.buffer.record_many({(self.user.pk, self.card.id): 42})
+        self.assertEqual(UsageBuffer(self.journal_dir).recover(), 0)
+        self.assertEqual(self.get_counter(self.user_cards[0]), 0)
+        self.assertEqual(len(os.listdir(self.journal_dir)), 1)
+
+    def test_recover_skips_journal_removed_by_another_process(self):
+        """Журнал, разобранный другим процессом, не пишется повторно."""
+
+        self.buffer.record_many({(self.user.pk, self.card.id): 42})
+        path = self.buffer._journal.name
+        self.buffer._journal.close()
+        self.buffer._journal = None
+        flock = fcntl.flock
+
+        def replayed_meanwhile(file, operation):
+            flock(file, operation)
+            os.remove(path)
+
+        with mock.patch('core.usage.fcntl.flock', replayed_meanwhile):
+            self.assertEqual(UsageBuffer(self.journal_dir).recover(), 0)
+        self.assertEqual(self.get_counter(self.user_cards[0]), 0)
+
+
+@override_settings(WALLET_SYNC_OVERLAP=0)
+class WalletSyncTestCase(APITests):
+    """Проверка синхронизации списка карт по токену."""
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('api:card-sync')
+
+    def sync(self, token=None, **headers):
+        params = {'since': token} if token is not None else {}
+        return self.auth_client.get(self.url, params, **headers)
+
+    def get_token(self):
+        return self.sync().data['token']
+
+    def test_full_sync_without_token(self):
+        """Без токена отдается весь список карт."""
+
+        response = self.sync()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['full'])
+        self.assertEqual(len(response.data['cards']), self.CARDS_USER_HAVE)
+        self.assertEqual(response.data['deleted'], [])
+        self.assertTrue(response.data['token'])
+
+    def test_no_changes(self):
+        """Без изменений ответ пустой, а повторный запрос получает 304."""
+
+        response = self.sync(self.get_token())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['full'])
+        self.assertEqual(response.data['cards'], [])
+        self.assertEqual(response.data['deleted'], [])
+
+        response = self.sync(
+            response.wsgi_request.GET['since'],
+            HTTP_IF_NONE_MATCH=response['ETag'],
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+    def test_changed_and_deleted_cards(self):
+        """Отдаются только измененные карты и id удаленных."""
+
+        token = self.get_token()
+        self.auth_client.post(
+            reverse('api:card-favorite', args=(self.card_user_not_fav.id,))
+        )
+        self.auth_client.patch(
+            reverse('api:card-statistics', args=(self.card_user_own.id,)),
+            {'usage_counter': 5},
+            format='json',
+        )
+        self.auth_client.delete(
+            reverse('api:card-detail', args=(self.card_user_not_own.id,))
+        )
+
+        response = self.sync(token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            {item['card']['id'] for item in response.data['cards']},
+            {self.card_user_not_fav.id, self.card_user_own.id},
+        )
+        self.assertEqual(
+            response.data['deleted'], [self.card_user_not_own.id]
+        )
+
+        response = self.sync(response.data['token'])
+        self.assertEqual(response.data['cards'], [])
+        self.assertEqual(response.data['deleted'], [])
+
+    def test_card_and_shop_changes(self):
+        """Изменения карты, магазина и его категорий попадают в выдачу."""
+
+        token = self.get_token()
+        Card.objects.filter(pk=self.card.pk).first().save()
+        response = self.sync(token)
+        self.assertEqual(
+            [item['card']['id'] for item in response.data['cards']],
+            [self.card.id],
+        )
+
+        token = response.data['token']
+        self.group.name = 'Renamed group'
+        self.group.save()
+        response = self.sync(token)
+        self.assertEqual(len(response.data['cards']), self.CARDS_USER_HAVE)
+        self.assertEqual(
+            response.data['cards'][0]['card']['shop']['group'][0]['name'],
+            'Renamed group',
+        )
+
+    def test_readded_card_not_deleted(self):
+        """Карта, удаленная и добавленная снова, не считается удаленной."""
+
+        token = self.get_token()
+        user_card = UserCards.objects.get(
+            user=self.user, card=self.card_user_not_own
+        )
+        user_card.delete()
+        user_card.pk = None
+        user_card.save()
+        response = self.sync(token)
+        self.assertEqual(response.data['deleted'], [])
+        self.assertEqual(
+            [item['card']['id'] for item in response.data['cards']],
+            [self.card_user_not_own.id],
+        )
+
+    def test_expired_token_gives_full_sync(self):
+        """Токен старше срока хранения отметок дает полную выдачу."""
+
+        token = make_sync_token(
+            timezone.now() - timedelta(
+                seconds=settings.WALLET_SYNC_TOMBSTONE_TTL + 1
+            )
+        )
+        response = self.sync(token)
+        self.assertTrue(response.data['full'])
+        self.assertEqual(len(response.data['cards']), self.CARDS_USER_HAVE)
+
+    def test_incorrect_token(self):
+        """Поддельный токен отклоняется."""
+
+        response = self.sync('forged-token')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_purge_tombstones(self):
+        """Устаревшие отметки об удалении удаляются командой."""
+
+        UserCards.objects.filter(user=self.user).delete()
+        Tombstone.objects.update(
+            deleted_at=timezone.now() - timedelta(
+                seconds=settings.WALLET_SYNC_TOMBSTONE_TTL + 1
+            )
+        )
+        call_command('purge_tombstones', stdout=StringIO())
+        self.assertFalse(Tombstone.objects.exists())
+
+
+class BarcodeTestCase(APITests):
+    """Проверка отрисовки штрих-кодов карт."""
+
+    EAN = '4006381333931'
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, True)
+        overrider = override_settings(BARCODE_CACHE_DIR=self.cache_dir)
+        overrider.enable()
+        self.addCleanup(overrider.disable)
+        self.card = Card.objects.filter(users=self.user).first()
+        self.card.barcode_number = self.EAN
+        self.card.encoding_type = EAN_13
+        self.card.save()
+
+    def barcode_url(self, card_id=None, file_format='png'):
+        return reverse(
+            'api:card-barcode',
+            kwargs={'pk': card_id or self.card.pk, 'file_format': file_format},
+        )
+
+    def test_check_digits(self):
+        """Контрольные цифры EAN/UPC считаются и проверяются."""
+
+        self.assertEqual(ean_check_digit('400638133393'), '1')
+        self.assertEqual(len(encode_ean13('400638133393')), 95)
+        self.assertEqual(
+            encode_ean13('400638133393'), encode_ean13(self.EAN)
+        )
+        self.assertEqual(upc_e_to_upc_a('0425261'), '04210000526')
+        self.assertEqual(len(encode_upc_e('04252614')), 51)
+        for encoding_type, value in (
+            (EAN_13, '4006381333932'),
+            (EAN_13, '40063813'),
+            (CODE39, 'lower'),
+            ('unknown', '1'),
+        ):
+            with self.subTest(encoding_type=encoding_type, value=value):
+                with self.assertRaises(BarcodeError):
+                    encode_barcode(encoding_type, value)
+
+    def test_code128_sets(self):
+        """Серии цифр кодируются набором C, остальное - набором B."""
+
+        self.assertEqual(
+            code128_values('1234567890'), [105, 12, 34, 56, 78, 90, 85, 106]
+        )
+        self.assertEqual(
+            code128_values('AB12345678CD'),
+            [104, 33, 34, 99, 12, 34, 56, 78, 100, 35, 36, 90, 106],
+        )
+
+    def test_qr(self):
+        """QR-код получает поисковые узоры и подходящую версию."""
+
+        matrix = encode_qr('https://example.com')
+        self.assertEqual(len(matrix), 25)
+        self.assertEqual(matrix[0][:7], [True] * 7)
+        self.assertEqual(matrix[1][:7], [True] + [False] * 5 + [True])
+        with self.assertRaises(QRCodeError):
+            encode_qr('x' * 400)
+
+    def test_render(self):
+        """Код отдается в PNG и SVG и сохраняется в кэше на диске."""
+
+        for file_format, content_type, signature in (
+            ('png', 'image/png', b'\x89PNG'),
+            ('svg', 'image/svg+xml', b'<svg'),
+        ):
+            with self.subTest(file_format=file_format):
+                response = self.auth_client.get(
+                    self.barcode_url(file_format=file_format)
+                )
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response['Content-Type'], content_type)
+                content = b''.join(response.streaming_content)
+                self.assertTrue(content.startswith(signature))
+                self.assertEqual(
+                    response['Cache-Control'], 'private, no-cache'
+                )
+        self.assertEqual(
+            sum(len(files) for _, _, files in os.walk(self.cache_dir)), 2
+        )
+
+    def test_immutable_and_not_modified(self):
+        """Ссылка с хэшем кэшируется бессрочно, ETag дает ответ 304."""
+
+        card = self.auth_client.get(
+            reverse('api:card-detail', kwargs={'pk': self.card.pk})
+        ).data
+        digest = barcode_digest(EAN_13, self.EAN)
+        self.assertEqual(
+            card['barcode'],
+            f'{self.barcode_url(file_format="svg")}?v={digest}',
+        )
+        response = self.auth_client.get(card['barcode'])
+        self.assertIn('immutable', response['Cache-Control'])
+
+        response = self.auth_client.get(
+            self.barcode_url(file_format='svg'),
+            HTTP_IF_NONE_MATCH=response['ETag'],
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_errors(self):
+        """Нет номера или чужая карта - 404, неверный номер - 400."""
+
+        foreign = Card.objects.exclude(users=self.user).first()
+        response = self.auth_client.get(self.barcode_url(foreign.pk))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.card.barcode_number = '123'
+        self.card.save()
+        response = self.auth_client.get(self.barcode_url())
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.card.barcode_number = ''
+        self.card.card_number = '157'
+        self.card.save()
+        response = self.auth_client.get(self.barcode_url())
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_batch(self):
+        """Коды всех карт пользователя отдаются одним ответом."""
+
+        qr_card = Card.objects.filter(users=self.user).last()
+        qr_card.barcode_number = 'Карта 157'
+        qr_card.encoding_type = QR_код
+        qr_card.save()
+        response = self.auth_client.get(
+            reverse('api:card-barcodes'), {'file_format': 'svg'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), self.CARDS_USER_HAVE)
+        for card_id in (self.card.pk, qr_card.pk):
+            self.assertTrue(
+                response.data[card_id]['content'].startswith('<svg')
+            )
+        self.assertEqual(
+            sum('error' in item for item in response.data.values()),
+            self.CARDS_USER_HAVE - 2,
+        )
+
+    def test_render_command(self):
+        """Команда заполняет кэш кодами всех карт."""
+
+        out = StringIO()
+        call_command(
+            'render_barcodes', '--format', 'png', '--workers', '1', stdout=out
+        )
+        self.assertIn('Rendered 1,', out.getvalue())
+        self.assertEqual(
+            sum(len(files) for _, _, files in os.walk(self.cache_dir)), 1
+        )
+
+
+class ThumbnailTestCase(APITests):
+    """Проверка уменьшенных копий изображений."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, True)
+        overrider = override_settings(
+            MEDIA_ROOT=self.media_root, THUMBNAILS_ASYNC=False
+        )
+        overrider.enable()
+        self.addCleanup(overrider.disable)
+        self.card = self.card_user_own
+
+    @staticmethod
+    def make_upload(size=(600, 300), image_format='PNG', exif=None):
+        output = BytesIO()
+        image = Image.new('RGB', size, (200, 30, 30))
+        image.save(output, format=image_format, exif=exif or Image.Exif())
+        return SimpleUploadedFile(
+            f'photo.{image_format.lower()}', output.getvalue()
+        )
+
+    def thumbnail_size(self, name, size, file_format='png'):
+        path = os.path.join(
+            self.media_root, thumbnail_name(name, size, file_format)
+        )
+        with Image.open(path) as image:
+            return image.size
+
+    def test_generated_on_upload(self):
+        """Копии строятся после коммита и не больше заданного размера."""
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.card.image = self.make_upload()
+            self.card.save()
+        name = self.card.image.name
+        self.assertEqual(self.thumbnail_size(name, 64), (64, 32))
+        self.assertEqual(self.thumbnail_size(name, 256), (256, 128))
+        self.assertEqual(self.thumbnail_size(name, 256, 'webp'), (256, 128))
+
+        response = self.auth_client.get(
+            reverse('api:card-detail', kwargs={'pk': self.card.pk})
+        )
+        self.assertTrue(
+            response.data['image_thumbnails']['128']['webp'].endswith(
+                thumbnail_name(name, 128, 'webp')
+            )
+        )
+        self.assertIn('logo_thumbnails', response.data['shop'])
+
+    def test_exif_orientation(self):
+        """Ориентация из EXIF применяется, мелкие файлы не растягиваются."""
+
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        self.card.image = self.make_upload((200, 100), 'JPEG', exif)
+        self.card.save()
+        self.assertEqual(generate_thumbnails(self.card.image.name), 6)
+        self.assertEqual(
+            self.thumbnail_size(self.card.image.name, 256), (100, 200)
+        )
+
+    @override_settings(THUMBNAILS_ASYNC=True)
+    def test_generated_in_pool(self):
+        """Пул запускается без fork и пишет копии в текущее хранилище."""
+
+        self.assertNotEqual(pool_context().get_start_method(), 'fork')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.card.image = self.make_upload()
+            self.card.save()
+        shutdown_executor()
+        self.assertEqual(
+            self.thumbnail_size(self.card.image.name, 64), (64, 32)
+        )
+
+    def test_backfill_command(self):
+        """Команда строит копии для уже загруженных изображений."""
+
+        Shop.objects.update(logo='')
+        Card.objects.update(image='')
+        self.card.image = self.make_upload()
+        self.card.save()
+        out = StringIO()
+        call_command('make_thumbnails', '--workers', '1', stdout=out)
+        self.assertIn('Processed 1 images', out.getvalue())
+        call_command('make_thumbnails', '--workers', '1', stdout=out)
+        self.assertIn('Processed 0 images', out.getvalue())
+
+
+class CardPhotoTestCase(APITests):
+    """Проверка нормализации фото карты при загрузке."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, True)
+        overrider = override_settings(MEDIA_ROOT=self.media_root)
+        overrider.enable()
+        self.addCleanup(overrider.disable)
+
+    def upload(self, image, image_format, **params):
+        output = BytesIO()
+        image.save(output, format=image_format, **params)
+        upload = SimpleUploadedFile(
+            f'photo.{image_format.lower()}', output.getvalue()
+        )
+        response = self.auth_client.patch(
+            reverse('api:card-detail', kwargs={'pk': self.card.pk}),
+            {'image': upload, 'card_number': self.card.card_number},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.card.refresh_from_db()
+        return Image.open(self.card.image.path)
+
+    def test_photo_normalized(self):
+        """EXIF применяется и удаляется, размер ограничивается."""
+
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'Phone Maker'
+        photo = Image.effect_noise((3000, 1000), 64).convert('RGB')
+        with self.assertLogs('core.images', 'INFO') as logs:
+            stored = self.upload(photo, 'JPEG', exif=exif, quality=100)
+        self.assertTrue(self.card.image.name.endswith('.jpg'))
+        self.assertEqual(stored.size, (533, 1600))
+        self.assertEqual(dict(stored.getexif()), {})
+        self.assertIn('saved', logs.output[0])
+
+    def patch_image(self, name, content):
+        return self.auth_client.patch(
+            reverse('api:card-detail', kwargs={'pk': self.card.pk}),
+            {
+                'image': SimpleUploadedFile(name, content),
+                'card_number': self.card.card_number,
+            },
+        )
+
+    def test_undecodable_image_rejected(self):
+        """Поврежденный файл отклоняется с 400, а не падает с 500."""
+
+        output = BytesIO()
+        Image.effect_noise((300, 300), 64).convert('RGB').save(
+            output, format='JPEG'
+        )
+        truncated = output.getvalue()[:len(output.getvalue()) // 2]
+        for in_pool in (True, False):
+            with self.subTest(in_pool=in_pool), override_settings(
+                IMAGE_NORMALIZE_IN_POOL=in_pool
+            ):
+                response = self.patch_image('photo.jpg', truncated)
+                self.assertEqual(
+                    response.status_code, status.HTTP_400_BAD_REQUEST
+                )
+                self.assertEqual(
+                    response.data['detail']['image'],
+                    [ErrorMessage.INCORRECT_IMAGE],
+                )
+
+    def test_broken_pool_replaced(self):
+        """Сломанный пул дает 400 и заменяется новым."""
+
+        output = BytesIO()
+        Image.new('RGB', (10, 10)).save(output, format='PNG')
+        broken = mock.Mock()
+        broken.submit.return_value.result.side_effect = BrokenProcessPool
+        with mock.patch('core.images._executor', broken):
+            response = self.patch_image('photo.png', output.getvalue())
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST
+            )
+            self.assertIsNone(images._executor)
+        broken.shutdown.assert_called_once()
+        response = self.patch_image('photo.png', output.getvalue())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_bytes_saved_recorded(self):
+        """Размер до и после нормализации попадает в метрики."""
+
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir, True)
+        with override_settings(METRICS_DIR=metrics_dir):
+            self.addCleanup(registry.reset)
+            photo = Image.effect_noise((2000, 1000), 64).convert('RGB')
+            self.upload(photo, 'JPEG', quality=100)
+            samples = registry.collect()
+        received = samples['card_photo_bytes_total', (('stage', 'received'),)]
+        stored = samples['card_photo_bytes_total', (('stage', 'stored'),)]
+        self.assertEqual(stored, self.card.image.size)
+        self.assertGreater(received, stored)
+
+    @override_settings(IMAGE_NORMALIZE_IN_POOL=False)
+    def test_transparent_image_kept_png(self):
+        """Изображение с прозрачностью сохраняется в PNG."""
+
+        stored = self.upload(Image.new('RGBA', (100, 50)), 'PNG')
+        self.assertTrue(self.card.image.name.endswith('.png'))
+        self.assertEqual((stored.mode, stored.size), ('RGBA', (100, 50)))
+
+
+class BlobStorageTestCase(APITests):
+    """Проверка хранения загрузок по хэшу содержимого."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, True)
+        overrider = override_settings(
+            MEDIA_ROOT=self.media_root, THUMBNAILS_ASYNC=False
+        )
+        overrider.enable()
+        self.addCleanup(overrider.disable)
+
+    def test_fixtures_deduplicated(self):
+        """Одинаковые загрузки хранятся одним файлом с общим счетчиком."""
+
+        names = set(Card.objects.values_list('image', flat=True)) | set(
+            Shop.objects.values_list('logo', flat=True)
+        )
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertTrue(name.startswith(f'{BLOB_DIR}/'))
+        self.assertTrue(name.endswith('.gif'))
+        self.assertEqual(
+            Blob.objects.get(name=name).references,
+            Card.objects.count() + Shop.objects.count(),
+        )
+
+    def test_reference_counting(self):
+        """Файл удаляется вместе с последней ссылкой и копиями."""
+
+        output = BytesIO()
+        Image.new('RGB', (10, 10)).save(output, format='PNG')
+        cards = Card.objects.filter(users=self.user)[:2]
+        with self.captureOnCommitCallbacks(execute=True):
+            for card in cards:
+                card.image = SimpleUploadedFile(
+                    'same.png', output.getvalue()
+                )
+                card.save()
+        name = cards[0].image.name
+        self.assertEqual(cards[1].image.name, name)
+        self.assertEqual(Blob.objects.get(name=name).references, 2)
+        self.assertTrue(blob_storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cards[0].delete()
+        self.assertEqual(Blob.objects.get(name=name).references, 1)
+        self.assertTrue(blob_storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cards[1].image = ''
+            cards[1].save()
+        self.assertFalse(Blob.objects.filter(name=name).exists())
+        self.assertFalse(blob_storage.exists(name))
+        self.assertFalse(
+            default_storage.exists(thumbnail_name(name, 64, 'png'))
+        )
+
+    def test_same_content_reuploaded(self):
+        """Повторная загрузка того же файла не оставляет лишней ссылки."""
+
+        output = BytesIO()
+        Image.new('RGB', (10, 10)).save(output, format='PNG')
+        card = Card.objects.filter(users=self.user).first()
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                card.image = SimpleUploadedFile('same.png', output.getvalue())
+                card.save()
+        name = card.image.name
+        self.assertEqual(Blob.objects.get(name=name).references, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            card.delete()
+        self.assertFalse(Blob.objects.filter(name=name).exists())
+        self.assertFalse(blob_storage.exists(name))
+
+    def test_reference_rolled_back_with_row(self):
+        """Ссылка не учитывается, если строку не удалось записать."""
+
+        output = BytesIO()
+        Image.new('RGB', (12, 12)).save(output, format='PNG')
+        card = Card.objects.filter(users=self.user).first()
+        card.image = SimpleUploadedFile('failed.png', output.getvalue())
+        with mock.patch.object(
+            Card, '_do_update', side_effect=DatabaseError
+        ), self.assertRaises(DatabaseError):
+            card.save()
+        self.assertFalse(
+            Blob.objects.filter(name__endswith='.png').exists()
+        )
+
+    def test_dedupe_command(self):
+        """Команда переносит старые файлы в хранилище по хэшу."""
+
+        legacy = default_storage.save('card/legacy.gif', ContentFile(b'gif'))
+        Card.objects.filter(users=self.user).update(image=legacy)
+        out = StringIO()
+        call_command('dedupe_media', stdout=out)
+        self.assertIn('Moved 1 files', out.getvalue())
+        self.assertFalse(default_storage.exists(legacy))
+        name = Card.objects.filter(users=self.user).first().image.name
+        self.assertTrue(blob_storage.exists(name))
+        self.assertEqual(
+            Blob.objects.get(name=name).references, self.CARDS_USER_HAVE
+        )
+
+
+class JSONRenderingTestCase(APITests):
+    """Проверка быстрого кодирования и разбора JSON."""
+
+    DATA = {
+        'pub_date': timezone.make_aware(datetime(2023, 5, 1, 12, 30, 1, 5)),
+        'naive': datetime(2023, 5, 1),
+        'day': date(2023, 5, 1),
+        'message': gettext_lazy('This field is required.'),
+        'detail': ErrorDetail('Нет данных.', code='not_found'),
+        'price': Decimal('1.50'),
+        'uuid': uuid.UUID(int=1),
+        'separators': 'a b c',
+        1: (1.5, None, True),
+    }
+
+    def assert_same_output(self, data):
+        self.assertEqual(
+            FastJSONRenderer().render(data), JSONRenderer().render(data)
+        )
+
+    def test_output_identical(self):
+        """Вывод совпадает с JSONRenderer до байта, в том числе без orjson."""
+
+        response = self.auth_client.get(self.CARDS_URL)
+        self.assertEqual(
+            response.content, JSONRenderer().render(response.data)
+        )
+        for value in self.DATA.values():
+            self.assert_same_output(value)
+        self.assert_same_output(self.DATA)
+        self.assert_same_output([2 ** 70])
+        with mock.patch('api.renderers.orjson', None):
+            self.assert_same_output(self.DATA)
+
+    def test_indent_requested(self):
+        """Отступы по запросу клиента обрабатывает JSONRenderer."""
+
+        media_type = 'application/json; indent=2'
+        self.assertEqual(
+            FastJSONRenderer().render(self.DATA, media_type),
+            JSONRenderer().render(self.DATA, media_type),
+        )
+
+    def test_parser(self):
+        """Разбор совпадает с JSONParser, NaN и мусор отклоняются."""
+
+        content = '{"title": "Магазин", "items": [1, 2.5, null]}'
+        for parser in (FastJSONParser, JSONParser):
+            for encoding in ('utf-8', 'utf-16'):
+                self.assertEqual(
+                    parser().parse(
+                        BytesIO(content.encode(encoding)),
+                        parser_context={'encoding': encoding},
+                    ),
+                    json.loads(content),
+                )
+        for invalid in (b'{"value": NaN}', b'{"value":'):
+            with self.assertRaises(ParseError):
+                FastJSONParser().parse(BytesIO(invalid))
+        with mock.patch('api.parsers.orjson', None):
+            with self.assertRaises(ParseError):
+                FastJSONParser().parse(BytesIO(b'{"value": NaN}'))
+
+    def test_bench_command(self):
+        """Команда сравнивает вывод и время обоих рендереров."""
+
+        out = StringIO()
+        call_command('bench_json', repeat=1, stdout=out)
+        self.assertIn('cards:', out.getvalue())
+        self.assertIn('shops:', out.getvalue())
+
+
+class DatasetTestCase(APITests):
+    """Проверка генератора синтетических данных."""
+
+    def generate(self, **options):
+        options = {
+            'users': 20,
+            'cards_per_user': 5,
+            'shops': 10,
+            'groups': 4,
+            'share_ratio': 0.5,
+            'seed': 7,
+            'batch_size': 16,
+            **options,
+        }
+        out = StringIO()
+        call_command(
+            'generate_dataset',
+            *(
+                f'--{name.replace("_", "-")}={value}'
+                for name, value in options.items()
+            ),
+            stdout=out,
+        )
+        return out.getvalue()
+
+    def snapshot(self):
+        return list(
+            UserCards.objects.filter(
+                user__email__endswith='dataset.example.com'
+            )
+            .order_by('user__email', 'card__name')
+            .values_list(
+                'user__email',
+                'card__name',
+                'card__shop__name',
+                'card__barcode_number',
+                'card__pub_date',
+                'owner',
+                'favourite',
+                'shared_by__email',
+            )
+        )
+
+    def test_deterministic(self):
+        """Одинаковый seed на той же базе дает одинаковые данные."""
+
+        with transaction.atomic():
+            self.generate()
+            first = self.snapshot()
+            transaction.set_rollback(True)
+        self.generate()
+        self.assertEqual(first, self.snapshot())
+        with transaction.atomic():
+            UserCards.objects.filter(
+                user__email__endswith='dataset.example.com'
+            ).delete()
+            self.generate(seed=8)
+            self.assertNotEqual(first, self.snapshot())
+            transaction.set_rollback(True)
+
+    def test_caches_invalidated(self):
+        """Сбрасывается только каталог: у новых id нет кэша списков."""
+
+        catalog_version = get_catalog_version()
+        with mock.patch('core.signals.bump_wallet_versions') as bump:
+            self.generate()
+        self.assertNotEqual(get_catalog_version(), catalog_version)
+        bump.assert_not_called()
+
+    def test_generated_data(self):
+        users_before = User.objects.count()
+        cards_before = Card.objects.count()
+        out = self.generate()
+        self.assertIn('users.User: 20 rows', out)
+        users = User.objects.filter(email__endswith='dataset.example.com')
+        self.assertEqual(users.count(), 20)
+        self.assertEqual(User.objects.count(), users_before + 20)
+        self.assertTrue(users.first().check_password(DATASET_PASSWORD))
+        cards = Card.objects.count() - cards_before
+        self.assertIn(f'core.Card: {cards} rows', out)
+        self.assertEqual(
+            UserCards.objects.filter(
+                user__in=users, owner=True
+            ).count(),
+            cards,
+        )
+        self.assertTrue(
+            UserCards.objects.filter(
+                user__in=users, owner=False, shared_by__isnull=False
+            ).exists()
+        )
+        self.assertFalse(
+            UserCards.objects.filter(
+                user__in=users, pub_date__gt=DATASET_EPOCH
+            ).exists()
+        )
+        shops = Shop.objects.filter(name__startswith='Shop ')
+        for shop in shops:
+            self.assertTrue(1 <= shop.group.count() <= 3)
+            self.assertEqual(shop.normalized_name, search_key(shop.name))
+        popular = shops.annotate(total=Count('card')).order_by('id')
+        self.assertGreater(popular[0].total, popular[9].total)
+
+        new_card = Card.objects.create(
+            name='After dataset', shop=shops.first()
+        )
+        self.assertGreater(new_card.pub_date, DATASET_EPOCH)
+        self.assertEqual(
+            Card.objects.aggregate(Max('id'))['id__max'], new_card.id
+        )
+
+    def test_copy_needs_postgresql(self):
+        with self.assertRaisesMessage(CommandError, 'PostgreSQL'):
+            self.generate(method='copy')
+
+    def test_copy_value(self):
+        self.assertEqual(copy_value(None), r'\N')
+        self.assertEqual(copy_value(True), 't')
+        self.assertEqual(copy_value('a\tb\nc\\'), 'a\\tb\\nc\\\\')
+
+
+class BenchApiTestCase(APITests):
+    """Проверка замера API на синтетических данных."""
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.output = os.path.join(self.directory, 'bench.json')
+        self.baseline = os.path.join(self.directory, 'baseline.json')
+
+    def bench(self, **options):
+        call_command(
+            'bench_api',
+            users=3,
+            cards_per_user=2,
+            shops=3,
+            groups=2,
+            requests=1,
+            warmup=0,
+            output=self.output,
+            baseline=self.baseline,
+            current_database=True,
+            stdout=StringIO(),
+            **options,
+        )
+        with open(self.output) as report_file:
+            return json.load(report_file)
+
+    def test_all_actions_succeed(self):
+        report = self.bench(update_baseline=True)
+        self.assertTrue(os.path.exists(self.baseline))
+        for action in (
+            'card-list GET',
+            'card-detail DELETE',
+            'card-import POST',
+            'shop-detail PATCH',
+            'group-detail GET',
+            'user-activation POST',
+            'user-set-password POST',
+        ):
+            self.assertIn(action, report['results'])
+        for action, result in report['results'].items():
+            self.assertEqual(result['errors'], 0, action)
+            self.assertEqual(result['requests'], 1)
+
+    def test_regressions(self):
+        report = self.bench(update_baseline=True)
+        report['results']['card-list GET']['queries'] -= 1
+        report['results']['user-me GET']['bytes'] = 1
+        with open(self.baseline, 'w') as baseline_file:
+            json.dump(report, baseline_file)
+        with self.assertRaisesMessage(CommandError, '2 regressions'):
+            self.bench(latency_tolerance=1000)
+
+        report['options']['seed'] = 1
+        with open(self.baseline, 'w') as baseline_file:
+            json.dump(report, baseline_file)
+        self.bench()
+
+
+class WalletReadTestCase(APIShopEditTests):
+    """Проверка быстрой выдачи списка карт из строк .values()."""
+
+    def setUp(self):
+        super().setUp()
+        UserCards.objects.filter(
+            user=self.user, card=self.card_unvalidated_from_friend
+        ).update(shared_by=self.another_user)
+        self.shop_validated.group.set(Group.objects.all()[:3])
+        Card.objects.filter(pk=self.card.pk).update(image='')
+        UserCards.objects.create(
+            user=self.another_user, card=self.card, owner=False
+        )
+
+    def assert_same_as_serializer(self, data, user_cards):
+        self.assertEqual(
+            JSONRenderer().render(data),
+            JSONRenderer().render(
+                CardsListSerializer(user_cards, many=True).data
+            ),
+        )
+
+    def test_parity_with_serializer(self):
+        """Вывод совпадает с CardsListSerializer для всех пользователей."""
+
+        for user in User.objects.all():
+            user_cards = UserCards.objects.filter(user=user).order_by(
+                '-pub_date', '-id'
+            )
+            with self.subTest(user=user.email):
+                self.assert_same_as_serializer(
+                    serialize_wallet(wallet_rows(user_cards)), user_cards
+                )
+
+    def test_endpoints_parity(self):
+        """Список, избранное и синхронизация отдают прежний формат."""
+
+        user_cards = UserCards.objects.filter(user=self.user).order_by(
+            '-pub_date', '-id'
+        )
+        for url, queryset in (
+            (self.CARDS_URL, user_cards),
+            (reverse('api:card-favorites'), user_cards.filter(favourite=True)),
+        ):
+            response = self.auth_client.get(url, {'page_size': 100})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assert_same_as_serializer(
+                response.data['results'], queryset
+            )
+
+        response = self.auth_client.get(reverse('api:card-sync'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['full'])
+        self.assert_same_as_serializer(
+            response.data['cards'], UserCards.objects.filter(user=self.user)
+        )
+
+    def test_paginated_by_rows(self):
+        """Курсор строится по строкам .values() без потери карт."""
+
+        ids, url = [], f'{self.CARDS_URL}?page_size=4'
+        while url:
+            response = self.auth_client.get(url)
+            ids.extend(item['card']['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(
+            ids,
+            list(
+                UserCards.objects.filter(user=self.user)
+                .order_by('-pub_date', '-id')
+                .values_list('card_id', flat=True)
+            ),
+        )
+
+    def test_queries_do_not_grow(self):
+        """Число запросов не зависит от числа карт и магазинов."""
+
+        user_cards = UserCards.objects.filter(user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            serialize_wallet(wallet_rows(user_cards))
+        self.assertEqual(len(queries), 3)
+
+
+class QueryBudgetTestCase(APIShopEditTests):
+    """Проверка бюджетов запросов к базе по эндпоинтам и действиям.
+
+    Бюджет - наибольшее число запросов при пустом кэше на данных
+    фикстур. Новое действие без бюджета в QUERY_BUDGETS роняет тест.
+    """
+
+    QUERY_BUDGETS = {
+        ('user-me', 'get'): 0,
+        ('user-me', 'patch'): 4,
+        ('card-list', 'get'): 3,
+        ('card-favorites', 'get'): 3,
+        ('card-sync', 'get'): 3,
+        ('card-export', 'get'): 1,
+        ('card-barcodes', 'get'): 1,
+        ('card-detail', 'get'): 2,
+        ('card-barcode', 'get'): 2,
+        ('card-detail', 'patch'): 5,
+        ('card-favorite', 'post'): 5,
+        ('card-favorite', 'delete'): 5,
+        ('card-statistics', 'patch'): 5,
+        ('card-bulk-statistics', 'patch'): 2,
+        ('card-share', 'post'): 5,
+        ('card-share-bulk', 'post'): 7,
+        ('card-list', 'post'): 5,
+        ('card-create-with-new-shop', 'post'): 9,
+        ('card-detail', 'delete'): 8,
+        ('shop-list', 'get'): 3,
+        ('shop-detail', 'get'): 0,
+        # Индекс магазинов догоняет магазин, созданный вместе с картой.
+        ('shop-autocomplete', 'get'): 3,
+        ('shop-detail', 'patch'): 6,
+        ('group-list', 'get'): 3,
+        ('group-detail', 'get'): 0,
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.barcode_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.barcode_dir, True)
+        overrider = override_settings(
+            BARCODE_CACHE_DIR=self.barcode_dir,
+            CATALOG_SNAPSHOT_ASYNC=False,
+        )
+        overrider.enable()
+        self.addCleanup(overrider.disable)
+        Card.objects.filter(pk=self.card_user_own.pk).update(
+            barcode_number='4006381333931'
+        )
+
+    def endpoint_requests(self):
+        """(маршрут, метод, kwargs маршрута, тело) в порядке выполнения."""
+
+        own = {'pk': self.card_user_own.pk}
+        not_fav = {'pk': self.card_user_not_fav.pk}
+        shop = {'pk': self.shop.pk}
+        return (
+            ('user-me', 'get', {}, None),
+            ('user-me', 'patch', {}, {'name': 'Budget'}),
+            ('card-list', 'get', {}, None),
+            ('card-favorites', 'get', {}, None),
+            ('card-sync', 'get', {}, None),
+            ('card-export', 'get', {}, None),
+            ('card-barcodes', 'get', {}, {'file_format': 'svg'}),
+            ('card-detail', 'get', own, None),
+            ('card-barcode', 'get', {**own, 'file_format': 'svg'}, None),
+            ('card-detail', 'patch', own, {'card_number': '42'}),
+            ('card-favorite', 'post', not_fav, None),
+            ('card-favorite', 'delete', not_fav, None),
+            ('card-statistics', 'patch', own, {'usage_counter': 5}),
+            (
+                'card-bulk-statistics',
+                'patch',
+                {},
+                {own['pk']: 7},
+            ),
+            (
+                'card-share',
+                'post',
+                own,
+                {'email': self.another_user.email},
+            ),
+            (
+                'card-share-bulk',
+                'post',
+                own,
+                {'emails': [
+                    self.another_user.email,
+                    self.unactivated_user.email,
+                    self.EMAIL_NOT_OF_A_USER,
+                ]},
+            ),
+            (
+                'card-list',
+                'post',
+                {},
+                {'name': 'Budget', 'shop': self.shop.pk, 'card_number': '1'},
+            ),
+            (
+                'card-create-with-new-shop',
+                'post',
+                {},
+                {'name': 'Budget', 'shop': {'name': 'Budget Shop'},
+                 'card_number': '2'},
+            ),
+            ('card-detail', 'delete', own, None),
+            ('shop-list', 'get', {}, None),
+            ('shop-detail', 'get', shop, None),
+            ('shop-autocomplete', 'get', {}, {'q': 'test'}),
+            (
+                'shop-detail',
+                'patch',
+                {'pk': self.shop_unvalidated.pk},
+                {'name': 'Budget Shop Renamed'},
+            ),
+            ('group-list', 'get', {}, None),
+            ('group-detail', 'get', {'pk': self.group.pk}, None),
+        )
+
+    def test_query_budgets(self):
+        """Эндпоинты укладываются в бюджет и не повторяют запросы."""
+
+        requested = set()
+        for name, method, kwargs, data in self.endpoint_requests():
+            requested.add((name, method))
+            budget = self.QUERY_BUDGETS[(name, method)]
+            url = reverse(f'api:{name}', kwargs=kwargs)
+            with self.subTest(endpoint=name, method=method):
+                with QueryRecorder() as recorder:
+                    response = getattr(self.auth_client, method)(
+                        url, data, format=None if method == 'get' else 'json'
+                    )
+                    content = (
+                        b''.join(response.streaming_content)
+                        if response.streaming else response.content
+                    )
+                self.assertLess(response.status_code, 400, content)
+                queries = '\n'.join(sql for sql, _ in recorder.queries)
+                self.assertLessEqual(
+                    len(recorder), budget,
+                    f'{len(recorder)} queries over budget {budget}:\n'
+                    f'{queries}',
+                )
+                self.assertEqual(
+                    recorder.repeated(settings.N_PLUS_ONE_THRESHOLD), [],
+                )
+        self.assertEqual(requested, set(self.QUERY_BUDGETS))
+
+    def test_inspector_logs_repeated_queries(self):
+        """Middleware пишет в лог повторы с местом вызова."""
+
+        def view(request):
+            for card in Card.objects.all()[:3]:
+                card.shop.name
+            return HttpResponse()
+
+        with self.assertRaises(MiddlewareNotUsed):
+            QueryInspectorMiddleware(view)
+        with override_settings(N_PLUS_ONE_DETECTION=True):
+            middleware = QueryInspectorMiddleware(view)
+            with self.assertLogs('api.middleware', 'WARNING') as logs:
+                middleware(RequestFactory().get('/api/v1/cards/'))
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('3x on GET /api/v1/cards/', logs.output[0])
+        self.assertIn('api/tests/test_api.py', logs.output[0])
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE a IN (%s, %s) AND b = 'x'"),
+            fingerprint('SELECT * FROM t WHERE a IN (%s)  AND b = 12'),
+        )
+
+
+class RequestProfilerTestCase(APITests):
+    """Проверка профилирования запросов по заголовку."""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings_override = override_settings(
+            REQUEST_PROFILING=True, REQUEST_PROFILE_DIR=directory
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.staff = User.objects.create_user(
+            email='staff@example.com',
+            password='StaffPass1',
+            is_staff=True,
+            is_active=True,
+        )
+        self.staff_client = APIClient()
+        self.staff_client.credentials(
+            HTTP_AUTHORIZATION=(
+                f'Token {Token.objects.create(user=self.staff).key}'
+            )
+        )
+
+    def profile(self, client=None, **headers):
+        return (client or self.staff_client).get(
+            reverse('api:group-list'), **headers
+        )
+
+    def test_staff_request_profiled(self):
+        response = self.profile(HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual(profile.user, self.staff)
+        self.assertEqual(profile.method, 'GET')
+        self.assertEqual(profile.path, reverse('api:group-list'))
+        self.assertEqual(profile.status_code, 200)
+        self.assertGreater(profile.query_count, 0)
+        self.assertEqual(profile.query_count, len(profile.queries))
+        self.assertIn('SELECT', profile.queries[0]['sql'])
+        self.assertTrue(profile.top_functions)
+        self.assertGreaterEqual(
+            profile.top_functions[0]['own_ms'],
+            profile.top_functions[-1]['own_ms'],
+        )
+        stats = pstats.Stats(artifact_path(profile.artifact))
+        self.assertTrue(stats.stats)
+
+    def test_other_requests_not_profiled(self):
+        user_client = APIClient()
+        user_client.force_authenticate(self.user)
+        for response in (
+            self.profile(),
+            self.profile(user_client, HTTP_X_PROFILE='1'),
+            self.profile(APIClient(), HTTP_X_PROFILE='1'),
+        ):
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    @override_settings(REQUEST_PROFILE_KEEP=1)
+    def test_old_profiles_deleted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = RequestProfile.objects.get(
+                pk=self.profile(HTTP_X_PROFILE='1')['X-Profile-Id']
+            )
+            second = self.profile(HTTP_X_PROFILE='1')['X-Profile-Id']
+        self.assertEqual(
+            list(RequestProfile.objects.values_list('pk', flat=True)),
+            [int(second)],
+        )
+        self.assertFalse(os.path.exists(artifact_path(first.artifact)))
+
+    def test_admin(self):
+        profile = RequestProfile.objects.get(
+            pk=self.profile(HTTP_X_PROFILE='1')['X-Profile-Id']
+        )
+        admin_user = User.objects.create_superuser(
+            email='admin@example.com', password='AdminPass1'
+        )
+        self.client.force_login(admin_user)
+        response = self.client.get(
+            reverse('admin:core_requestprofile_changelist')
+        )
+        self.assertContains(response, profile.path)
+        response = self.client.get(
+            reverse('admin:core_requestprofile_change', args=(profile.pk,))
+        )
+        self.assertContains(response, profile.top_functions[0]['function'])
+        response = self.client.get(
+            reverse('admin:core_requestprofile_artifact', args=(profile.pk,))
+        )
+        with open(artifact_path(profile.artifact), 'rb') as artifact:
+            self.assertEqual(
+                b''.join(response.streaming_content), artifact.read()
+            )
+
+    @override_settings(REQUEST_PROFILING=False)
+    def test_disabled(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            RequestProfilerMiddleware(lambda request: HttpResponse())
+
+    def test_flag_parsed(self):
+        """Строка false в окружении выключает профилирование."""
+
+        for value, expected in (
+            ('false', False),
+            ('0', False),
+            ('True', True),
+            ('yes', True),
+        ):
+            with mock.patch.dict(os.environ, REQUEST_PROFILING=value):
+                self.assertIs(env_bool('REQUEST_PROFILING'), expected)
+        with mock.patch.dict(os.environ):
+            os.environ.pop('REQUEST_PROFILING', None)
+            self.assertIs(env_bool('REQUEST_PROFILING'), False)
+
+
+class MetricsTestCase(APITests):
+    """Проверка метрик Prometheus."""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings_override = override_settings(
+            METRICS_DIR=directory, METRICS_TOKEN='secret'
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(registry.reset)
+
+    def scrape(self, authorization='Bearer secret'):
+        return APIClient().get(
+            reverse('api:metrics'), HTTP_AUTHORIZATION=authorization
+        )
+
+    def test_request_recorded(self):
+        self.assertEqual(
+            self.auth_client.get(reverse('api:card-list')).status_code,
+            status.HTTP_200_OK,
+        )
+        response = self.scrape()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], CONTENT_TYPE)
+        text = response.content.decode()
+        labels = 'method="GET",status="200",view="CardViewSet.list"'
+        self.assertIn(
+            '# TYPE http_request_duration_seconds histogram', text
+        )
+        self.assertIn(
+            f'http_request_duration_seconds_count{{{labels}}} 1', text
+        )
+        self.assertIn(
+            f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 1',
+            text,
+        )
+        self.assertRegex(
+            text, r'db_queries_total\{view="CardViewSet.list"\} [1-9]'
+        )
+
+    def test_histogram_buckets_cumulative(self):
+        request_latency.observe(0.02, view='test', method='GET', status=200)
+        request_latency.observe(3, view='test', method='GET', status=200)
+        samples = dict(
+            (labels[-1][1], value)
+            for name, labels, value in request_latency.samples(
+                registry.collect()
+            )
+            if name.endswith('_bucket') and ('view', 'test') in labels
+        )
+        self.assertEqual(samples['0.01'], 0)
+        self.assertEqual(samples['0.025'], 1)
+        self.assertEqual(samples['2.5'], 1)
+        self.assertEqual(samples['5'], 2)
+        self.assertEqual(samples['+Inf'], 2)
+
+    def test_values_survive_reopen(self):
+        path = os.path.join(settings.METRICS_DIR, 'test.db')
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        metrics_file = MetricsFile(path)
+        metrics_file.add('first', 1)
+        metrics_file.add('второй' * 100000, 2.5)
+        metrics_file.add('first', 1)
+        metrics_file.close()
+        metrics_file = MetricsFile(path)
+        metrics_file.add('first', 1)
+        metrics_file.close()
+        with open(path, 'rb') as file:
+            entries = {
+                key: value for key, _, value in read_entries(file.read())
+            }
+        self.assertEqual(entries, {'first': 3, 'второй' * 100000: 2.5})
+
+    def test_gauges(self):
+        wallet_cache_stats.hit()
+        wallet_cache_stats.hit()
+        wallet_cache_stats.hit()
+        wallet_cache_stats.miss()
+        enqueue_emails([
+            EmailMultiAlternatives(
+                subject='Тема', body='Текст', to=['metrics@example.com']
+            )
+        ])
+        text = self.scrape().content.decode()
+        self.assertIn('cache_hit_ratio{cache="wallet"} 0.75', text)
+        self.assertIn(f'outbox_emails{{status="{OUTBOX_PENDING}"}} 1', text)
+        self.assertIn(f'outbox_emails{{status="{OUTBOX_SENT}"}} 0', text)
+
+    def test_token_required(self):
+        self.assertEqual(
+            self.scrape('').status_code, status.HTTP_401_UNAUTHORIZED
+        )
+        self.assertEqual(
+            self.scrape('Bearer wrong').status_code,
+            status.HTTP_401_UNAUTHORIZED,
+        )
+        self.assertEqual(self.scrape().status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_not_served_without_token(self):
+        """Без настроенного токена метрики закрыты для всех."""
+
+        self.assertEqual(self.scrape().status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(
+            self.scrape('').status_code, status.HTTP_404_NOT_FOUND
+        )
+        staff = User.objects.create_user(
+            email='metrics@example.com',
+            password='StaffPass1',
+            is_staff=True,
+            is_active=True,
+        )
+        client = APIClient()
+        client.force_login(staff)
+        self.assertEqual(
+            client.get(reverse('api:metrics')).status_code,
+            status.HTTP_404_NOT_FOUND,
+        )
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        self.assertEqual(self.scrape().status_code, status.HTTP_404_NOT_FOUND)
+        with self.assertRaises(MiddlewareNotUsed):
+            MetricsMiddleware(lambda request: HttpResponse())
+        request_latency.observe(1, view='test', method='GET', status=200)
+        self.assertFalse(os.listdir(settings.METRICS_DIR))
+
+
+class ShopEditTestCase(APIShopEditTests):
+    """Проверка редактирования неверифицированного магазина."""
+
+    def test_unvalidated_shop_edit(self):
+        """Пользователь, создавший магазин, может его редактировать."""
+        response = self.auth_client.patch(
+            reverse(
+                'api:shop-detail',
+                kwargs={'pk': f'{self.shop_unvalidated.id}'},
+            ),
+            {
+                'name': 'New shop name',
+                'group': f'{self.group.id}'
+            }
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.shop_unvalidated.refresh_from_db()
+        self.assertEqual(self.shop_unvalidated.name, 'New shop name')
+        group = self.shop_unvalidated.group.all()[0]
+        self.assertEqual(group, self.group)
+
+    def test_unvalidated_friends_shop_not_edit(self):
+        """Пользователь не может редактировать магазин расшаренной карты."""
+
+        response = self.auth_client.patch(
+            reverse(
+                'api:shop-detail',
+                kwargs={'pk': f'{self.shop_unvalidated_from_friends_card.id}'},
+            ),
+            {
+                'name': 'New shop name',
+                'group': f'{self.group.id}'
+            }
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_validated_shop_not_edit(self):
+        """Пользователь не может редактировать предустановленный магазин."""
+
+        response = self.auth_client.patch(
+            reverse(
+                'api:shop-detail',
+                kwargs={'pk': f'{self.shop_validated.id}'},
+            ),
+            {
+                'name': 'New shop name',
+                'group': f'{self.group.id}'
+            }
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class CustomizedDjoserTestCase(APITests):
+    """Проверка кастомизированных ручек Djoser."""
+
+    def test_unactivated_user_can_login(self):
+        """Неактивированный пользователь может залогиниться."""
+
+        response = self.client.post(
+            reverse('api:login'),
+            {'email': self.unactivated_user.email,
+             'password': 'TestPass2'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_password_recovery(self):
+        """Пользователь может запросить восстановление пароля."""
+
+        users_phone = self.user.phone_number
+        response = self.client.post(
+            reverse('api:user-reset-password'),
+            {
+                'email': self.user.email,
+                'phone_last_digits': users_phone[-4:]
+            },
+            format='json'
+        )
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_204_NO_CONTENT,
+            'Не удалось отправить запрос на смену пароля.'
+        )
+
+    def get_mail_context(self, message):
+        """Достает uid и токен из ссылки активации в письме."""
+
+        match = re.search(
+            r'activate/(?P<uid>[^/\s]+)/(?P<token>[^/\s"<]+)',
+            message.body,
         )
+        self.assertIsNotNone(match, 'В письме нет ссылки активации.')
+        return match.groupdict()
 
     def check_activation(self, mail_context, email):
         uid = mail_context['uid']
@@ -523,13 +3387,14 @@ class CustomizedDjoserTestCase(APITests):
             }
         )
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.send_outbox()
         self.assertEqual(
             len(mail.outbox),
             1,
             'Не удалось отправить письмо для активации.'
         )
         self.assertIn(email, mail.outbox[0].recipients())
-        mail_context = mail.outbox[0].get_context_data()
+        mail_context = self.get_mail_context(mail.outbox[0])
         self.assertIn('uid', mail_context)
         self.assertIn('token', mail_context)
         self.check_activation(mail_context=mail_context, email=email)
@@ -538,6 +3403,7 @@ class CustomizedDjoserTestCase(APITests):
         """Пользователь может активировать почту."""
 
         self.inactive_auth_client.post(reverse('api:user-resend-activation'))
-        mail_context = mail.outbox[0].get_context_data()
+        self.send_outbox()
+        mail_context = self.get_mail_context(mail.outbox[0])
         email = self.unactivated_user.email
         self.check_activation(mail_context=mail_context, email=email)
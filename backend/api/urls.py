@@ -10,6 +10,7 @@ from .views import (
     CustomUserViewSet,
     GroupViewSet,
     ShopViewSet,
+    metrics,
 )
 
 
@@ -63,6 +64,11 @@ urlpatterns = [
         'v1/auth/',
         include('djoser.urls.authtoken'),
     ),
+    path(
+        'metrics/',
+        metrics,
+        name='metrics'
+    ),
     path(
         'docs/swagger/',
         schema_view.with_ui('swagger', cache_timeout=0),
@@ -1,6 +1,20 @@
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_GET
 from djoser.conf import settings as djoser_settings
 from djoser.permissions import CurrentUserOrAdmin
 from djoser.views import TokenDestroyView, UserViewSet
@@ -8,37 +22,88 @@ from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import serializers, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
-from core.consts import ErrorMessage, Message
+from core.barcodes import (
+    BARCODE_CONTENT_TYPES,
+    BarcodeError,
+    barcode_content,
+    barcode_digest,
+    cached_barcode,
+)
+from core.cache import wallet_cache_stats, wallet_data_key
+from core.consts import (
+    SHARE_ALREADY_SHARED,
+    SHARE_INVITED,
+    SHARE_SELF,
+    SHARE_SHARED,
+    ErrorMessage,
+    Message,
+)
+from core.exporter import export_wallet
+from core.importer import CardImporter, read_rows
+from core.metrics import CONTENT_TYPE, registry
 from core.models import Card, Group, Shop, UserCards
+from core.signals import invalidate_wallets
+from core.sync import make_sync_token, wallet_changes
+from core.usage import (
+    apply_usage_counters,
+    merge_buffered,
+    store_usage_counters,
+)
 
+from .catalog import (
+    autocomplete_response,
+    snapshot_item_response,
+    snapshot_list_response,
+)
+from .conditional import catalog_version, conditional_get, wallet_version
 from .email import InvitationEmail
 from .exceptions import StatisticsError
+from .pagination import WalletCursorPagination
 from .permissions import IsCardsUser, IsShopCreatorOrReadOnly
 from .serializers import (
+    BarcodeBatchSerializer,
+    BarcodeSerializer,
+    BulkEmailSerializer,
+    BulkStatisticsSerializer,
     CardEditSerializer,
+    CardExportSerializer,
+    CardImportSerializer,
     CardSerializer,
     CardShopCreateSerializer,
     CardsListSerializer,
     EmailSerializer,
     GroupSerializer,
+    ShopAutocompleteSerializer,
     ShopCreateSerializer,
     ShopSerializer,
     StatisticsSerializer,
+    SyncQuerySerializer,
     UserPreCheckSerializer,
+    WalletSyncSerializer,
 )
+from .wallet import serialize_wallet, wallet_rows
 
 
 User = get_user_model()
 
+BARCODE_IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+BARCODE_CACHE_CONTROL = 'private, no-cache'
+
 
 class CustomUserViewSet(UserViewSet):
     """Эндпоинт для просмотра и управления пользователями."""
 
     permission_classes = (CurrentUserOrAdmin,)
 
+    @transaction.atomic
+    def perform_create(self, serializer, *args, **kwargs):
+        super().perform_create(serializer, *args, **kwargs)
+
     @action(["get", "patch"], detail=False)
     def me(self, request, *args, **kwargs):
         self.get_object = self.get_instance
@@ -122,6 +187,7 @@ class CardViewSet(viewsets.ModelViewSet):
     queryset = Card.objects.all()
     serializer_class = CardSerializer
     permission_classes = (IsCardsUser,)
+    pagination_class = WalletCursorPagination
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -134,18 +200,35 @@ class CardViewSet(viewsets.ModelViewSet):
         if not self.request.user.is_authenticated:
             return
         if self.action == 'list':
-            return (
-                self.request.user.cards.
-                select_related('card', 'card__shop').
-                prefetch_related('card__shop__group')
-            )
+            return self.request.user.cards.all()
         else:
             return (
                 Card.objects.filter(users=self.request.user).
                 select_related('shop').
-                prefetch_related('shop__group')
+                prefetch_related('shop__group').
+                annotate(is_owner=Exists(UserCards.objects.filter(
+                    user=self.request.user, card=OuterRef('pk'), owner=True
+                )))
             )
 
+    def cached_wallet_response(self, request, view_method, *args, **kwargs):
+        """Отдает список карт из кэша текущей версии кошелька."""
+
+        key = wallet_data_key(request.user.pk, request.build_absolute_uri())
+        data = cache.get(key)
+        if data is not None:
+            wallet_cache_stats.hit()
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        wallet_cache_stats.miss()
+        response = view_method(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, settings.WALLET_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
+
     def perform_create(self, serializer):
         card = serializer.save()
 
@@ -158,13 +241,12 @@ class CardViewSet(viewsets.ModelViewSet):
         )
 
     def perform_destroy(self, instance):
-        id = instance.id
-        user = self.request.user
-        user_card = UserCards.objects.get(user=user, card__id=id)
-        if user_card.owner:
-            card = Card.objects.get(id=id)
-            card.delete()
-        user_card.delete()
+        if instance.is_owner:
+            instance.delete()
+        else:
+            UserCards.objects.filter(
+                user=self.request.user, card=instance
+            ).delete()
 
     @swagger_auto_schema(
         responses={200: CardsListSerializer(many=True)},
@@ -174,8 +256,20 @@ class CardViewSet(viewsets.ModelViewSet):
             'и выдает список его карт.'
         )
     )
+    @conditional_get(wallet_version)
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        return self.cached_wallet_response(
+            request, self.wallet_list, *args, **kwargs
+        )
+
+    def wallet_list(self, request, *args, **kwargs):
+        """Список карт из строк .values() в формате CardsListSerializer."""
+
+        rows = wallet_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(serialize_wallet(rows))
+        return self.get_paginated_response(serialize_wallet(page))
 
     @swagger_auto_schema(
         responses={200: CardSerializer()},
@@ -186,6 +280,7 @@ class CardViewSet(viewsets.ModelViewSet):
             'пользователю.Иначе 404.'
         )
     )
+    @conditional_get(wallet_version)
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
 
@@ -269,7 +364,9 @@ class CardViewSet(viewsets.ModelViewSet):
     )
     def create_with_new_shop(self, request):
         user = self.request.user
-        serializer = CardShopCreateSerializer(data=request.data)
+        serializer = CardShopCreateSerializer(
+            data=request.data, context={'request': request}
+        )
         if serializer.is_valid(raise_exception=True):
             card = serializer.save()
             UserCards.objects.create(
@@ -289,19 +386,197 @@ class CardViewSet(viewsets.ModelViewSet):
         )
     )
     @action(detail=False)
+    @conditional_get(wallet_version)
     def favorites(self, request, *args, **kwargs):
         """Возвращает список избранных карт."""
 
-        favorite_cards = (
-            self.request.user.cards.
-            select_related('card', 'card__shop').
-            prefetch_related('card__shop__group')
-        ).filter(favourite=True)
-        serializer = CardsListSerializer(
-            favorite_cards,
-            many=True,
+        return self.cached_wallet_response(
+            request, self.favorites_list, *args, **kwargs
+        )
+
+    def favorites_list(self, request, *args, **kwargs):
+        favorite_cards = self.request.user.cards.filter(favourite=True)
+        page = self.paginate_queryset(wallet_rows(favorite_cards))
+        return self.get_paginated_response(serialize_wallet(page))
+
+    @swagger_auto_schema(
+        query_serializer=SyncQuerySerializer(),
+        responses={200: WalletSyncSerializer()},
+        operation_summary='Синхронизация списка карт',
+        operation_description=(
+            'Отдает карты, добавленные или измененные после выдачи '
+            'токена since, и id карт, удаленных из списка. '
+            'Без since отдает весь список (full=true). '
+            'Полученный token передается в следующий запрос.'
+        )
+    )
+    @action(detail=False, url_path='sync', name='sync')
+    @conditional_get(wallet_version)
+    def sync(self, request):
+        query = SyncQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        token = make_sync_token(timezone.now())
+        full, cards, deleted = wallet_changes(
+            request.user, query.validated_data.get('since')
+        )
+        return Response(
+            {
+                'token': token,
+                'full': full,
+                'cards': serialize_wallet(wallet_rows(cards)),
+                'deleted': list(deleted),
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    @swagger_auto_schema(
+        methods=['POST'],
+        request_body=CardImportSerializer(),
+        responses={200: openapi.Schema(type=openapi.TYPE_OBJECT)},
+        operation_summary='Импорт карт из файла',
+        operation_description='''
+            Принимает файл CSV (с заголовком) или JSON Lines с полями
+            name, shop, card_number, barcode_number, encoding_type,
+            favourite. Магазин ищется по названию среди существующих.
+            Карты, уже имеющиеся в списке, пропускаются. \n
+            Возвращает количество созданных, пропущенных и ошибочных
+            строк и ошибки по номерам строк.
+            '''
+    )
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='import',
+        url_name='import',
+        parser_classes=(MultiPartParser,),
+    )
+    def import_cards(self, request):
+        serializer = CardImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        report = CardImporter(request.user).run(
+            read_rows(
+                serializer.validated_data['file'],
+                serializer.validated_data['format'],
+            )
+        )
+        return Response(report, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        query_serializer=CardExportSerializer(),
+        responses={200: openapi.Schema(type=openapi.TYPE_FILE)},
+        operation_summary='Выгрузка списка карт',
+        operation_description='''
+            Потоково выгружает список карт пользователя в CSV или
+            JSON Lines с теми же полями, что принимает импорт. \n
+            Администратор может выгрузить список другого пользователя,
+            передав его id в параметре user.
+            '''
+    )
+    @action(detail=False, url_path='export', url_name='export')
+    def export(self, request):
+        serializer = CardExportSerializer(
+            data=request.query_params, context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+        file_format = serializer.validated_data['file_format']
+        content, content_type = export_wallet(
+            serializer.validated_data.get('user', request.user),
+            file_format,
+        )
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="wallet.{file_format}"'
+        )
+        return response
+
+    @swagger_auto_schema(
+        query_serializer=BarcodeSerializer(),
+        responses={200: openapi.Schema(type=openapi.TYPE_FILE)},
+        operation_summary='Штрих-код карты',
+        operation_description='''
+            Отрисовывает штрих-код карты в PNG или SVG по номеру
+            и типу кодировки. Размер модуля в пикселях задается
+            параметром scale. \n
+            Если параметр v совпадает с хэшем кода (ссылка из поля
+            barcode карты), ответ кэшируется клиентом бессрочно.
+            '''
+    )
+    @action(
+        detail=True,
+        url_path=r'barcode\.(?P<file_format>png|svg)',
+        url_name='barcode',
+    )
+    def barcode(self, request, pk, file_format):
+        card = self.get_object()
+        serializer = BarcodeSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        if not card.barcode_number:
+            raise NotFound(ErrorMessage.BARCODE_NOT_SET)
+        scale = serializer.validated_data['scale']
+        digest = barcode_digest(
+            card.encoding_type, card.barcode_number, scale
+        )
+        etag = quote_etag(f'{digest}-{file_format}')
+        response = get_conditional_response(request._request, etag=etag)
+        if response is None:
+            try:
+                _, path = cached_barcode(
+                    card.encoding_type,
+                    card.barcode_number,
+                    file_format,
+                    scale,
+                )
+            except BarcodeError as error:
+                raise serializers.ValidationError(
+                    {'barcode_number': [str(error)]}
+                )
+            response = FileResponse(
+                open(path, 'rb'),
+                content_type=BARCODE_CONTENT_TYPES[file_format],
+            )
+        response['ETag'] = etag
+        response['Cache-Control'] = (
+            BARCODE_IMMUTABLE_CACHE_CONTROL
+            if serializer.validated_data.get('v') == digest
+            else BARCODE_CACHE_CONTROL
+        )
+        return response
+
+    @swagger_auto_schema(
+        query_serializer=BarcodeBatchSerializer(),
+        responses={200: openapi.Schema(type=openapi.TYPE_OBJECT)},
+        operation_summary='Штрих-коды всех карт пользователя',
+        operation_description='''
+            Возвращает словарь {id карты: штрих-код} для карт
+            с номером штрих-кода: SVG текстом или PNG в base64
+            и хэш кода. Для номеров, которые нельзя закодировать,
+            вместо кода возвращается ошибка.
+            '''
+    )
+    @action(detail=False, url_path='barcodes', url_name='barcodes')
+    @conditional_get(wallet_version)
+    def barcodes(self, request):
+        serializer = BarcodeBatchSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        cards = (
+            Card.objects.filter(users=request.user)
+            .exclude(barcode_number='')
+            .values_list('id', 'encoding_type', 'barcode_number')
         )
-        return Response(serializer.data)
+        result = {}
+        for card_id, encoding_type, barcode_number in cards:
+            try:
+                digest, content = barcode_content(
+                    encoding_type,
+                    barcode_number,
+                    serializer.validated_data['file_format'],
+                    serializer.validated_data['scale'],
+                )
+            except BarcodeError as error:
+                result[card_id] = {'error': str(error)}
+            else:
+                result[card_id] = {'digest': digest, 'content': content}
+        return Response(result, status=status.HTTP_200_OK)
 
     @swagger_auto_schema(
         methods=['POST'],
@@ -367,14 +642,59 @@ class CardViewSet(viewsets.ModelViewSet):
         if serializer.is_valid(raise_exception=True):
             user = request.user
             user_card = get_object_or_404(UserCards, user=user, card__id=pk)
-            new_statistics = request.data['usage_counter']
-            if user_card.usage_counter < int(new_statistics):
+            new_statistics = serializer.validated_data['usage_counter']
+            current = merge_buffered(
+                user.pk, {user_card.card_id: user_card.usage_counter}
+            )[user_card.card_id]
+            if current < new_statistics:
+                store_usage_counters(
+                    user.pk, {user_card.card_id: new_statistics}
+                )
                 user_card.usage_counter = new_statistics
-                user_card.save()
                 serializer = CardsListSerializer(user_card)
                 return Response(serializer.data, status=status.HTTP_200_OK)
             raise StatisticsError
 
+    @swagger_auto_schema(
+        methods=['PATCH'],
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            additional_properties=openapi.Schema(type=openapi.TYPE_INTEGER),
+        ),
+        responses={200: openapi.Schema(type=openapi.TYPE_OBJECT)},
+        operation_summary='Пакетное увеличение счётчиков использования',
+        operation_description='''
+            Принимает словарь {id карты: счётчик использования}
+            и обновляет все счётчики одним запросом к базе.
+            Счётчик только увеличивается. Для каждой карты
+            возвращает статус (updated, stale, not_found)
+            и текущее значение счётчика.
+            '''
+    )
+    @action(
+        detail=False,
+        methods=['patch'],
+        url_path='statistics',
+        url_name='bulk-statistics',
+    )
+    def bulk_statistics(self, request):
+        serializer = BulkStatisticsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = apply_usage_counters(
+            request.user.pk,
+            serializer.validated_data['usage_counters'],
+        )
+        return Response(
+            {
+                card_id: {
+                    'status': result_status,
+                    'usage_counter': usage_counter,
+                }
+                for card_id, (result_status, usage_counter) in results.items()
+            },
+            status=status.HTTP_200_OK,
+        )
+
     @swagger_auto_schema(
         methods=['POST'],
         request_body=EmailSerializer(),
@@ -436,6 +756,93 @@ class CardViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_201_CREATED,
             )
 
+    @swagger_auto_schema(
+        methods=['POST'],
+        request_body=BulkEmailSerializer(),
+        responses={200: openapi.Schema(type=openapi.TYPE_OBJECT)},
+        operation_summary='Добавление карты в список нескольким друзьям',
+        operation_description='''
+            Принимает список е-мейлов. Пользователям из списка
+            карта добавляется одним запросом к базе, остальным
+            направляются письма-приглашения.
+            Для каждого е-мейла возвращает статус (shared,
+            already_shared, invited, self) и сообщение.
+            '''
+    )
+    @action(
+        methods=['post'],
+        detail=True,
+        url_path='share-bulk',
+        url_name='share-bulk',
+        permission_classes=[IsAuthenticated],
+    )
+    def share_bulk(self, request, pk):
+        serializer = BulkEmailSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        emails = serializer.validated_data['emails']
+        card = get_object_or_404(Card, id=pk, users=request.user)
+        friends = {
+            friend.email: friend
+            for friend in User.objects.filter(email__in=emails).annotate(
+                has_card=Exists(
+                    UserCards.objects.filter(user=OuterRef('pk'), card=card)
+                )
+            ).only('id', 'email')
+        }
+
+        results = {}
+        new_user_cards = []
+        invitations = []
+        for email in emails:
+            friend = friends.get(email)
+            if email == request.user.email:
+                results[email] = (
+                    SHARE_SELF, ErrorMessage.CANNOT_SHARE_WITH_SELF
+                )
+            elif friend is None:
+                invitations.append(email)
+                results[email] = (
+                    SHARE_INVITED,
+                    Message.invitation_message_create(self, email=email),
+                )
+            elif friend.has_card:
+                results[email] = (
+                    SHARE_ALREADY_SHARED,
+                    ErrorMessage.card_already_shared(self, email),
+                )
+            else:
+                new_user_cards.append(UserCards(
+                    user=friend,
+                    card=card,
+                    shared_by=request.user,
+                    owner=False,
+                ))
+                results[email] = (
+                    SHARE_SHARED,
+                    Message.successful_sharing(self, email, card),
+                )
+
+        with transaction.atomic():
+            if new_user_cards:
+                UserCards.objects.bulk_create(
+                    new_user_cards, ignore_conflicts=True
+                )
+                invalidate_wallets(
+                    user_card.user_id for user_card in new_user_cards
+                )
+            if invitations:
+                InvitationEmail(
+                    self.request,
+                    context={'card': card, 'user': request.user},
+                ).send_each(invitations)
+        return Response(
+            {
+                email: {'status': share_status, 'message': message}
+                for email, (share_status, message) in results.items()
+            },
+            status=status.HTTP_200_OK,
+        )
+
 
 class ShopViewSet(viewsets.ModelViewSet):
     """Вьюсет для отображения единично и списком Магазинов."""
@@ -444,6 +851,8 @@ class ShopViewSet(viewsets.ModelViewSet):
     serializer_class = ShopSerializer
     permission_classes = (AllowAny,)
     queryset = Shop.objects.filter(validation=True)
+    snapshot_list = 'shops'
+    snapshot_items = 'shop_items'
 
     def get_queryset(self):
         if self.action == 'partial_update':
@@ -467,8 +876,9 @@ class ShopViewSet(viewsets.ModelViewSet):
             'Выдает список верифицированных категорий магазинов.'
         )
     )
+    @conditional_get(catalog_version)
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        return snapshot_list_response(self.snapshot_list)
 
     @swagger_auto_schema(
         responses={200: ShopSerializer()},
@@ -477,8 +887,28 @@ class ShopViewSet(viewsets.ModelViewSet):
             'Выдает данные конкретного верифицированного магазина.'
         )
     )
+    @conditional_get(catalog_version)
     def retrieve(self, request, *args, **kwargs):
-        return super().retrieve(request, *args, **kwargs)
+        return snapshot_item_response(self.snapshot_items, kwargs['pk'])
+
+    @swagger_auto_schema(
+        query_serializer=ShopAutocompleteSerializer(),
+        responses={200: ShopSerializer(many=True)},
+        operation_summary='Подсказки по названию магазина.',
+        operation_description=(
+            'Выдает верифицированные магазины, слово в названии которых '
+            'начинается с q. Регистр и ё/е не учитываются, '
+            'кириллица и латиница взаимозаменяемы.'
+        )
+    )
+    @action(detail=False, url_path='autocomplete', name='autocomplete')
+    def autocomplete(self, request):
+        serializer = ShopAutocompleteSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return autocomplete_response(
+            serializer.validated_data['q'],
+            serializer.validated_data['limit'],
+        )
 
     @swagger_auto_schema(
         request_body=ShopCreateSerializer(),
@@ -500,6 +930,8 @@ class GroupViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Group.objects.all()
     serializer_class = GroupSerializer
     permission_classes = (AllowAny,)
+    snapshot_list = 'groups'
+    snapshot_items = 'group_items'
 
     @swagger_auto_schema(
         responses={200: GroupSerializer()},
@@ -508,8 +940,9 @@ class GroupViewSet(viewsets.ReadOnlyModelViewSet):
             'Выдает список категорий магазинов.'
         )
     )
+    @conditional_get(catalog_version)
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        return snapshot_list_response(self.snapshot_list)
 
     @swagger_auto_schema(
         responses={200: GroupSerializer()},
@@ -518,5 +951,24 @@ class GroupViewSet(viewsets.ReadOnlyModelViewSet):
             'Выдает данные конкретной категории магазина.'
         )
     )
+    @conditional_get(catalog_version)
     def retrieve(self, request, *args, **kwargs):
-        return super().retrieve(request, *args, **kwargs)
+        return snapshot_item_response(self.snapshot_items, kwargs['pk'])
+
+
+@require_GET
+def metrics(request):
+    """Метрики всех воркеров в текстовом формате Prometheus.
+
+    Нужен заголовок Authorization: Bearer с METRICS_TOKEN. Без
+    заданного токена метрики не отдаются никому.
+    """
+
+    if not settings.METRICS_ENABLED or not settings.METRICS_TOKEN:
+        raise Http404
+    if not constant_time_compare(
+            request.headers.get('Authorization', ''),
+            f'Bearer {settings.METRICS_TOKEN}',
+    ):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,149 @@
+"""Быстрая выдача списка карт пользователя только для чтения.
+
+Ответ совпадает с выводом CardsListSerializer, но строится из строк
+.values(): магазины с категориями собираются в словари один раз на
+страницу, а экземпляры сериализаторов и полей на каждую карту не
+создаются. Изменение полей CardsListSerializer, CardSerializer или
+ShopSerializer нужно повторить здесь, расхождение ловят тесты.
+"""
+
+from django.urls import reverse
+from rest_framework import serializers
+
+from core.barcodes import barcode_digest
+from core.images import name_thumbnail_urls
+from core.models import Card, Group, Shop
+
+
+USER_CARD_FIELDS = (
+    'id',
+    'owner',
+    'favourite',
+    'pub_date',
+    'usage_counter',
+    'updated_at',
+    'shared_by_id',
+    'shared_by__name',
+    'shared_by__email',
+    'card_id',
+    'card__shop_id',
+    'card__name',
+    'card__pub_date',
+    'card__image',
+    'card__card_number',
+    'card__barcode_number',
+    'card__encoding_type',
+    'card__updated_at',
+)
+SHOP_FIELDS = ('id', 'logo', 'name', 'color', 'validation', 'updated_at')
+PK_PLACEHOLDER = '__pk__'
+
+_datetime = serializers.DateTimeField().to_representation
+
+
+def wallet_rows(queryset):
+    """Строки UserCards со всеми полями ответа за один запрос."""
+
+    return queryset.select_related(None).prefetch_related(None).values(
+        *USER_CARD_FIELDS
+    )
+
+
+def file_urls(storage, name):
+    """Путь файла и его уменьшенных копий, как у сериализаторов."""
+
+    if not name:
+        return None, None
+    return storage.url(name), name_thumbnail_urls(name, storage)
+
+
+def shop_dicts(shop_ids):
+    """Магазины с категориями в формате ShopSerializer по id."""
+
+    groups = {shop_id: [] for shop_id in shop_ids}
+    for shop_id, group_id, group_name in (
+        Shop.group.through.objects.filter(shop_id__in=shop_ids)
+        .order_by(*(f'group__{field}' for field in Group._meta.ordering))
+        .values_list('shop_id', 'group_id', 'group__name')
+    ):
+        groups[shop_id].append({'id': group_id, 'name': group_name})
+
+    storage = Shop._meta.get_field('logo').storage
+    shops = {}
+    for shop in Shop.objects.filter(id__in=shop_ids).values(*SHOP_FIELDS):
+        logo, logo_thumbnails = file_urls(storage, shop['logo'])
+        shops[shop['id']] = {
+            'id': shop['id'],
+            'group': groups[shop['id']],
+            'logo': logo,
+            'logo_thumbnails': logo_thumbnails,
+            'name': shop['name'],
+            'color': shop['color'],
+            'validation': shop['validation'],
+            'updated_at': _datetime(shop['updated_at']),
+        }
+    return shops
+
+
+def barcode_url_parts():
+    """Путь SVG штрих-кода до и после id карты, reverse один раз."""
+
+    head, _, tail = reverse(
+        'api:card-barcode',
+        kwargs={'pk': PK_PLACEHOLDER, 'file_format': 'svg'},
+    ).rpartition(PK_PLACEHOLDER)
+    return head, tail
+
+
+def barcode_url(url_parts, card_id, encoding_type, barcode_number):
+    if not barcode_number:
+        return None
+    head, tail = url_parts
+    digest = barcode_digest(encoding_type, barcode_number)
+    return f'{head}{card_id}{tail}?v={digest}'
+
+
+def serialize_wallet(rows):
+    """Список карт в формате CardsListSerializer из строк wallet_rows."""
+
+    rows = list(rows)
+    shops = shop_dicts({row['card__shop_id'] for row in rows})
+    storage = Card._meta.get_field('image').storage
+    url_parts = barcode_url_parts()
+    data = []
+    for row in rows:
+        image, image_thumbnails = file_urls(storage, row['card__image'])
+        shared_by = None
+        if row['shared_by_id'] is not None:
+            shared_by = {
+                'id': row['shared_by_id'],
+                'name': row['shared_by__name'],
+                'email': row['shared_by__email'],
+            }
+        data.append({
+            'card': {
+                'id': row['card_id'],
+                'shop': shops[row['card__shop_id']],
+                'image': image,
+                'image_thumbnails': image_thumbnails,
+                'barcode': barcode_url(
+                    url_parts,
+                    row['card_id'],
+                    row['card__encoding_type'],
+                    row['card__barcode_number'],
+                ),
+                'name': row['card__name'],
+                'pub_date': _datetime(row['card__pub_date']),
+                'card_number': row['card__card_number'],
+                'barcode_number': row['card__barcode_number'],
+                'encoding_type': row['card__encoding_type'],
+                'updated_at': _datetime(row['card__updated_at']),
+            },
+            'shared_by': shared_by,
+            'owner': row['owner'],
+            'favourite': row['favourite'],
+            'pub_date': _datetime(row['pub_date']),
+            'usage_counter': row['usage_counter'],
+            'updated_at': _datetime(row['updated_at']),
+        })
+    return data
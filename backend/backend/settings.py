@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -6,6 +7,16 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+
+def env_bool(name, default=False):
+    """Флаг из окружения: 1, true и yes включают, остальное выключает."""
+
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes')
+
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 DATA_FILES_DIR = os.path.join(BASE_DIR, 'data')
 GROUP_FILES_DIR = os.path.join(DATA_FILES_DIR, 'group.csv')
@@ -42,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -50,6 +62,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.RequestProfilerMiddleware',
+    'api.middleware.QueryInspectorMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -86,6 +100,70 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default=''),
+    }
+}
+
+WALLET_CACHE_TIMEOUT = int(os.getenv('WALLET_CACHE_TIMEOUT', default=60 * 60))
+CATALOG_SNAPSHOT_TIMEOUT = int(
+    os.getenv('CATALOG_SNAPSHOT_TIMEOUT', default=24 * 60 * 60)
+)
+CATALOG_SNAPSHOT_ASYNC = True
+
+TOKEN_CACHE_ENABLED = True
+TOKEN_CACHE_LOCAL_SIZE = 1024
+TOKEN_CACHE_LOCAL_TTL = 5
+TOKEN_CACHE_SHARED_TTL = 5 * 60
+
+WALLET_SYNC_OVERLAP = 5
+WALLET_SYNC_TOMBSTONE_TTL = 30 * 24 * 60 * 60
+
+USAGE_BUFFER_ENABLED = env_bool('USAGE_BUFFER_ENABLED')
+USAGE_BUFFER_FLUSH_INTERVAL = 5
+USAGE_BUFFER_FLUSH_EVENTS = 100
+USAGE_BUFFER_JOURNAL_DIR = os.getenv(
+    'USAGE_BUFFER_JOURNAL_DIR',
+    default=os.path.join(tempfile.gettempdir(), 'osdc_usage_journal'),
+)
+
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', default=2))
+THUMBNAILS_ASYNC = True
+IMAGE_NORMALIZE_IN_POOL = True
+
+# DEBUG читается сырой строкой, поэтому здесь разбирается отдельно.
+N_PLUS_ONE_DETECTION = env_bool(
+    'N_PLUS_ONE_DETECTION', default=env_bool('DEBUG')
+)
+N_PLUS_ONE_THRESHOLD = 3
+
+METRICS_ENABLED = env_bool('METRICS_ENABLED', default=True)
+METRICS_DIR = os.getenv(
+    'METRICS_DIR',
+    default=os.path.join(tempfile.gettempdir(), 'osdc_metrics'),
+)
+# Без токена /api/metrics/ отвечает 404.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Профили пишутся на диск, поэтому по умолчанию профилирование выключено.
+REQUEST_PROFILING = env_bool('REQUEST_PROFILING')
+REQUEST_PROFILE_HEADER = 'X-Profile'
+REQUEST_PROFILE_DIR = os.getenv(
+    'REQUEST_PROFILE_DIR', default=os.path.join(BASE_DIR, 'profiles')
+)
+REQUEST_PROFILE_TOP_FUNCTIONS = 30
+REQUEST_PROFILE_KEEP = 200
+
+BARCODE_CACHE_DIR = os.getenv(
+    'BARCODE_CACHE_DIR',
+    default=os.path.join(tempfile.gettempdir(), 'osdc_barcodes'),
+)
+
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
@@ -137,6 +215,15 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'users.authentication.CustomTokenAuthentication',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'EXCEPTION_HANDLER': 'api.exception_handler.custom_exception_handler',
 }
 
@@ -170,6 +257,13 @@ DEFAULT_FROM_EMAIL = os.getenv('SENDGRID_FROM_EMAIL')
 SENDGRID_API_KEY = os.getenv('SENDGRID_API_KEY')
 SENDGRID_SANDBOX_MODE_IN_DEBUG = False
 
+EMAIL_OUTBOX_BATCH_SIZE = 50
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_RETRY_DELAY = 60
+EMAIL_OUTBOX_DEDUP_WINDOW = 10 * 60
+EMAIL_OUTBOX_POLL_INTERVAL = 5
+EMAIL_OUTBOX_LEASE = 10 * 60
+
 if os.getenv('EMAIL_DEBUG', default=False):
     EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
     EMAIL_FILE_PATH = os.path.join(STATIC_ROOT, 'sent_emails')
@@ -1,6 +1,19 @@
 from django.contrib import admin
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html, format_html_join
 
-from core.models import Card, Group, Shop, UserCards
+from core.models import (
+    Blob,
+    Card,
+    Group,
+    OutboxEmail,
+    RequestProfile,
+    Shop,
+    UserCards,
+)
+from core.profiling import artifact_path
 
 
 @admin.register(Group)
@@ -96,3 +109,169 @@ class UserCardsAdmin(admin.ModelAdmin):
         'user',
         'card',
     )
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'subject',
+        'recipients',
+        'status',
+        'attempts',
+        'next_attempt_at',
+        'sent_at',
+    )
+    list_filter = (
+        'status',
+    )
+    search_fields = (
+        'subject',
+        'recipients',
+    )
+    readonly_fields = (
+        'created_at',
+        'sent_at',
+    )
+
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = (
+        'name',
+        'size',
+        'references',
+        'created_at',
+    )
+    search_fields = (
+        'name',
+    )
+    readonly_fields = (
+        'name',
+        'size',
+        'references',
+        'created_at',
+    )
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'created_at',
+        'method',
+        'path',
+        'status_code',
+        'duration',
+        'query_count',
+        'query_time',
+        'top_function',
+        'user',
+    )
+    list_filter = (
+        'method',
+        'status_code',
+    )
+    search_fields = (
+        'path',
+        'user__email',
+    )
+    fields = (
+        ('method', 'path', 'status_code'),
+        ('duration', 'query_count', 'query_time'),
+        ('user', 'created_at'),
+        'artifact_link',
+        'functions_table',
+        'queries_table',
+    )
+    readonly_fields = (
+        'method',
+        'path',
+        'status_code',
+        'duration',
+        'query_count',
+        'query_time',
+        'user',
+        'created_at',
+        'artifact_link',
+        'functions_table',
+        'queries_table',
+    )
+    list_select_related = ('user',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path(
+                '<int:pk>/artifact/',
+                self.admin_site.admin_view(self.artifact_view),
+                name='core_requestprofile_artifact',
+            ),
+        ] + super().get_urls()
+
+    def artifact_view(self, request, pk):
+        if not self.has_view_permission(request):
+            raise Http404
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        try:
+            artifact = open(artifact_path(profile.artifact), 'rb')
+        except FileNotFoundError:
+            raise Http404
+        return FileResponse(
+            artifact, as_attachment=True, filename=profile.artifact
+        )
+
+    @admin.display(description='Самая дорогая функция')
+    def top_function(self, obj):
+        if not obj.top_functions:
+            return None
+        top = obj.top_functions[0]
+        return f'{top["function"]} ({top["own_ms"]} мс)'
+
+    @admin.display(description='Файл профиля')
+    def artifact_link(self, obj):
+        return format_html(
+            '<a href="{}">{}</a>',
+            reverse('admin:core_requestprofile_artifact', args=(obj.pk,)),
+            obj.artifact,
+        )
+
+    @admin.display(description='Самые дорогие функции')
+    def functions_table(self, obj):
+        return format_html(
+            '<table><tr><th>Функция</th><th>Вызовов</th>'
+            '<th>Собственное, мс</th><th>Всего, мс</th></tr>{}</table>',
+            format_html_join(
+                '',
+                '<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>',
+                (
+                    (
+                        row['function'],
+                        row['calls'],
+                        row['own_ms'],
+                        row['cumulative_ms'],
+                    )
+                    for row in obj.top_functions
+                ),
+            ),
+        )
+
+    @admin.display(description='Запросы к базе')
+    def queries_table(self, obj):
+        return format_html(
+            '<table><tr><th>Мс</th><th>Запрос</th><th>Откуда</th></tr>'
+            '{}</table>',
+            format_html_join(
+                '',
+                '<tr><td>{}</td><td><code>{}</code></td><td>{}</td></tr>',
+                (
+                    (query['ms'], query['sql'], query['site'])
+                    for query in obj.queries
+                ),
+            ),
+        )
@@ -0,0 +1,451 @@
+"""Отрисовка штрих-кодов карт в SVG и PNG без внешних сервисов.
+
+Код раскладывается в матрицу модулей (у линейных кодов одна строка),
+квадратная сетка модулей масштабируется при отрисовке. Готовые файлы
+кэшируются на диске под хэшем типа, номера и размера.
+"""
+
+import base64
+import hashlib
+import io
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+
+from django.conf import settings
+from PIL import Image
+
+from .consts import (
+    BARCODE_SCALE,
+    CODE39,
+    CODE128,
+    EAN_8,
+    EAN_13,
+    UPC_A,
+    UPC_E,
+    ErrorMessage,
+    QR_код,
+)
+from .qr import QRCodeError, encode_qr
+
+
+# Меняется при любом изменении отрисовки: старые файлы в кэше
+# и ссылки с ?v= перестают совпадать с новыми.
+BARCODE_RENDER_VERSION = 1
+BARCODE_FORMATS = ('png', 'svg')
+BARCODE_CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+LINEAR_QUIET_ZONE = 10
+LINEAR_HEIGHT = 60
+QR_QUIET_ZONE = 4
+
+CODE128_PATTERNS = (
+    '212222', '222122', '222221', '121223', '121322', '131222', '122213',
+    '122312', '132212', '221213', '221312', '231212', '112232', '122132',
+    '122231', '113222', '123122', '123221', '223211', '221132', '221231',
+    '213212', '223112', '312131', '311222', '321122', '321221', '312212',
+    '322112', '322211', '212123', '212321', '232121', '111323', '131123',
+    '131321', '112313', '132113', '132311', '211313', '231113', '231311',
+    '112133', '112331', '132131', '113123', '113321', '133121', '313121',
+    '211331', '231131', '213113', '213311', '213131', '311123', '311321',
+    '331121', '312113', '312311', '332111', '314111', '221411', '431111',
+    '111224', '111422', '121124', '121421', '141122', '141221', '112214',
+    '112412', '122114', '122411', '142112', '142211', '241211', '221114',
+    '413111', '241112', '134111', '111242', '121142', '121241', '114212',
+    '124112', '124211', '411212', '421112', '421211', '212141', '214121',
+    '412121', '111143', '111341', '131141', '114113', '114311', '411113',
+    '411311', '113141', '114131', '311141', '411131', '211412', '211214',
+    '211232', '2331112',
+)
+CODE128_CODE_C = 99
+CODE128_CODE_B = 100
+CODE128_START_B = 104
+CODE128_START_C = 105
+CODE128_STOP = 106
+
+# Элементы символа по порядку: штрих, пробел, ...; w - широкий.
+CODE39_PATTERNS = {
+    '0': 'nnnwwnwnn', '1': 'wnnwnnnnw', '2': 'nnwwnnnnw',
+    '3': 'wnwwnnnnn', '4': 'nnnwwnnnw', '5': 'wnnwwnnnn',
+    '6': 'nnwwwnnnn', '7': 'nnnwnnwnw', '8': 'wnnwnnwnn',
+    '9': 'nnwwnnwnn', 'A': 'wnnnnwnnw', 'B': 'nnwnnwnnw',
+    'C': 'wnwnnwnnn', 'D': 'nnnnwwnnw', 'E': 'wnnnwwnnn',
+    'F': 'nnwnwwnnn', 'G': 'nnnnnwwnw', 'H': 'wnnnnwwnn',
+    'I': 'nnwnnwwnn', 'J': 'nnnnwwwnn', 'K': 'wnnnnnnww',
+    'L': 'nnwnnnnww', 'M': 'wnwnnnnwn', 'N': 'nnnnwnnww',
+    'O': 'wnnnwnnwn', 'P': 'nnwnwnnwn', 'Q': 'nnnnnnwww',
+    'R': 'wnnnnnwwn', 'S': 'nnwnnnwwn', 'T': 'nnnnwnwwn',
+    'U': 'wwnnnnnnw', 'V': 'nwwnnnnnw', 'W': 'wwwnnnnnn',
+    'X': 'nwnnwnnnw', 'Y': 'wwnnwnnnn', 'Z': 'nwwnwnnnn',
+    '-': 'nwnnnnwnw', '.': 'wwnnnnwnn', ' ': 'nwwnnnwnn',
+    '$': 'nwnwnwnnn', '/': 'nwnwnnnwn', '+': 'nwnnnwnwn',
+    '%': 'nnnwnwnwn', '*': 'nwnnwnwnn',
+}
+CODE39_WIDE = 3
+
+EAN_L_CODES = (
+    '0001101', '0011001', '0010011', '0111101', '0100011',
+    '0110001', '0101111', '0111011', '0110111', '0001011',
+)
+EAN_R_CODES = tuple(
+    code.translate(str.maketrans('01', '10')) for code in EAN_L_CODES
+)
+EAN_G_CODES = tuple(code[::-1] for code in EAN_R_CODES)
+# Четность левой половины EAN-13 по первой цифре: L - нечетная, G - четная.
+EAN_13_PARITY = (
+    'LLLLLL', 'LLGLGG', 'LLGGLG', 'LLGGGL', 'LGLLGG',
+    'LGGLLG', 'LGGGLL', 'LGLGLG', 'LGLGGL', 'LGGLGL',
+)
+# Четность цифр UPC-E по контрольной цифре для системы счисления 0,
+# у системы 1 она обратная.
+UPC_E_PARITY = (
+    'GGGLLL', 'GGLGLL', 'GGLLGL', 'GGLLLG', 'GLGGLL',
+    'GLLGGL', 'GLLLGG', 'GLGLGL', 'GLGLLG', 'GLLGLG',
+)
+EAN_GUARD = '101'
+EAN_CENTER_GUARD = '01010'
+UPC_E_END_GUARD = '010101'
+
+
+class BarcodeError(ValueError):
+    """Номер нельзя закодировать выбранным типом кода."""
+
+
+def widths_to_modules(widths, dark=True):
+    """Ширины чередующихся штрихов и пробелов в строку модулей."""
+
+    modules = []
+    for width in widths:
+        modules.extend((dark,) * int(width))
+        dark = not dark
+    return modules
+
+
+def bits_to_modules(bits):
+    return [bit == '1' for bit in bits]
+
+
+def code128_values(value):
+    """Значения символов Code 128 с переключением наборов B и C.
+
+    Набор C кодирует пары цифр одним символом, поэтому длинные серии
+    цифр переводятся в него, если это укорачивает код.
+    """
+
+    if any(not 32 <= ord(char) <= 126 for char in value):
+        raise BarcodeError(ErrorMessage.BARCODE_INCORRECT_SYMBOLS)
+
+    def digits_run(start):
+        end = start
+        while end < len(value) and value[end].isdigit():
+            end += 1
+        return end - start
+
+    run = digits_run(0)
+    code_c = (run == len(value) and run % 2 == 0) or run >= 4
+    values = [CODE128_START_C if code_c else CODE128_START_B]
+    position = 0
+    while position < len(value):
+        run = digits_run(position)
+        if code_c and run < 2:
+            values.append(CODE128_CODE_B)
+            code_c = False
+        elif (
+            not code_c
+            and run >= 4
+            and (run >= 6 or position + run == len(value))
+        ):
+            if run % 2:
+                values.append(ord(value[position]) - 32)
+                position += 1
+            values.append(CODE128_CODE_C)
+            code_c = True
+        if code_c:
+            values.append(int(value[position:position + 2]))
+            position += 2
+        else:
+            values.append(ord(value[position]) - 32)
+            position += 1
+    values.append(
+        (values[0] + sum(
+            index * code for index, code in enumerate(values[1:], 1)
+        )) % 103
+    )
+    values.append(CODE128_STOP)
+    return values
+
+
+def encode_code128(value):
+    return widths_to_modules(
+        ''.join(CODE128_PATTERNS[code] for code in code128_values(value))
+    )
+
+
+def encode_code39(value):
+    if any(char not in CODE39_PATTERNS or char == '*' for char in value):
+        raise BarcodeError(ErrorMessage.BARCODE_INCORRECT_SYMBOLS)
+    modules = []
+    for char in f'*{value}*':
+        if modules:
+            modules.append(False)
+        modules.extend(widths_to_modules(
+            CODE39_WIDE if element == 'w' else 1
+            for element in CODE39_PATTERNS[char]
+        ))
+    return modules
+
+
+def ean_check_digit(digits):
+    """Контрольная цифра EAN/UPC: веса 3 и 1 справа налево."""
+
+    total = sum(
+        int(digit) * (3 if index % 2 == 0 else 1)
+        for index, digit in enumerate(reversed(digits))
+    )
+    return str(-total % 10)
+
+
+def ean_digits(value, length):
+    """Цифры кода с контрольной цифрой: дописывает или проверяет ее."""
+
+    if not value.isdigit() or not value.isascii():
+        raise BarcodeError(ErrorMessage.BARCODE_INCORRECT_SYMBOLS)
+    if len(value) == length - 1:
+        return value + ean_check_digit(value)
+    if len(value) != length:
+        raise BarcodeError(ErrorMessage.BARCODE_INCORRECT_LENGTH)
+    if ean_check_digit(value[:-1]) != value[-1]:
+        raise BarcodeError(ErrorMessage.BARCODE_INCORRECT_CHECK_DIGIT)
+    return value
+
+
+def ean_digit_code(digit, parity):
+    codes = EAN_L_CODES if parity == 'L' else EAN_G_CODES
+    return codes[int(digit)]
+
+
+def encode_ean13(value):
+    digits = ean_digits(value, 13)
+    left = ''.join(
+        ean_digit_code(digit, parity)
+        for digit, parity in zip(digits[1:7], EAN_13_PARITY[int(digits[0])])
+    )
+    right = ''.join(EAN_R_CODES[int(digit)] for digit in digits[7:])
+    return bits_to_modules(
+        EAN_GUARD + left + EAN_CENTER_GUARD + right + EAN_GUARD
+    )
+
+
+def encode_ean8(value):
+    digits = ean_digits(value, 8)
+    left = ''.join(EAN_L_CODES[int(digit)] for digit in digits[:4])
+    right = ''.join(EAN_R_CODES[int(digit)] for digit in digits[4:])
+    return bits_to_modules(
+        EAN_GUARD + left + EAN_CENTER_GUARD + right + EAN_GUARD
+    )
+
+
+def encode_upc_a(value):
+    """UPC-A совпадает с EAN-13 с ведущим нулем."""
+
+    return encode_ean13('0' + ean_digits(value, 12))
+
+
+def upc_e_to_upc_a(digits):
+    """Разворачивает 6 цифр UPC-E в 11 цифр UPC-A без контрольной."""
+
+    system, body = digits[0], digits[1:7]
+    last = body[5]
+    if last in '012':
+        expanded = body[:2] + last + '0000' + body[2:5]
+    elif last == '3':
+        expanded = body[:3] + '00000' + body[3:5]
+    elif last == '4':
+        expanded = body[:4] + '00000' + body[4]
+    else:
+        expanded = body[:5] + '0000' + last
+    return system + expanded
+
+
+def encode_upc_e(value):
+    """UPC-E из 6, 7 (с системой счисления) или 8 цифр."""
+
+    if not value.isdigit() or not value.isascii():
+        raise BarcodeError(ErrorMessage.BARCODE_INCORRECT_SYMBOLS)
+    if len(value) == 6:
+        value = '0' + value
+    if len(value) not in (7, 8) or value[0] not in '01':
+        raise BarcodeError(ErrorMessage.BARCODE_INCORRECT_LENGTH)
+    check = ean_check_digit(upc_e_to_upc_a(value))
+    if len(value) == 8 and value[7] != check:
+        raise BarcodeError(ErrorMessage.BARCODE_INCORRECT_CHECK_DIGIT)
+    parity = UPC_E_PARITY[int(check)]
+    if value[0] == '1':
+        parity = parity.translate(str.maketrans('LG', 'GL'))
+    body = ''.join(
+        ean_digit_code(digit, digit_parity)
+        for digit, digit_parity in zip(value[1:7], parity)
+    )
+    return bits_to_modules(EAN_GUARD + body + UPC_E_END_GUARD)
+
+
+LINEAR_ENCODERS = {
+    CODE128: encode_code128,
+    CODE39: encode_code39,
+    EAN_13: encode_ean13,
+    EAN_8: encode_ean8,
+    UPC_A: encode_upc_a,
+    UPC_E: encode_upc_e,
+}
+
+
+def encode_barcode(encoding_type, value):
+    """Матрица модулей кода с тихой зоной: список строк из bool."""
+
+    if not value:
+        raise BarcodeError(ErrorMessage.BARCODE_NOT_SET)
+    if encoding_type == QR_код:
+        try:
+            matrix = encode_qr(value)
+        except QRCodeError as error:
+            raise BarcodeError(str(error))
+        quiet = vertical_quiet = QR_QUIET_ZONE
+    else:
+        try:
+            encoder = LINEAR_ENCODERS[encoding_type]
+        except KeyError:
+            raise BarcodeError(ErrorMessage.BARCODE_INCORRECT_SYMBOLS)
+        matrix = (encoder(value),) * LINEAR_HEIGHT
+        quiet, vertical_quiet = LINEAR_QUIET_ZONE, 0
+    padding = [False] * quiet
+    rows = [padding + list(row) + padding for row in matrix]
+    blank = [False] * len(rows[0])
+    return [blank] * vertical_quiet + rows + [blank] * vertical_quiet
+
+
+def render_svg(matrix, scale):
+    """SVG с одним контуром: строки одинаковых модулей сливаются."""
+
+    height = len(matrix)
+    width = len(matrix[0])
+    path = []
+    y = 0
+    for row, rows in groupby(matrix):
+        run_height = len(tuple(rows))
+        x = 0
+        for dark, modules in groupby(row):
+            run = len(tuple(modules))
+            if dark:
+                path.append(f'M{x} {y}h{run}v{run_height}h-{run}z')
+            x += run
+        y += run_height
+    return (
+        '<svg xmlns="http://www.w3.org/2000/svg" '
+        f'width="{width * scale}" height="{height * scale}" '
+        f'viewBox="0 0 {width} {height}" shape-rendering="crispEdges">'
+        f'<rect width="{width}" height="{height}" fill="#fff"/>'
+        f'<path d="{"".join(path)}" fill="#000"/></svg>'
+    ).encode()
+
+
+def render_png(matrix, scale):
+    """Черно-белый PNG: модуль занимает scale x scale пикселей."""
+
+    height = len(matrix)
+    width = len(matrix[0])
+    image = Image.new('1', (width, height), 1)
+    image.putdata([0 if dark else 1 for row in matrix for dark in row])
+    image = image.resize(
+        (width * scale, height * scale), Image.Resampling.NEAREST
+    )
+    output = io.BytesIO()
+    image.save(output, format='PNG', optimize=True)
+    return output.getvalue()
+
+
+RENDERERS = {
+    'png': render_png,
+    'svg': render_svg,
+}
+
+
+def render_barcode(encoding_type, value, file_format, scale):
+    return RENDERERS[file_format](encode_barcode(encoding_type, value), scale)
+
+
+def barcode_digest(encoding_type, value, scale=None):
+    """Хэш содержимого кода: меняется вместе с номером, типом и размером."""
+
+    scale = scale or BARCODE_SCALE
+    payload = f'{BARCODE_RENDER_VERSION}:{encoding_type}:{scale}:{value}'
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def barcode_path(digest, file_format):
+    return os.path.join(
+        settings.BARCODE_CACHE_DIR, digest[:2], f'{digest}.{file_format}'
+    )
+
+
+def cached_barcode(encoding_type, value, file_format, scale=None):
+    """Путь к файлу кода в кэше, отрисовывает его при промахе.
+
+    Файл пишется во временный и переименовывается, поэтому параллельные
+    запросы не видят недописанных файлов.
+    """
+
+    scale = scale or BARCODE_SCALE
+    digest = barcode_digest(encoding_type, value, scale)
+    path = barcode_path(digest, file_format)
+    if os.path.exists(path):
+        return digest, path
+    content = render_barcode(encoding_type, value, file_format, scale)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(descriptor, 'wb') as temp_file:
+            temp_file.write(content)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return digest, path
+
+
+def barcode_content(encoding_type, value, file_format, scale=None):
+    """Код для встраивания в JSON: SVG текстом, PNG в base64."""
+
+    digest, path = cached_barcode(encoding_type, value, file_format, scale)
+    with open(path, 'rb') as barcode_file:
+        content = barcode_file.read()
+    if file_format == 'svg':
+        return digest, content.decode()
+    return digest, base64.b64encode(content).decode()
+
+
+def _render_item(item):
+    encoding_type, value, file_format, scale = item
+    try:
+        return cached_barcode(encoding_type, value, file_format, scale)[0]
+    except BarcodeError:
+        return None
+
+
+def render_many(items, workers=None):
+    """Отрисовывает в кэш коды (тип, номер, формат, размер) пачкой.
+
+    Отрисовка занимает процессор, поэтому пачка делится между
+    процессами. Возвращает хэши в порядке items, None для номеров,
+    которые нельзя закодировать.
+    """
+
+    items = list(items)
+    if workers == 1 or len(items) < 2:
+        return [_render_item(item) for item in items]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_render_item, items, chunksize=16))
@@ -0,0 +1,122 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+
+from .metrics import cache_requests
+
+
+WALLET_VERSION_KEY = 'wallet:version:{user_id}'
+WALLET_DATA_KEY = 'wallet:data:{user_id}:{version}:{digest}'
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+class CacheStats:
+    """Счётчики попаданий и промахов кэша в пределах процесса.
+
+    Те же события попадают в общую для воркеров метрику
+    cache_requests_total.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self):
+        self.hits += 1
+        cache_requests.inc(cache=self.name, result='hit')
+
+    def miss(self):
+        self.misses += 1
+        cache_requests.inc(cache=self.name, result='miss')
+
+    @property
+    def ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def as_dict(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'ratio': self.ratio,
+        }
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+
+
+wallet_cache_stats = CacheStats('wallet')
+
+
+def _new_version(previous=None):
+    """Версия растет монотонно и привязана ко времени изменения.
+
+    Начальное значение берется от текущего времени, поэтому после
+    вытеснения ключа из кэша версия не повторит уже выданную.
+    """
+
+    version = time.time_ns()
+    if previous is not None and previous >= version:
+        version = previous + 1
+    return version
+
+
+def get_version(key):
+    """Текущее значение счётчика версии."""
+
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_versions(keys):
+    """Увеличивает счётчики версий."""
+
+    keys = set(keys)
+    if not keys:
+        return
+    versions = cache.get_many(keys)
+    cache.set_many(
+        {key: _new_version(versions.get(key)) for key in keys},
+        timeout=None,
+    )
+
+
+def get_wallet_version(user_id):
+    """Текущая версия списка карт пользователя."""
+
+    return get_version(WALLET_VERSION_KEY.format(user_id=user_id))
+
+
+def bump_wallet_versions(user_ids):
+    """Инвалидирует закэшированные списки карт пользователей."""
+
+    bump_versions(
+        WALLET_VERSION_KEY.format(user_id=user_id) for user_id in user_ids
+    )
+
+
+def get_catalog_version():
+    """Текущая версия каталога магазинов и категорий."""
+
+    return get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    bump_versions((CATALOG_VERSION_KEY,))
+
+
+def wallet_data_key(user_id, url):
+    """Ключ ответа списка карт для текущей версии и адреса запроса."""
+
+    return WALLET_DATA_KEY.format(
+        user_id=user_id,
+        version=get_wallet_version(user_id),
+        digest=hashlib.md5(url.encode()).hexdigest(),
+    )
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """Кэш кошельков, версии для ETag и кэш токенов должны быть общими.
+
+    С кэшем в памяти процесса сброс версии в одном воркере не виден
+    остальным, и они отдают устаревшие данные до истечения таймаута.
+    """
+
+    if settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES:
+        return []
+    return [
+        Warning(
+            'The default cache is local to the process.',
+            hint=(
+                'Wallet and catalog invalidation, ETags and the token '
+                'cache are not shared between gunicorn workers and '
+                'management commands. Set CACHE_BACKEND to a Redis, '
+                'Memcached or file based cache.'
+            ),
+            id='core.W001',
+        )
+    ]
@@ -1,11 +1,54 @@
 MAX_LENGTH_CARD_NAME = 30
 MAX_LENGTH_GROUP_NAME = 30
 MAX_LENGTH_SHOP_NAME = 30
+# Транслитерация удлиняет название: щ -> sch.
+MAX_LENGTH_NORMALIZED_SHOP_NAME = MAX_LENGTH_SHOP_NAME * 3
 MAX_LENGTH_CARD_NUMBER = 40
 MAX_LENGTH_BARCODE_NUMBER = 256
+MAX_LENGTH_BLOB_NAME = 100
+MAX_LENGTH_PROFILE_PATH = 2000
+MAX_LENGTH_HTTP_METHOD = 10
 MAX_LENGTH_COLOR = 16
 MAX_LENGTH_ENCODING_TYPE = 30
 MAX_NUM_CARD_USE_BY_USER = None
+WALLET_PAGE_SIZE = 50
+WALLET_MAX_PAGE_SIZE = 200
+MAX_BULK_STATISTICS_CARDS = 500
+MAX_SHARE_RECIPIENTS = 50
+SHARE_SHARED = 'shared'
+SHARE_ALREADY_SHARED = 'already_shared'
+SHARE_INVITED = 'invited'
+SHARE_SELF = 'self'
+CARD_IMPORT_CHUNK_SIZE = 500
+CARD_IMPORT_MAX_ERRORS = 100
+EXPORT_CHUNK_SIZE = 2000
+AUTOCOMPLETE_LIMIT = 10
+MAX_AUTOCOMPLETE_LIMIT = 50
+SHOP_SUGGEST_CUTOFF = 0.85
+SHOP_SUGGEST_PREFIX = 2
+THUMBNAIL_SIZES = (64, 128, 256)
+CARD_IMAGE_MAX_SIZE = 1600
+CARD_IMAGE_QUALITY = 85
+THUMBNAIL_FORMATS = ('png', 'webp')
+BARCODE_SCALE = 3
+MAX_BARCODE_SCALE = 10
+IMPORT_CSV = 'csv'
+IMPORT_JSONL = 'jsonl'
+IMPORT_FORMATS = (
+    (IMPORT_CSV, 'CSV'),
+    (IMPORT_JSONL, 'JSON Lines'),
+)
+MAX_LENGTH_EMAIL_SUBJECT = 256
+MAX_LENGTH_DEDUP_KEY = 64
+MAX_LENGTH_OUTBOX_STATUS = 16
+OUTBOX_PENDING = 'pending'
+OUTBOX_SENT = 'sent'
+OUTBOX_FAILED = 'failed'
+OUTBOX_STATUS = (
+    (OUTBOX_PENDING, 'Ожидает отправки'),
+    (OUTBOX_SENT, 'Отправлено'),
+    (OUTBOX_FAILED, 'Не отправлено'),
+)
 FIELD_MASK = r"^[A-Za-zА-ЯЁа-яё\@\!\#\$\%\&\'\*\+\/\=\?\^\_\`\{\|\}\~\-\.\ ]+$"
 FIELD_MASK_WITH_DIGITS = (
     r"^[A-Za-zА-ЯЁа-яё\d\@\!\#\$\%\&\'\*\+\/\=\?\^\_\`\{\|\}\~\-\.\ ]{1,30}$"
@@ -42,6 +85,13 @@ class ErrorMessage:
         429: 'Слишком много запросов.',
         431: 'Заголовок слишком большой.',
     }
+    BARCODE_INCORRECT_CHECK_DIGIT = 'Неверная контрольная цифра штрих-кода.'
+    BARCODE_INCORRECT_LENGTH = 'Неверная длина номера для этого типа кода.'
+    BARCODE_INCORRECT_SYMBOLS = (
+        'Номер содержит символы, недопустимые для этого типа кода.'
+    )
+    BARCODE_NOT_SET = 'У карты нет номера штрих-кода.'
+    BARCODE_TOO_LONG = 'Номер слишком длинный для QR-кода.'
     CANNOT_SHARE_WITH_SELF = 'Вы не можете поделиться картой с самим собой.'
     CARD_HAS_NO_BARCODE_OR_NUMBER = (
         'Необходимо указать номер карты и/или штрих-кода.'
@@ -64,6 +114,7 @@ class ErrorMessage:
         'Название может содержать только буквы, цифры, пробелы и спецсимволы.'
     )
     INCORRECT_EMAIL = 'Введен некорректный email'
+    INCORRECT_IMAGE = 'Файл поврежден или не является изображением.'
     INCORRECT_SHOP_TITLE = (
         'Название может содержать только буквы, цифры, пробелы и спецсимволы.'
     )
@@ -72,11 +123,16 @@ class ErrorMessage:
         'заглавную, одну строчную буквы и одну цифру. '
         'Минимальная длина - 8 знаков.'
     )
+    IMPORT_INCORRECT_ENCODING = 'Файл должен быть в кодировке UTF-8.'
+    IMPORT_INCORRECT_ROW = 'Строка должна быть JSON-объектом.'
+    IMPORT_NO_SHOP = 'Магазин с таким названием не найден.'
+    INCORRECT_SYNC_TOKEN = 'Неверный токен синхронизации.'
     INCORRECT_UID = 'Неверный формат uid.'
     INCORRECT_USAGE_STATISTICS = (
         'Счётчик использования можно только увеличить!'
     )
     INCORRECT_USERS_DATA = 'Неверные данные пользователя.'
+    INCORRECT_CARD_ID = 'Ключом должен быть id карты.'
     INVALID_CREDENTIALS = 'Неверные учетные данные.'
     MUST_HAVE = 'Обязательное поле.'
     NAME_INCORRECT = 'Имя может содержать только буквы, пробелы и спецсимволы.'
@@ -106,6 +162,8 @@ class ErrorMessage:
         'Имя может содержать только буквы, цифры, пробелы и спецсимволы.'
     )
     TOO_SIMILAR_DATA = 'Пароль слишком похож на е-мейл.'
+    TOO_MANY_CARDS = 'Слишком много карт в одном запросе.'
+    TOO_MANY_RECIPIENTS = 'Слишком много получателей в одном запросе.'
 
     def card_already_shared(self, email):
         return (
@@ -0,0 +1,490 @@
+"""Синтетические данные для замеров и нагрузочного тестирования.
+
+Случайные значения берутся из random.Random(seed), поэтому одни и те
+же параметры на одной и той же исходной базе всегда дают одинаковые
+данные. Идентификаторы назначаются заранее от текущего максимума, и
+строки пишутся потоком, без хранения объектов в памяти: пачками через
+bulk_create или через COPY на PostgreSQL. Сигналы моделей при этом не
+срабатывают, поэтому кэш каталога сбрасывается явно.
+
+Распределения приближены к продакшену: популярность магазинов и
+категорий убывает по закону Ципфа, число карт у пользователя
+логнормальное, даты регистрации и добавления карт растянуты на
+DATASET_DAYS дней до DATASET_EPOCH.
+"""
+
+import io
+import math
+import random
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate, islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max
+
+from .barcodes import ean_check_digit
+from .consts import CODE128, EAN_8, EAN_13, QR_код
+from .models import Card, Group, Shop, UserCards
+from .signals import invalidate_catalog
+from .text import search_key
+
+
+User = get_user_model()
+
+DATASET_BATCH_SIZE = 5000
+DATASET_PASSWORD = 'DatasetPass1'
+DATASET_EMAIL = 'user{number}@dataset.example.com'
+DATASET_NAMES = (
+    'Анна', 'Иван', 'Мария', 'Петр', 'Ольга', 'Сергей', 'Елена', 'Дмитрий',
+)
+DATASET_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+DATASET_DAYS = 730
+ACTIVE_USERS_RATIO = 0.95
+VALIDATED_SHOPS_RATIO = 0.8
+MAX_SHOP_GROUPS = 3
+MAX_CARDS_PER_USER = 300
+CARDS_PER_USER_SIGMA = 0.8
+MAX_SHARE_FRIENDS = 3
+FAVOURITE_RATIO = 0.2
+MEAN_USAGE_COUNTER = 5
+ZIPF_EXPONENT = 1.1
+ENCODING_WEIGHTS = (
+    (EAN_13, 0.6),
+    (CODE128, 0.25),
+    (QR_код, 0.1),
+    (EAN_8, 0.05),
+)
+
+BULK_CREATE = 'bulk'
+COPY = 'copy'
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def zipf_weights(count, exponent=ZIPF_EXPONENT):
+    """Накопленные веса рангов 1..count для random.choices."""
+
+    return list(accumulate(
+        1 / rank ** exponent for rank in range(1, count + 1)
+    ))
+
+
+def random_age(rng, limit=DATASET_DAYS * 24 * 60 * 60):
+    """Случайное число секунд до DATASET_EPOCH, не больше limit."""
+
+    return rng.randrange(max(limit, 1))
+
+
+def timestamp(age):
+    return DATASET_EPOCH - timedelta(seconds=age)
+
+
+def barcode(rng, encoding_type):
+    """Номер штрих-кода, который можно отрисовать в encoding_type."""
+
+    if encoding_type in (EAN_13, EAN_8):
+        length = 12 if encoding_type == EAN_13 else 7
+        digits = ''.join(str(rng.randrange(10)) for _ in range(length))
+        return digits + ean_check_digit(digits)
+    return str(rng.randrange(10 ** 9, 10 ** 16))
+
+
+def copy_value(value):
+    """Значение в текстовом формате COPY."""
+
+    if value is None:
+        return r'\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return (
+        str(value).replace('\\', '\\\\').replace('\t', '\\t')
+        .replace('\n', '\\n').replace('\r', '\\r')
+    )
+
+
+@contextmanager
+def manual_timestamps(*models):
+    """Отключает auto_now и auto_now_add, чтобы сохранить даты из строк.
+
+    bulk_create вызывает pre_save полей, и без этого все даты стали
+    бы текущим временем.
+    """
+
+    fields = [
+        (field, field.auto_now, field.auto_now_add)
+        for model in models
+        for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False)
+        or getattr(field, 'auto_now_add', False)
+    ]
+    for field, _, _ in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in fields:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class BulkCreateWriter:
+    """Пишет строки моделей пачками через bulk_create."""
+
+    def __init__(self, batch_size, using=DEFAULT_DB_ALIAS):
+        self.batch_size = batch_size
+        self.using = using
+
+    def write(self, model, fields, rows):
+        """Сохраняет кортежи значений полей fields, возвращает их число."""
+
+        count = 0
+        for batch in batched(rows, self.batch_size):
+            model.objects.using(self.using).bulk_create(
+                [model(**dict(zip(fields, row))) for row in batch]
+            )
+            count += len(batch)
+        return count
+
+
+class CopyWriter(BulkCreateWriter):
+    """Пишет строки моделей через COPY FROM STDIN, только PostgreSQL."""
+
+    def write(self, model, fields, rows):
+        """Как bulk_create, остальные поля берут значения по умолчанию.
+
+        COPY не знает о значениях по умолчанию Django, поэтому они
+        дописываются в каждую строку явно.
+        """
+
+        connection = connections[self.using]
+        quote_name = connection.ops.quote_name
+        model_fields = [model._meta.get_field(name) for name in fields]
+        defaults = [
+            field for field in model._meta.concrete_fields
+            if field not in model_fields and not field.primary_key
+        ]
+        default_values = tuple(field.get_default() for field in defaults)
+        model_fields += defaults
+        sql = 'COPY {} ({}) FROM STDIN'.format(
+            quote_name(model._meta.db_table),
+            ', '.join(quote_name(field.column) for field in model_fields),
+        )
+        count = 0
+        with connection.cursor() as cursor:
+            for batch in batched(rows, self.batch_size):
+                buffer = io.StringIO()
+                for row in batch:
+                    buffer.write('\t'.join(
+                        copy_value(field.get_db_prep_save(value, connection))
+                        for field, value in zip(
+                            model_fields, row + default_values
+                        )
+                    ))
+                    buffer.write('\n')
+                buffer.seek(0)
+                cursor.copy_expert(sql, buffer)
+                count += len(batch)
+        return count
+
+
+class DatasetGenerator:
+    """Генератор категорий, магазинов, пользователей и их карт.
+
+    cards_per_user - среднее число карт, которыми владеет пользователь;
+    доля share_ratio карт поделена с 1..MAX_SHARE_FRIENDS случайными
+    пользователями. run() возвращает число строк по моделям, id первого
+    созданного пользователя после него лежит в first_user_id.
+    """
+
+    def __init__(
+            self,
+            users,
+            cards_per_user,
+            shops,
+            groups,
+            share_ratio=0.0,
+            seed=0,
+            batch_size=DATASET_BATCH_SIZE,
+            method=None,
+            using=DEFAULT_DB_ALIAS,
+    ):
+        if shops < 1 and users and cards_per_user:
+            raise ValueError('Cards need at least one shop')
+        vendor = connections[using].vendor
+        if method is None:
+            method = COPY if vendor == 'postgresql' else BULK_CREATE
+        if method == COPY and vendor != 'postgresql':
+            raise ValueError('COPY is only available on PostgreSQL')
+        writer_class = CopyWriter if method == COPY else BulkCreateWriter
+        self.writer = writer_class(batch_size, using)
+        self.users = users
+        self.cards_per_user = cards_per_user
+        self.shops = shops
+        self.groups = groups
+        self.share_ratio = share_ratio
+        self.batch_size = batch_size
+        self.using = using
+        self.rng = random.Random(seed)
+        self.counts = {}
+        # Секунды от регистрации до DATASET_EPOCH по порядку пользователей.
+        self.joined = array('L')
+
+    def next_id(self, model):
+        return (
+            model.objects.using(self.using).aggregate(Max('pk'))['pk__max']
+            or 0
+        ) + 1
+
+    def write(self, model, fields, rows):
+        count = self.writer.write(model, fields, rows)
+        self.counts[model._meta.label] = (
+            self.counts.get(model._meta.label, 0) + count
+        )
+
+    def run(self):
+        models = (Group, Shop, User, Card, UserCards)
+        with transaction.atomic(using=self.using), manual_timestamps(*models):
+            self.first_group_id = self.next_id(Group)
+            self.first_shop_id = self.next_id(Shop)
+            self.first_user_id = self.next_id(User)
+            self.first_card_id = self.next_id(Card)
+            self.write(Group, ('id', 'name'), self.group_rows())
+            self.write(
+                Shop,
+                (
+                    'id',
+                    'name',
+                    'normalized_name',
+                    'color',
+                    'validation',
+                    'updated_at',
+                ),
+                self.shop_rows(),
+            )
+            self.write(
+                Shop.group.through,
+                ('shop_id', 'group_id'),
+                self.shop_group_rows(),
+            )
+            self.write(
+                User,
+                (
+                    'id',
+                    'email',
+                    'name',
+                    'phone_number',
+                    'password',
+                    'is_active',
+                    'date_joined',
+                ),
+                self.user_rows(),
+            )
+            self.write_cards()
+            self.reset_sequences(models)
+            # Кэш списков карт не сбрасывается: новые id больше всех
+            # существующих, и закэшированных списков у них быть не может.
+            invalidate_catalog()
+        return self.counts
+
+    def reset_sequences(self, models):
+        """Сдвигает последовательности id за назначенные вручную."""
+
+        connection = connections[self.using]
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+
+    def group_rows(self):
+        for group_id in range(
+                self.first_group_id, self.first_group_id + self.groups
+        ):
+            yield group_id, f'Group {group_id}'
+
+    def shop_rows(self):
+        for shop_id in range(
+                self.first_shop_id, self.first_shop_id + self.shops
+        ):
+            name = f'Shop {shop_id}'
+            yield (
+                shop_id,
+                name,
+                search_key(name),
+                f'#{self.rng.randrange(0x1000000):06X}',
+                self.rng.random() < VALIDATED_SHOPS_RATIO,
+                timestamp(random_age(self.rng)),
+            )
+
+    def shop_group_rows(self):
+        if not self.groups:
+            return
+        group_ids = range(
+            self.first_group_id, self.first_group_id + self.groups
+        )
+        weights = zipf_weights(self.groups)
+        for shop_id in range(
+                self.first_shop_id, self.first_shop_id + self.shops
+        ):
+            count = self.rng.randint(1, min(MAX_SHOP_GROUPS, self.groups))
+            chosen = set()
+            while len(chosen) < count:
+                chosen.update(
+                    self.rng.choices(group_ids, cum_weights=weights)
+                )
+            for group_id in sorted(chosen):
+                yield shop_id, group_id
+
+    def user_rows(self):
+        password = make_password(DATASET_PASSWORD)
+        for user_id in range(
+                self.first_user_id, self.first_user_id + self.users
+        ):
+            joined = random_age(self.rng)
+            self.joined.append(joined)
+            yield (
+                user_id,
+                DATASET_EMAIL.format(number=user_id),
+                self.rng.choice(DATASET_NAMES),
+                f'9{self.rng.randrange(10 ** 9):09d}',
+                password,
+                self.rng.random() < ACTIVE_USERS_RATIO,
+                timestamp(joined),
+            )
+
+    def card_count(self):
+        """Число карт пользователя, в среднем cards_per_user."""
+
+        if not self.cards_per_user:
+            return 0
+        mu = math.log(self.cards_per_user) - CARDS_PER_USER_SIGMA ** 2 / 2
+        return min(
+            round(self.rng.lognormvariate(mu, CARDS_PER_USER_SIGMA)),
+            MAX_CARDS_PER_USER,
+        )
+
+    def write_cards(self):
+        """Пишет карты и списки карт пачками по batch_size карт."""
+
+        shop_ids = range(self.first_shop_id, self.first_shop_id + self.shops)
+        shop_weights = zipf_weights(self.shops)
+        encodings, encoding_weights = zip(*ENCODING_WEIGHTS)
+        card_id = self.first_card_id
+        cards, user_cards = [], []
+        for user_id in range(
+                self.first_user_id, self.first_user_id + self.users
+        ):
+            for _ in range(self.card_count()):
+                age = random_age(
+                    self.rng, self.joined[user_id - self.first_user_id]
+                )
+                pub_date = timestamp(age)
+                encoding_type = self.rng.choices(
+                    encodings, encoding_weights
+                )[0]
+                cards.append((
+                    card_id,
+                    f'Card {card_id}',
+                    self.rng.choices(shop_ids, cum_weights=shop_weights)[0],
+                    str(self.rng.randrange(10 ** 8, 10 ** 16)),
+                    barcode(self.rng, encoding_type),
+                    encoding_type,
+                    pub_date,
+                    pub_date,
+                ))
+                user_cards.extend(self.user_card_rows(user_id, card_id, age))
+                card_id += 1
+                if len(cards) >= self.batch_size:
+                    self.write_card_batch(cards, user_cards)
+                    cards, user_cards = [], []
+        self.write_card_batch(cards, user_cards)
+
+    def user_card_rows(self, owner_id, card_id, age):
+        yield self.user_card(owner_id, card_id, True, None, timestamp(age))
+        if self.users < 2 or self.rng.random() >= self.share_ratio:
+            return
+        friends = set()
+        for _ in range(self.rng.randint(1, MAX_SHARE_FRIENDS)):
+            friend_id = self.first_user_id + self.rng.randrange(self.users)
+            if friend_id != owner_id:
+                friends.add(friend_id)
+        for friend_id in sorted(friends):
+            yield self.user_card(
+                friend_id,
+                card_id,
+                False,
+                owner_id,
+                timestamp(random_age(self.rng, age)),
+            )
+
+    def user_card(self, user_id, card_id, owner, shared_by_id, pub_date):
+        return (
+            user_id,
+            card_id,
+            owner,
+            self.rng.random() < FAVOURITE_RATIO,
+            shared_by_id,
+            int(self.rng.expovariate(1 / MEAN_USAGE_COUNTER)),
+            pub_date,
+            pub_date,
+        )
+
+    def write_card_batch(self, cards, user_cards):
+        self.write(
+            Card,
+            (
+                'id',
+                'name',
+                'shop_id',
+                'card_number',
+                'barcode_number',
+                'encoding_type',
+                'pub_date',
+                'updated_at',
+            ),
+            cards,
+        )
+        self.write(
+            UserCards,
+            (
+                'user_id',
+                'card_id',
+                'owner',
+                'favourite',
+                'shared_by_id',
+                'usage_counter',
+                'pub_date',
+                'updated_at',
+            ),
+            user_cards,
+        )
+
+
+def seed_dataset(
+        users,
+        cards_per_user,
+        shops,
+        groups,
+        share_ratio=0.0,
+        seed=0,
+        batch_size=DATASET_BATCH_SIZE,
+):
+    """Создает данные, возвращает queryset созданных пользователей.
+
+    У всех пользователей пароль DATASET_PASSWORD.
+    """
+
+    generator = DatasetGenerator(
+        users, cards_per_user, shops, groups, share_ratio, seed, batch_size
+    )
+    generator.run()
+    return User.objects.filter(
+        pk__gte=generator.first_user_id,
+        pk__lt=generator.first_user_id + users,
+    ).order_by('pk')
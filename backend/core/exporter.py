@@ -0,0 +1,72 @@
+import csv
+import json
+
+from .consts import EXPORT_CHUNK_SIZE, IMPORT_CSV, IMPORT_JSONL
+from .models import UserCards
+
+
+EXPORT_FIELDS = (
+    ('name', 'card__name'),
+    ('shop', 'card__shop__name'),
+    ('card_number', 'card__card_number'),
+    ('barcode_number', 'card__barcode_number'),
+    ('encoding_type', 'card__encoding_type'),
+    ('favourite', 'favourite'),
+    ('owner', 'owner'),
+    ('usage_counter', 'usage_counter'),
+    ('pub_date', 'pub_date'),
+)
+EXPORT_CONTENT_TYPES = {
+    IMPORT_CSV: 'text/csv; charset=utf-8',
+    IMPORT_JSONL: 'application/x-ndjson; charset=utf-8',
+}
+
+
+class Echo:
+    """Файлоподобный объект, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def wallet_rows(user):
+    """Строки списка карт пользователя, читаемые из базы пачками.
+
+    Поля совпадают с полями импорта, поэтому выгрузку можно загрузить
+    обратно.
+    """
+
+    return (
+        UserCards.objects.filter(user=user)
+        .order_by('-pub_date', '-id')
+        .values_list(*(lookup for _, lookup in EXPORT_FIELDS))
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+
+def encode_value(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(name for name, _ in EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow(map(encode_value, row))
+
+
+def iter_jsonl(rows):
+    names = tuple(name for name, _ in EXPORT_FIELDS)
+    for row in rows:
+        yield json.dumps(
+            dict(zip(names, map(encode_value, row))), ensure_ascii=False
+        ) + '\n'
+
+
+def export_wallet(user, file_format):
+    """Возвращает (генератор строк выгрузки, тип содержимого)."""
+
+    encode = iter_csv if file_format == IMPORT_CSV else iter_jsonl
+    return encode(wallet_rows(user)), EXPORT_CONTENT_TYPES[file_format]
@@ -0,0 +1,304 @@
+"""Обработка логотипов магазинов и изображений карт.
+
+Фото карт приводятся к единому виду при загрузке, уменьшенные копии
+строятся после сохранения. Работа с пикселями идет в пуле процессов.
+Копии лежат в хранилище рядом с оригиналами под предсказуемыми
+именами, поэтому ссылки на них выдаются без обращения к хранилищу.
+"""
+
+import atexit
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .consts import (
+    CARD_IMAGE_MAX_SIZE,
+    CARD_IMAGE_QUALITY,
+    THUMBNAIL_FORMATS,
+    THUMBNAIL_SIZES,
+)
+from .metrics import card_photo_bytes
+from .storage import blob_storage
+
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_DIR = 'thumbs'
+THUMBNAIL_SAVE_OPTIONS = {
+    'png': {'optimize': True},
+    'webp': {'quality': 80, 'method': 4},
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class ImageError(ValueError):
+    """Загруженный файл не удалось разобрать как изображение."""
+
+
+def pool_context():
+    """Процессы пула запускаются без fork текущего процесса.
+
+    У воркера уже работают фоновые потоки (пересборка каталога, сброс
+    счётчиков использования), и fork мог бы унаследовать захваченные
+    ими блокировки. Процессы запускает forkserver, где его нет - spawn.
+    """
+
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def image_pool(max_workers):
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=pool_context(),
+        initializer=django.setup,
+    )
+
+
+def get_executor():
+    """Общий пул процессов для работы с пикселями.
+
+    Создается при первом обращении, поэтому команды и процессы, не
+    работающие с изображениями, не запускают лишних процессов.
+    """
+
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = image_pool(settings.IMAGE_WORKERS)
+        return _executor
+
+
+def discard_executor(executor):
+    """Убирает сломанный пул, следующее задание создаст новый."""
+
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown()
+
+
+def thumbnail_name(name, size, file_format):
+    root, _ = os.path.splitext(name)
+    return f'{THUMBNAIL_DIR}/{root}/{size}.{file_format}'
+
+
+def thumbnail_urls(field_file):
+    """Ссылки на копии: {размер: {формат: url}} или None без файла."""
+
+    if not field_file:
+        return None
+    return name_thumbnail_urls(field_file.name, field_file.storage)
+
+
+def name_thumbnail_urls(name, storage=default_storage):
+    """Ссылки на копии файла по его имени в хранилище."""
+
+    return {
+        str(size): {
+            file_format: storage.url(thumbnail_name(name, size, file_format))
+            for file_format in THUMBNAIL_FORMATS
+        }
+        for size in THUMBNAIL_SIZES
+    }
+
+
+def has_thumbnails(name, storage=default_storage):
+    return storage.exists(
+        thumbnail_name(name, THUMBNAIL_SIZES[-1], THUMBNAIL_FORMATS[-1])
+    )
+
+
+def load_image(name, storage=default_storage):
+    """Открывает изображение с учетом ориентации из EXIF."""
+
+    with storage.open(name, 'rb') as image_file:
+        image = Image.open(image_file)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert(
+            'RGBA' if image.mode in ('P', 'LA', 'PA') else 'RGB'
+        )
+    return image
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (
+        image.mode == 'P' and 'transparency' in image.info
+    )
+
+
+def normalize_photo(data, max_size, quality):
+    """Приводит фото к единому виду, возвращает (байты, расширение).
+
+    Ориентация из EXIF применяется к пикселям, метаданные не
+    сохраняются, длинная сторона ограничивается max_size. Фото
+    перекодируются в JPEG, изображения с прозрачностью - в PNG.
+    """
+
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    output = io.BytesIO()
+    if has_alpha(image):
+        image.convert('RGBA').save(output, format='PNG', optimize=True)
+        return output.getvalue(), 'png'
+    image.convert('RGB').save(
+        output,
+        format='JPEG',
+        quality=quality,
+        optimize=True,
+        progressive=True,
+    )
+    return output.getvalue(), 'jpg'
+
+
+def normalize_upload(upload):
+    """Загруженное фото карты после нормализации в пуле процессов.
+
+    Поток запроса блокируется до конца обработки: пул не делает
+    загрузку асинхронной. Он выносит разбор и кодирование из
+    процесса воркера, поэтому GIL не держится во время обработки, а
+    падение на вредоносном файле не убивает воркер. Размер до и после
+    нормализации копится в метрике card_photo_bytes_total.
+    Файл, который не удалось разобрать, дает ImageError.
+    """
+
+    upload.seek(0)
+    data = upload.read()
+    arguments = (data, CARD_IMAGE_MAX_SIZE, CARD_IMAGE_QUALITY)
+    try:
+        if settings.IMAGE_NORMALIZE_IN_POOL:
+            executor = get_executor()
+            try:
+                content, extension = executor.submit(
+                    normalize_photo, *arguments
+                ).result()
+            except BrokenProcessPool:
+                discard_executor(executor)
+                raise
+        else:
+            content, extension = normalize_photo(*arguments)
+    except (
+        OSError, Image.DecompressionBombError, BrokenProcessPool
+    ) as error:
+        raise ImageError(str(error)) from error
+    root, _ = os.path.splitext(os.path.basename(upload.name))
+    name = f'{root}.{extension}'
+    card_photo_bytes.inc(len(data), stage='received')
+    card_photo_bytes.inc(len(content), stage='stored')
+    logger.info(
+        'Card photo %s normalized: %d -> %d bytes, saved %d',
+        name, len(data), len(content), len(data) - len(content),
+    )
+    return ContentFile(content, name=name)
+
+
+def generate_thumbnails(name, storage=default_storage):
+    """Строит копии всех размеров и форматов, возвращает их количество.
+
+    Копия вписывается в квадрат с сохранением пропорций и не бывает
+    больше оригинала. Существующие копии перезаписываются.
+    """
+
+    image = load_image(name, storage)
+    count = 0
+    for size in THUMBNAIL_SIZES:
+        thumbnail = image.copy()
+        thumbnail.thumbnail((size, size), Image.Resampling.LANCZOS)
+        for file_format in THUMBNAIL_FORMATS:
+            output = io.BytesIO()
+            thumbnail.save(
+                output,
+                format=file_format.upper(),
+                **THUMBNAIL_SAVE_OPTIONS[file_format],
+            )
+            path = thumbnail_name(name, size, file_format)
+            storage.delete(path)
+            storage.save(path, ContentFile(output.getvalue()))
+            count += 1
+    return count
+
+
+def delete_thumbnails(name, storage=default_storage):
+    for size in THUMBNAIL_SIZES:
+        for file_format in THUMBNAIL_FORMATS:
+            storage.delete(thumbnail_name(name, size, file_format))
+
+
+def release_image(name):
+    """Снимает ссылку на изображение, с последней удаляет и копии."""
+
+    if blob_storage.delete(name):
+        delete_thumbnails(name)
+
+
+def _log_failure(name):
+    def callback(future):
+        error = future.exception()
+        if error is not None:
+            logger.error('Thumbnails for %s failed: %s', name, error)
+
+    return callback
+
+
+def schedule_thumbnails(name):
+    """Ставит построение копий в пул процессов.
+
+    Хранилище передается вместе с заданием: процесс пула не знает
+    о настройках, измененных после его запуска.
+    """
+
+    if not settings.THUMBNAILS_ASYNC:
+        generate_thumbnails(name)
+        return
+    get_executor().submit(
+        generate_thumbnails, name, default_storage
+    ).add_done_callback(_log_failure(name))
+
+
+def _generate_item(name):
+    try:
+        return generate_thumbnails(name)
+    except Exception as error:
+        logger.error('Thumbnails for %s failed: %s', name, error)
+        return None
+
+
+def generate_many(names, workers=None):
+    """Строит копии для пачки файлов в отдельных процессах.
+
+    Возвращает количество копий в порядке names, None для файлов,
+    которые не удалось открыть.
+    """
+
+    names = list(names)
+    if workers == 1 or len(names) < 2:
+        return [_generate_item(name) for name in names]
+    with image_pool(workers) as executor:
+        return list(executor.map(_generate_item, names, chunksize=8))
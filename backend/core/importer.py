@@ -0,0 +1,220 @@
+import csv
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .consts import (
+    CARD_IMPORT_CHUNK_SIZE,
+    CARD_IMPORT_MAX_ERRORS,
+    EAN_13,
+    IMPORT_CSV,
+    IMPORT_JSONL,
+    ErrorMessage,
+)
+from .models import Card, Shop, UserCards
+from .signals import invalidate_wallets
+from .text import search_key
+
+
+IMPORT_FIELDS = (
+    'name',
+    'shop',
+    'card_number',
+    'barcode_number',
+    'encoding_type',
+)
+TRUE_VALUES = frozenset(('1', 'true', 'yes', 'y', 'да', '+'))
+JSONL_EXTENSIONS = ('.jsonl', '.ndjson', '.json')
+
+
+class ImportRowError(Exception):
+    """Ошибка в строке файла импорта."""
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def decode_lines(lines):
+    """Декодирует строки загруженного файла по одной."""
+
+    for line in lines:
+        if isinstance(line, bytes):
+            try:
+                line = line.decode('utf-8-sig')
+            except UnicodeDecodeError:
+                raise ImportRowError(
+                    {'file': [ErrorMessage.IMPORT_INCORRECT_ENCODING]}
+                )
+        yield line
+
+
+def read_csv(lines):
+    """Строки CSV с заголовком как пары (номер строки, словарь)."""
+
+    rows = csv.DictReader(lines)
+    for row in rows:
+        yield rows.line_num, row
+
+
+def read_jsonl(lines):
+    """Строки JSON Lines как пары (номер строки, словарь или ошибка)."""
+
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        if not isinstance(row, dict):
+            row = ImportRowError(
+                {'row': [ErrorMessage.IMPORT_INCORRECT_ROW]}
+            )
+        yield line_number, row
+
+
+def guess_import_format(file_name):
+    if str(file_name).lower().endswith(JSONL_EXTENSIONS):
+        return IMPORT_JSONL
+    return IMPORT_CSV
+
+
+def read_rows(lines, file_format):
+    lines = decode_lines(lines)
+    if file_format == IMPORT_CSV:
+        return read_csv(lines)
+    return read_jsonl(lines)
+
+
+class CardImporter:
+    """Потоковый импорт карт в список пользователя.
+
+    Строки читаются по одной и пишутся в базу пачками по
+    CARD_IMPORT_CHUNK_SIZE, поэтому память не зависит от размера файла.
+    Магазины ищутся по нормализованному названию (search_key) в индексе,
+    собранном один раз на импорт, так же как при создании карты;
+    при совпадении названий предпочтение отдается проверенным.
+    Карты, которые уже есть в списке пользователя, пропускаются.
+    """
+
+    def __init__(self, user, chunk_size=CARD_IMPORT_CHUNK_SIZE):
+        self.user = user
+        self.chunk_size = chunk_size
+        self.created = 0
+        self.skipped = 0
+        self.failed = 0
+        self.errors = []
+        self._shops = None
+
+    @property
+    def shops(self):
+        if self._shops is None:
+            # Порядок как в match_shop: при совпадении ключей остается
+            # проверенный магазин с наименьшим id.
+            self._shops = dict(
+                Shop.objects.order_by('validation', '-id')
+                .values_list('normalized_name', 'id')
+                .iterator()
+            )
+        return self._shops
+
+    def add_error(self, line_number, errors):
+        self.failed += 1
+        if len(self.errors) < CARD_IMPORT_MAX_ERRORS:
+            self.errors.append({'line': line_number, 'errors': errors})
+
+    def build_card(self, row):
+        """Проверяет строку и возвращает (карта, избранное)."""
+
+        values = {
+            field: str(row.get(field) or '').strip()
+            for field in IMPORT_FIELDS
+        }
+        shop_id = self.shops.get(search_key(values.pop('shop')))
+        if shop_id is None:
+            raise ImportRowError({'shop': [ErrorMessage.IMPORT_NO_SHOP]})
+        card = Card(shop_id=shop_id, **values)
+        card.encoding_type = card.encoding_type or EAN_13
+        try:
+            card.clean_fields(exclude=('shop',))
+        except ValidationError as error:
+            raise ImportRowError(error.message_dict)
+        if not (card.card_number or card.barcode_number):
+            raise ImportRowError(
+                {'card': [ErrorMessage.CARD_HAS_NO_BARCODE_OR_NUMBER]}
+            )
+        favourite = str(row.get('favourite') or '').strip().casefold()
+        return card, favourite in TRUE_VALUES
+
+    def card_key(self, card):
+        return card.shop_id, card.card_number, card.barcode_number
+
+    def write_chunk(self, chunk):
+        """Создает карты пачки, пропуская уже имеющиеся у пользователя."""
+
+        existing = set(
+            Card.objects.filter(
+                users=self.user,
+                shop_id__in={card.shop_id for card, _ in chunk},
+                card_number__in={card.card_number for card, _ in chunk},
+            ).values_list('shop_id', 'card_number', 'barcode_number')
+        )
+        new_cards = []
+        for card, favourite in chunk:
+            key = self.card_key(card)
+            if key in existing:
+                self.skipped += 1
+                continue
+            existing.add(key)
+            new_cards.append((card, favourite))
+        if not new_cards:
+            return
+
+        with transaction.atomic():
+            cards = Card.objects.bulk_create(card for card, _ in new_cards)
+            UserCards.objects.bulk_create(
+                UserCards(
+                    user=self.user,
+                    card=card,
+                    owner=True,
+                    favourite=favourite,
+                )
+                for card, (_, favourite) in zip(cards, new_cards)
+            )
+        self.created += len(cards)
+
+    def run(self, rows):
+        """Импортирует пары (номер строки, словарь) и возвращает отчет."""
+
+        chunk = []
+        try:
+            try:
+                for line_number, row in rows:
+                    try:
+                        if isinstance(row, ImportRowError):
+                            raise row
+                        chunk.append(self.build_card(row))
+                    except ImportRowError as error:
+                        self.add_error(line_number, error.errors)
+                        continue
+                    if len(chunk) >= self.chunk_size:
+                        self.write_chunk(chunk)
+                        chunk = []
+            except ImportRowError as error:
+                self.add_error(None, error.errors)
+            if chunk:
+                self.write_chunk(chunk)
+        finally:
+            if self.created:
+                invalidate_wallets((self.user.pk,))
+        return self.report()
+
+    def report(self):
+        return {
+            'created': self.created,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'errors': self.errors,
+        }
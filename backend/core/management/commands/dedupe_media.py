@@ -0,0 +1,61 @@
+from collections import Counter
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Blob, Card, Shop, UserCards
+from core.signals import invalidate_catalog, invalidate_wallets
+from core.storage import BLOB_DIR, blob_storage
+
+
+IMAGE_FIELDS = ((Card, 'image'), (Shop, 'logo'))
+
+
+class Command(BaseCommand):
+    """Команда для переноса загруженных файлов в хранилище по хэшу."""
+
+    help = 'Move existing card images and shop logos into the blob storage'
+
+    def handle(self, *args, **options):
+        references = Counter()
+        for model, field in IMAGE_FIELDS:
+            references.update(
+                model.objects.exclude(**{f'{field}__startswith': BLOB_DIR})
+                .exclude(**{field: ''})
+                .exclude(**{f'{field}__isnull': True})
+                .values_list(field, flat=True)
+            )
+
+        moved = failed = freed = 0
+        for name, count in references.items():
+            try:
+                size = blob_storage.size(name)
+                with blob_storage.open(name, 'rb') as content:
+                    with transaction.atomic():
+                        blob_name = blob_storage.save(name, content)
+                        if count > 1:
+                            blob_storage.add_reference(
+                                blob_name, size, count - 1
+                            )
+                        for model, field in IMAGE_FIELDS:
+                            model.objects.filter(**{field: name}).update(
+                                **{field: blob_name}
+                            )
+            except OSError as error:
+                self.stderr.write(f'{name}: {error}')
+                failed += 1
+                continue
+            if Blob.objects.get(name=blob_name).references > count:
+                freed += size
+            default_storage.delete(name)
+            moved += 1
+
+        if moved:
+            invalidate_catalog()
+            invalidate_wallets(
+                UserCards.objects.values_list('user_id', flat=True).distinct()
+            )
+        self.stdout.write(
+            f'Moved {moved} files, failed {failed}, freed {freed} bytes'
+        )
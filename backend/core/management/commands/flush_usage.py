@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from core.usage import usage_buffer
+
+
+class Command(BaseCommand):
+    """Команда для записи в базу журналов отложенных счётчиков."""
+
+    help = 'Apply usage counter journals left by stopped workers'
+
+    def handle(self, *args, **kwargs):
+        recovered = usage_buffer.recover()
+        self.stdout.write(f'Recovered {recovered} usage counters')
@@ -0,0 +1,89 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from core.dataset import (
+    BULK_CREATE,
+    COPY,
+    DATASET_BATCH_SIZE,
+    DATASET_PASSWORD,
+    DatasetGenerator,
+)
+
+
+class Command(BaseCommand):
+    """Команда для наполнения базы синтетическими данными.
+
+    Нужна, чтобы локально воспроизводить планы запросов продакшена:
+    после записи по таблицам собирается статистика (ANALYZE).
+    """
+
+    help = (
+        'Generate synthetic groups, shops, users and cards with realistic '
+        'distributions for capacity testing'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument(
+            '--cards-per-user',
+            type=float,
+            default=10,
+            help='Mean number of cards owned by a user',
+        )
+        parser.add_argument('--shops', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument(
+            '--share-ratio',
+            type=float,
+            default=0.1,
+            help='Share of cards shared with other users',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--batch-size', type=int, default=DATASET_BATCH_SIZE
+        )
+        parser.add_argument(
+            '--method',
+            choices=(BULK_CREATE, COPY),
+            help='Insert method, COPY on PostgreSQL by default',
+        )
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        if min(
+            options['users'], options['shops'], options['groups']
+        ) < 0 or options['cards_per_user'] < 0:
+            raise CommandError('Counts must not be negative')
+        if options['batch_size'] < 1:
+            raise CommandError('Batch size must be positive')
+        try:
+            generator = DatasetGenerator(
+                options['users'],
+                options['cards_per_user'],
+                options['shops'],
+                options['groups'],
+                options['share_ratio'],
+                options['seed'],
+                options['batch_size'],
+                options['method'],
+                options['database'],
+            )
+        except ValueError as error:
+            raise CommandError(error)
+
+        started = time.perf_counter()
+        counts = generator.run()
+        elapsed = time.perf_counter() - started
+        for label, count in counts.items():
+            self.stdout.write(f'{label}: {count} rows')
+        self.stdout.write(
+            f'Generated {sum(counts.values())} rows in {elapsed:.1f} s, '
+            f'user password: {DATASET_PASSWORD}'
+        )
+
+        connection = connections[options['database']]
+        if connection.vendor in ('postgresql', 'sqlite'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
@@ -0,0 +1,52 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.consts import IMPORT_FORMATS
+from core.importer import CardImporter, guess_import_format, read_rows
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """Команда для импорта карт пользователя из CSV или JSON Lines."""
+
+    help = 'Import cards into the user wallet from CSV or JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSON Lines file')
+        parser.add_argument(
+            '--user',
+            required=True,
+            help='Email of the wallet owner',
+        )
+        parser.add_argument(
+            '--format',
+            choices=[choice for choice, _ in IMPORT_FORMATS],
+            help='File format, guessed from the extension by default',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(email=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f'User {options["user"]} not found')
+        file_format = options['format'] or guess_import_format(
+            options['path']
+        )
+        try:
+            with open(
+                options['path'], encoding='utf-8-sig', newline=''
+            ) as lines:
+                report = CardImporter(user).run(
+                    read_rows(lines, file_format)
+                )
+        except OSError as error:
+            raise CommandError(f'Import failed: {error}')
+
+        for error in report['errors']:
+            self.stderr.write(f'line {error["line"]}: {error["errors"]}')
+        self.stdout.write(
+            f'Created {report["created"]}, skipped {report["skipped"]}, '
+            f'failed {report["failed"]}'
+        )
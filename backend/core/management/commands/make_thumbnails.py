@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from core.images import generate_many, has_thumbnails
+from core.models import Card, Shop
+
+
+class Command(BaseCommand):
+    """Команда для построения копий уже загруженных изображений."""
+
+    help = 'Generate thumbnails for existing shop logos and card images'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate existing thumbnails',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Number of processes, CPU count by default',
+        )
+
+    def handle(self, *args, **options):
+        names = set(
+            Shop.objects.exclude(logo__isnull=True).exclude(logo='')
+            .values_list('logo', flat=True)
+        ) | set(
+            Card.objects.exclude(image='').values_list('image', flat=True)
+        )
+        if not options['force']:
+            names = [name for name in names if not has_thumbnails(name)]
+        results = generate_many(sorted(names), options['workers'])
+        failed = results.count(None)
+        self.stdout.write(
+            f'Processed {len(results) - failed} images, failed {failed}'
+        )
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from core.sync import purge_tombstones
+
+
+class Command(BaseCommand):
+    """Команда для удаления устаревших отметок об удалении карт."""
+
+    help = 'Delete card tombstones older than WALLET_SYNC_TOMBSTONE_TTL'
+
+    def handle(self, *args, **kwargs):
+        deleted = purge_tombstones()
+        self.stdout.write(f'Deleted {deleted} tombstones')
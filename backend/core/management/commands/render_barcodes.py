@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from core.barcodes import BARCODE_FORMATS, render_many
+from core.consts import BARCODE_SCALE
+from core.models import Card
+
+
+class Command(BaseCommand):
+    """Команда для заполнения дискового кэша штрих-кодов карт."""
+
+    help = 'Render barcodes of all cards into the disk cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format',
+            choices=BARCODE_FORMATS,
+            action='append',
+            help='Barcode format, all formats by default',
+        )
+        parser.add_argument(
+            '--scale',
+            type=int,
+            default=BARCODE_SCALE,
+            help='Module size in pixels',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Number of rendering processes, CPU count by default',
+        )
+
+    def handle(self, *args, **options):
+        cards = (
+            Card.objects.exclude(barcode_number='')
+            .order_by()
+            .values_list('encoding_type', 'barcode_number')
+            .distinct()
+        )
+        items = [
+            (encoding_type, barcode_number, file_format, options['scale'])
+            for encoding_type, barcode_number in cards.iterator()
+            for file_format in options['format'] or BARCODE_FORMATS
+        ]
+        digests = render_many(items, options['workers'])
+        failed = digests.count(None)
+        self.stdout.write(
+            f'Rendered {len(digests) - failed}, failed {failed}'
+        )
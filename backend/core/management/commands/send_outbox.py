@@ -0,0 +1,44 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.outbox import send_pending
+
+
+class Command(BaseCommand):
+    """Команда для отправки писем из очереди."""
+
+    help = 'Send queued emails from the outbox in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.EMAIL_OUTBOX_BATCH_SIZE,
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep polling the outbox instead of exiting when empty',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=settings.EMAIL_OUTBOX_POLL_INTERVAL,
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        try:
+            while True:
+                processed = send_pending(options['batch_size'])
+                total += processed
+                if processed:
+                    continue
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f'Processed {total} emails')
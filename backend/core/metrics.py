@@ -0,0 +1,384 @@
+"""Метрики в текстовом формате Prometheus, общие для всех воркеров.
+
+Каждый процесс пишет свои счетчики в отдельный файл в METRICS_DIR,
+отображенный в память, поэтому обновление - это запись нескольких
+байт без системных вызовов. При сборе значения из файлов всех
+процессов складываются. Файлы завершившихся воркеров остаются, и
+счетчики не уменьшаются после перезапуска; каталог очищается при
+деплое. Gauge считаются в момент сбора и в файлы не пишутся.
+"""
+
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Count
+
+from .consts import OUTBOX_STATUS
+from .models import OutboxEmail
+
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, math.inf,
+)
+METRICS_FILE_SIZE = 1 << 20
+HEADER = struct.Struct('q')
+KEY_LENGTH = struct.Struct('i')
+VALUE = struct.Struct('d')
+
+
+def sample_key(name, labels):
+    return json.dumps((name, labels), ensure_ascii=False)
+
+
+def escape(value):
+    return (
+        str(value).replace('\\', r'\\').replace('\n', r'\n')
+        .replace('"', r'\"')
+    )
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_sample(name, labels, value):
+    if labels:
+        name += '{' + ','.join(
+            f'{label}="{escape(label_value)}"'
+            for label, label_value in labels
+        ) + '}'
+    return f'{name} {format_value(value)}'
+
+
+def read_entries(data):
+    """(ключ, смещение значения, значение) из содержимого файла."""
+
+    used = HEADER.unpack_from(data, 0)[0]
+    offset = HEADER.size
+    while offset < used:
+        length = KEY_LENGTH.unpack_from(data, offset)[0]
+        key_end = offset + KEY_LENGTH.size + length
+        key = bytes(data[offset + KEY_LENGTH.size:key_end]).decode()
+        value_offset = key_end + (-key_end % VALUE.size)
+        yield key, value_offset, VALUE.unpack_from(data, value_offset)[0]
+        offset = value_offset + VALUE.size
+
+
+class MetricsFile:
+    """Значения одного процесса в файле, отображенном в память.
+
+    Формат: занятый размер (8 байт), затем записи: длина ключа
+    (4 байта), ключ в UTF-8, выравнивание до 8 байт и значение double.
+    Размер обновляется после записи, поэтому читатель не видит
+    недописанных записей.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'a+b')
+        capacity = os.fstat(self._file.fileno()).st_size
+        if capacity == 0:
+            capacity = METRICS_FILE_SIZE
+            self._file.truncate(capacity)
+        self._mmap = mmap.mmap(self._file.fileno(), capacity)
+        if HEADER.unpack_from(self._mmap, 0)[0] == 0:
+            HEADER.pack_into(self._mmap, 0, HEADER.size)
+        self._used = HEADER.unpack_from(self._mmap, 0)[0]
+        self._offsets = {
+            key: offset for key, offset, _ in read_entries(self._mmap)
+        }
+
+    def add(self, key, amount):
+        offset = self._offsets.get(key)
+        if offset is None:
+            offset = self._allocate(key)
+        VALUE.pack_into(
+            self._mmap, offset, VALUE.unpack_from(self._mmap, offset)[0]
+            + amount
+        )
+
+    def _allocate(self, key):
+        encoded = key.encode()
+        key_end = self._used + KEY_LENGTH.size + len(encoded)
+        offset = key_end + (-key_end % VALUE.size)
+        end = offset + VALUE.size
+        if end > len(self._mmap):
+            capacity = len(self._mmap)
+            while end > capacity:
+                capacity *= 2
+            self._mmap.close()
+            self._file.truncate(capacity)
+            self._mmap = mmap.mmap(self._file.fileno(), capacity)
+        KEY_LENGTH.pack_into(self._mmap, self._used, len(encoded))
+        self._mmap[self._used + KEY_LENGTH.size:key_end] = encoded
+        VALUE.pack_into(self._mmap, offset, 0.0)
+        HEADER.pack_into(self._mmap, 0, end)
+        self._used = end
+        self._offsets[key] = offset
+        return offset
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+
+class Registry:
+    """Метрики приложения и хранилище значений текущего процесса."""
+
+    def __init__(self):
+        self.metrics = []
+        self._lock = threading.Lock()
+        self._file = None
+        self._file_key = None
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add(self, values):
+        """Прибавляет значения [(ключ sample_key, величина)]."""
+
+        if not settings.METRICS_ENABLED:
+            return
+        with self._lock:
+            metrics_file = self._current_file()
+            for key, amount in values:
+                metrics_file.add(key, amount)
+
+    def _current_file(self):
+        # После fork у воркера свой pid и свой файл.
+        file_key = (settings.METRICS_DIR, os.getpid())
+        if self._file_key != file_key:
+            if self._file is not None:
+                self._file.close()
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            self._file = MetricsFile(
+                os.path.join(settings.METRICS_DIR, f'{file_key[1]}.db')
+            )
+            self._file_key = file_key
+        return self._file
+
+    def collect(self):
+        """{(имя, метки): сумма по всем процессам}."""
+
+        samples = defaultdict(float)
+        try:
+            names = sorted(os.listdir(settings.METRICS_DIR))
+        except FileNotFoundError:
+            return samples
+        for name in names:
+            if not name.endswith('.db'):
+                continue
+            with open(os.path.join(settings.METRICS_DIR, name), 'rb') as file:
+                data = file.read()
+            if len(data) < HEADER.size:
+                continue
+            for key, _, value in read_entries(data):
+                sample_name, labels = json.loads(key)
+                samples[sample_name, tuple(map(tuple, labels))] += value
+        return samples
+
+    def render(self):
+        samples = self.collect()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(
+                format_sample(name, labels, value)
+                for name, labels, value in metric.samples(samples)
+            )
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """Удаляет значения всех процессов."""
+
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = self._file_key = None
+            for name in os.listdir(settings.METRICS_DIR):
+                if name.endswith('.db'):
+                    os.remove(os.path.join(settings.METRICS_DIR, name))
+
+
+registry = Registry()
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        # Ключи в файле по набору меток: кодируются один раз.
+        self._keys = {}
+        registry.register(self)
+
+    def keys(self, labels):
+        labels = tuple(sorted((name, str(value)) for name, value in labels))
+        keys = self._keys.get(labels)
+        if keys is None:
+            keys = self._keys[labels] = self.make_keys(labels)
+        return keys
+
+    def make_keys(self, labels):
+        return sample_key(self.name, labels)
+
+    def inc(self, amount=1, **labels):
+        registry.add(((self.keys(labels.items()), amount),))
+
+    def samples(self, samples):
+        return sorted(
+            (name, labels, value)
+            for (name, labels), value in samples.items()
+            if name == self.name
+        )
+
+
+class Histogram(Counter):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = buckets
+
+    def make_keys(self, labels):
+        return (
+            tuple(
+                sample_key(
+                    f'{self.name}_bucket',
+                    sorted((*labels, ('le', format_value(bound)))),
+                )
+                for bound in self.buckets
+            ),
+            sample_key(f'{self.name}_sum', labels),
+            sample_key(f'{self.name}_count', labels),
+        )
+
+    def observe(self, value, **labels):
+        bucket_keys, sum_key, count_key = self.keys(labels.items())
+        registry.add((
+            *(
+                (key, 1)
+                for bound, key in zip(self.buckets, bucket_keys)
+                if value <= bound
+            ),
+            (sum_key, value),
+            (count_key, 1),
+        ))
+
+    def samples(self, samples):
+        series = defaultdict(dict)
+        for (name, labels), value in samples.items():
+            if not name.startswith(f'{self.name}_'):
+                continue
+            suffix = name[len(self.name) + 1:]
+            if suffix == 'bucket':
+                labels = dict(labels)
+                bound = labels.pop('le')
+                series[tuple(sorted(labels.items()))][bound] = value
+            elif suffix in ('sum', 'count'):
+                series[labels][suffix] = value
+        for labels in sorted(series):
+            values = series[labels]
+            for bound in self.buckets:
+                le = format_value(bound)
+                yield (
+                    f'{self.name}_bucket',
+                    (*labels, ('le', le)),
+                    values.get(le, 0),
+                )
+            yield f'{self.name}_sum', labels, values.get('sum', 0)
+            yield f'{self.name}_count', labels, values.get('count', 0)
+
+
+class Gauge:
+    """Значение, которое вычисляет collect(samples) при сборе.
+
+    Ошибка базы пропускает только эту метрику, а не весь ответ.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, collect):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        registry.register(self)
+
+    def samples(self, samples):
+        try:
+            return sorted(
+                (self.name, tuple(sorted(labels.items())), value)
+                for labels, value in self.collect(samples)
+            )
+        except DatabaseError as error:
+            logger.warning('Metric %s is unavailable: %s', self.name, error)
+            return []
+
+
+def cache_hit_ratios(samples):
+    totals = defaultdict(lambda: {'hit': 0, 'miss': 0})
+    for (name, labels), value in samples.items():
+        if name == cache_requests.name:
+            labels = dict(labels)
+            totals[labels['cache']][labels['result']] += value
+    for cache_name, counts in totals.items():
+        total = counts['hit'] + counts['miss']
+        yield {'cache': cache_name}, counts['hit'] / total if total else 0
+
+
+def outbox_depth(samples):
+    counts = dict(
+        OutboxEmail.objects.order_by().values_list('status')
+        .annotate(count=Count('id'))
+    )
+    for status, _ in OUTBOX_STATUS:
+        yield {'status': status}, counts.get(status, 0)
+
+
+request_latency = Histogram(
+    'http_request_duration_seconds',
+    'Время обработки запроса по действию вьюсета.',
+)
+db_queries = Counter(
+    'db_queries_total',
+    'Запросы к базе по действию вьюсета.',
+)
+db_query_time = Counter(
+    'db_query_duration_seconds_total',
+    'Время запросов к базе по действию вьюсета.',
+)
+cache_requests = Counter(
+    'cache_requests_total',
+    'Обращения к кэшам с попаданием (hit) или промахом (miss).',
+)
+card_photo_bytes = Counter(
+    'card_photo_bytes_total',
+    'Размер фото карт до (received) и после (stored) нормализации.',
+)
+cache_hit_ratio = Gauge(
+    'cache_hit_ratio',
+    'Доля попаданий в кэш.',
+    cache_hit_ratios,
+)
+outbox_emails = Gauge(
+    'outbox_emails',
+    'Письма в очереди по статусам.',
+    outbox_depth,
+)
@@ -0,0 +1,35 @@
+# Generated by Django 4.1 on 2026-10-18 07:56
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_empty_pub_date(apps, schema_editor):
+    """Ключ пагинации не может быть пустым: берем дату создания карты."""
+
+    Card = apps.get_model('core', 'Card')
+    UserCards = apps.get_model('core', 'UserCards')
+    UserCards.objects.filter(pub_date__isnull=True).update(
+        pub_date=Subquery(
+            Card.objects.filter(pk=OuterRef('card_id')).values('pub_date')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_alter_card_name_alter_group_name_alter_shop_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_empty_pub_date, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='usercards',
+            index=models.Index(fields=['user', '-pub_date', '-id'], name='usercards_wallet_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usercards',
+            index=models.Index(condition=models.Q(('favourite', True)), fields=['user', '-pub_date', '-id'], name='usercards_favorites_idx'),
+        ),
+    ]
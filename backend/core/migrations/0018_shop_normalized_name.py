@@ -0,0 +1,33 @@
+# Generated by Django 4.1 on 2026-10-18 08:16
+
+from django.db import migrations, models
+
+from core.text import search_key
+
+
+def fill_normalized_name(apps, schema_editor):
+    Shop = apps.get_model('core', 'Shop')
+    shops = list(Shop.objects.only('id', 'name'))
+    for shop in shops:
+        shop.normalized_name = search_key(shop.name)
+    Shop.objects.bulk_update(shops, ('normalized_name',), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_sync_updated_at_tombstone'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='normalized_name',
+            field=models.CharField(blank=True, editable=False, max_length=90, verbose_name='Нормализованное название'),
+        ),
+        migrations.RunPython(fill_normalized_name, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='shop',
+            index=models.Index(fields=['normalized_name', '-validation', 'id'], name='shop_normalized_name_idx'),
+        ),
+    ]
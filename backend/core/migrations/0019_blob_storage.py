@@ -0,0 +1,39 @@
+# Generated by Django 4.1 on 2026-10-18 08:30
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_shop_normalized_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Путь')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Размер')),
+                ('references', models.PositiveIntegerField(default=0, verbose_name='Количество ссылок')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+            ],
+            options={
+                'verbose_name': 'Файл',
+                'verbose_name_plural': 'Файлы',
+                'ordering': ('-created_at',),
+            },
+        ),
+        migrations.AlterField(
+            model_name='card',
+            name='image',
+            field=models.ImageField(blank=True, storage=core.storage.get_blob_storage, upload_to='card/', verbose_name='Изображение карты'),
+        ),
+        migrations.AlterField(
+            model_name='shop',
+            name='logo',
+            field=models.ImageField(blank=True, null=True, storage=core.storage.get_blob_storage, upload_to='shop/', verbose_name='Лого магазина'),
+        ),
+    ]
@@ -1,26 +1,56 @@
 from django.contrib.auth import get_user_model
 from django.core.validators import RegexValidator
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 
 from .consts import (
     EAN_13,
     ENCODING_TYPE,
     FIELD_MASK_WITH_DIGITS,
     MAX_LENGTH_BARCODE_NUMBER,
+    MAX_LENGTH_BLOB_NAME,
     MAX_LENGTH_CARD_NAME,
     MAX_LENGTH_CARD_NUMBER,
     MAX_LENGTH_COLOR,
+    MAX_LENGTH_DEDUP_KEY,
+    MAX_LENGTH_EMAIL_SUBJECT,
     MAX_LENGTH_ENCODING_TYPE,
     MAX_LENGTH_GROUP_NAME,
+    MAX_LENGTH_HTTP_METHOD,
+    MAX_LENGTH_NORMALIZED_SHOP_NAME,
+    MAX_LENGTH_OUTBOX_STATUS,
+    MAX_LENGTH_PROFILE_PATH,
     MAX_LENGTH_SHOP_NAME,
+    OUTBOX_PENDING,
+    OUTBOX_STATUS,
     ErrorMessage,
 )
+from .storage import get_blob_storage
+from .text import search_key
 from .validators import validate_color_format
 
 
 User = get_user_model()
 
 
+class AtomicImageSaveMixin:
+    """Сохранение строки и ссылки на загруженный файл одной транзакцией.
+
+    Хранилище увеличивает счетчик ссылок Blob во время сохранения
+    поля, и при ошибке записи строки он откатывается вместе с ней.
+    Без новой загрузки транзакция не открывается.
+    """
+
+    image_field = None
+
+    def save(self, *args, **kwargs):
+        field_file = getattr(self, self.image_field)
+        if not field_file or field_file._committed:
+            return super().save(*args, **kwargs)
+        with transaction.atomic(using=kwargs.get('using')):
+            return super().save(*args, **kwargs)
+
+
 class Group(models.Model):
     """Класс для представления Категории."""
 
@@ -42,9 +72,11 @@ class Group(models.Model):
         return self.name
 
 
-class Shop(models.Model):
+class Shop(AtomicImageSaveMixin, models.Model):
     """Клас для представления магазинов."""
 
+    image_field = 'logo'
+
     name = models.CharField(
         max_length=MAX_LENGTH_SHOP_NAME,
         verbose_name='Название магазина',
@@ -60,6 +92,7 @@ class Shop(models.Model):
     )
     logo = models.ImageField(
         upload_to='shop/',
+        storage=get_blob_storage,
         verbose_name='Лого магазина',
         null=True,
         blank=True
@@ -75,8 +108,25 @@ class Shop(models.Model):
         blank=True,
         default=False,
     )
+    normalized_name = models.CharField(
+        max_length=MAX_LENGTH_NORMALIZED_SHOP_NAME,
+        verbose_name='Нормализованное название',
+        editable=False,
+        blank=True,
+    )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+        db_index=True,
+    )
 
     class Meta:
+        indexes = (
+            models.Index(
+                fields=('normalized_name', '-validation', 'id'),
+                name='shop_normalized_name_idx',
+            ),
+        )
         ordering = ('name',)
         verbose_name = 'Магазин'
         verbose_name_plural = 'Магазины'
@@ -84,10 +134,19 @@ class Shop(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.normalized_name = search_key(self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'normalized_name'}
+        super().save(*args, **kwargs)
 
-class Card(models.Model):
+
+class Card(AtomicImageSaveMixin, models.Model):
     """Класс для представления Карт."""
 
+    image_field = 'image'
+
     name = models.CharField(
         max_length=MAX_LENGTH_CARD_NAME,
         blank=False,
@@ -110,6 +169,7 @@ class Card(models.Model):
     )
     image = models.ImageField(
         upload_to='card/',
+        storage=get_blob_storage,
         verbose_name='Изображение карты',
         blank=True,
     )
@@ -145,6 +205,11 @@ class Card(models.Model):
         verbose_name='Пользователи',
         blank=False
     )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+        db_index=True,
+    )
 
     class Meta:
         ordering = ('-pub_date',)
@@ -200,6 +265,11 @@ class UserCards(models.Model):
         default=0,
         blank=True
     )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+        db_index=True,
+    )
 
     class Meta:
         constraints = (
@@ -211,9 +281,223 @@ class UserCards(models.Model):
                 name='uniq_favorites'
             ),
         )
+        indexes = (
+            models.Index(
+                fields=('user', '-pub_date', '-id'),
+                name='usercards_wallet_idx',
+            ),
+            models.Index(
+                fields=('user', '-pub_date', '-id'),
+                name='usercards_favorites_idx',
+                condition=models.Q(favourite=True),
+            ),
+        )
         verbose_name = 'Карта пользователя'
         verbose_name_plural = 'Список карт пользователя'
         ordering = ('-pub_date', 'user', 'card')
 
     def __str__(self):
         return f'{self.card} в списке карт пользователя {self.user}'
+
+
+class Tombstone(models.Model):
+    """Отметка об удалении карты из списка пользователя.
+
+    Нужна для синхронизации: клиент узнает об удаленных картах,
+    не запрашивая весь список заново.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        verbose_name='Пользователь',
+    )
+    card_id = models.PositiveBigIntegerField(
+        verbose_name='Id карты',
+    )
+    deleted_at = models.DateTimeField(
+        verbose_name='Дата удаления',
+        auto_now=True,
+        db_index=True,
+    )
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'card_id'),
+                name='uniq_tombstone',
+            ),
+        )
+        ordering = ('-deleted_at',)
+        verbose_name = 'Удаленная карта'
+        verbose_name_plural = 'Удаленные карты'
+
+    def __str__(self):
+        return f'Карта {self.card_id} удалена у пользователя {self.user_id}'
+
+
+class OutboxEmail(models.Model):
+    """Письмо в очереди на отправку."""
+
+    subject = models.CharField(
+        max_length=MAX_LENGTH_EMAIL_SUBJECT,
+        verbose_name='Тема',
+    )
+    body = models.TextField(
+        verbose_name='Текст письма',
+        blank=True,
+    )
+    html = models.TextField(
+        verbose_name='HTML письма',
+        blank=True,
+    )
+    from_email = models.CharField(
+        max_length=MAX_LENGTH_EMAIL_SUBJECT,
+        verbose_name='Отправитель',
+        blank=True,
+    )
+    recipients = models.JSONField(
+        verbose_name='Получатели',
+    )
+    dedup_key = models.CharField(
+        max_length=MAX_LENGTH_DEDUP_KEY,
+        verbose_name='Ключ дедупликации',
+    )
+    status = models.CharField(
+        max_length=MAX_LENGTH_OUTBOX_STATUS,
+        choices=OUTBOX_STATUS,
+        default=OUTBOX_PENDING,
+        verbose_name='Статус',
+    )
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name='Количество попыток',
+        default=0,
+    )
+    next_attempt_at = models.DateTimeField(
+        verbose_name='Следующая попытка',
+        default=timezone.now,
+    )
+    last_error = models.TextField(
+        verbose_name='Последняя ошибка',
+        blank=True,
+    )
+    created_at = models.DateTimeField(
+        verbose_name='Дата создания',
+        auto_now_add=True,
+    )
+    sent_at = models.DateTimeField(
+        verbose_name='Дата отправки',
+        blank=True,
+        null=True,
+    )
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('dedup_key',),
+                condition=models.Q(status=OUTBOX_PENDING),
+                name='uniq_pending_outbox_email',
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('status', 'next_attempt_at'),
+                name='outbox_due_idx',
+            ),
+        )
+        ordering = ('next_attempt_at',)
+        verbose_name = 'Письмо в очереди'
+        verbose_name_plural = 'Очередь писем'
+
+    def __str__(self):
+        return f'{self.subject} -> {", ".join(self.recipients)}'
+
+
+class Blob(models.Model):
+    """Файл в хранилище по хэшу содержимого и число ссылок на него."""
+
+    name = models.CharField(
+        max_length=MAX_LENGTH_BLOB_NAME,
+        verbose_name='Путь',
+        unique=True,
+    )
+    size = models.PositiveBigIntegerField(
+        verbose_name='Размер',
+    )
+    references = models.PositiveIntegerField(
+        verbose_name='Количество ссылок',
+        default=0,
+    )
+    created_at = models.DateTimeField(
+        verbose_name='Дата создания',
+        auto_now_add=True,
+    )
+
+    class Meta:
+        ordering = ('-created_at',)
+        verbose_name = 'Файл'
+        verbose_name_plural = 'Файлы'
+
+    def __str__(self):
+        return f'{self.name} ({self.references})'
+
+
+class RequestProfile(models.Model):
+    """Профиль одного запроса, снятый по заголовку сотрудника.
+
+    Полный профиль cProfile лежит в файле artifact в
+    REQUEST_PROFILE_DIR, здесь - запросы к базе и самые дорогие функции.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='+',
+        verbose_name='Пользователь',
+    )
+    method = models.CharField(
+        max_length=MAX_LENGTH_HTTP_METHOD,
+        verbose_name='Метод',
+    )
+    path = models.CharField(
+        max_length=MAX_LENGTH_PROFILE_PATH,
+        verbose_name='Путь',
+    )
+    status_code = models.PositiveSmallIntegerField(
+        verbose_name='Код ответа',
+    )
+    duration = models.FloatField(
+        verbose_name='Время, мс',
+    )
+    query_count = models.PositiveIntegerField(
+        verbose_name='Запросов к базе',
+    )
+    query_time = models.FloatField(
+        verbose_name='Время запросов к базе, мс',
+    )
+    queries = models.JSONField(
+        verbose_name='Запросы к базе',
+    )
+    top_functions = models.JSONField(
+        verbose_name='Самые дорогие функции',
+    )
+    artifact = models.CharField(
+        max_length=MAX_LENGTH_BLOB_NAME,
+        verbose_name='Файл профиля',
+    )
+    created_at = models.DateTimeField(
+        verbose_name='Дата создания',
+        auto_now_add=True,
+        db_index=True,
+    )
+
+    class Meta:
+        ordering = ('-created_at', '-id')
+        verbose_name = 'Профиль запроса'
+        verbose_name_plural = 'Профили запросов'
+
+    def __str__(self):
+        return f'{self.method} {self.path} ({self.duration:.0f} мс)'
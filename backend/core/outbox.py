@@ -0,0 +1,201 @@
+import hashlib
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .consts import OUTBOX_FAILED, OUTBOX_PENDING, OUTBOX_SENT
+from .models import OutboxEmail
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_dedup_key(recipients, subject, body, html):
+    """Одинаковые письма одинаковым получателям имеют один ключ."""
+
+    payload = json.dumps(
+        (sorted(recipients), subject, body, html), ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def get_html(message):
+    html = getattr(message, 'html', None)
+    if html:
+        return html
+    for content, mimetype in getattr(message, 'alternatives', ()):
+        if mimetype == 'text/html':
+            return content
+    return ''
+
+
+def build_outbox_email(message):
+    """Готовит запись очереди из отрендеренного письма."""
+
+    html = get_html(message)
+    body = message.body if message.body != html else ''
+    recipients = list(message.to)
+    return OutboxEmail(
+        subject=message.subject,
+        body=body,
+        html=html,
+        from_email=message.from_email or '',
+        recipients=recipients,
+        dedup_key=get_dedup_key(recipients, message.subject, body, html),
+    )
+
+
+def enqueue_emails(messages):
+    """Кладет письма в очередь в текущей транзакции.
+
+    Письмо, такое же как уже ожидающее отправки, повторно не ставится.
+    """
+
+    OutboxEmail.objects.bulk_create(
+        [build_outbox_email(message) for message in messages],
+        ignore_conflicts=True,
+    )
+
+
+def build_message(email, connection):
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email or settings.DEFAULT_FROM_EMAIL,
+        to=email.recipients,
+        connection=connection,
+    )
+    if email.html and email.body:
+        message.attach_alternative(email.html, 'text/html')
+    elif email.html:
+        message.body = email.html
+        message.content_subtype = 'html'
+    return message
+
+
+def record_failure(email, error, now):
+    """Записывает неудачную попытку и время следующего повтора."""
+
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OUTBOX_FAILED
+        logger.error('Outbox email %s failed: %s', email.pk, error)
+        return
+    email.next_attempt_at = now + timedelta(
+        seconds=settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1)
+    )
+
+
+def deliver(email, connection, now):
+    """Отправляет письмо и записывает результат или время повтора."""
+
+    try:
+        build_message(email, connection).send()
+    except Exception as error:
+        record_failure(email, error, now)
+        return False
+    email.attempts += 1
+    email.status = OUTBOX_SENT
+    email.sent_at = now
+    email.last_error = ''
+    return True
+
+
+def drop_duplicates(emails, now):
+    """Убирает письма, такие же как уже отправленные недавно."""
+
+    recently_sent = set(
+        OutboxEmail.objects.filter(
+            status=OUTBOX_SENT,
+            dedup_key__in=[email.dedup_key for email in emails],
+            sent_at__gte=now - timedelta(
+                seconds=settings.EMAIL_OUTBOX_DEDUP_WINDOW
+            ),
+        ).values_list('dedup_key', flat=True)
+    )
+    duplicates = [
+        email.pk for email in emails if email.dedup_key in recently_sent
+    ]
+    if duplicates:
+        OutboxEmail.objects.filter(pk__in=duplicates).delete()
+    return [email for email in emails if email.pk not in duplicates]
+
+
+def claim_pending(batch_size, now):
+    """Забирает пачку писем, продлевая их время повтора на аренду.
+
+    Пока аренда не истекла, другие обработчики эти письма не берут.
+    Если обработчик упал, не записав результат, письма снова станут
+    доступны после EMAIL_OUTBOX_LEASE секунд.
+    """
+
+    with transaction.atomic():
+        emails = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OUTBOX_PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'pk')[:batch_size]
+        )
+        if not emails:
+            return 0, []
+        processed = len(emails)
+        emails = drop_duplicates(emails, now)
+        OutboxEmail.objects.filter(
+            pk__in=[email.pk for email in emails]
+        ).update(
+            next_attempt_at=now
+            + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE)
+        )
+    return processed, emails
+
+
+def send_pending(batch_size=None):
+    """Отправляет одну пачку писем через одно соединение.
+
+    Письма забираются и результаты записываются в коротких
+    транзакциях, а сама отправка идет вне транзакции и без блокировок
+    строк. Если соединение не открылось, вся пачка повторяется позже.
+    Возвращает количество обработанных записей очереди.
+    """
+
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    now = timezone.now()
+    processed, emails = claim_pending(batch_size, now)
+    if not emails:
+        return processed
+
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as error:
+        logger.warning('Outbox connection failed: %s', error)
+        for email in emails:
+            record_failure(email, error, now)
+    else:
+        try:
+            for email in emails:
+                deliver(email, connection, now)
+        finally:
+            connection.close()
+
+    with transaction.atomic():
+        OutboxEmail.objects.bulk_update(
+            emails,
+            (
+                'status',
+                'attempts',
+                'next_attempt_at',
+                'last_error',
+                'sent_at',
+            ),
+        )
+    return processed
+
+
+def pending_count():
+    return OutboxEmail.objects.filter(status=OUTBOX_PENDING).count()
@@ -0,0 +1,93 @@
+"""Профили отдельных запросов.
+
+Полный профиль сохраняется файлом pstats в REQUEST_PROFILE_DIR, его
+можно открыть python -m pstats или snakeviz. В базу пишутся запросы с
+временем и самые дорогие по собственному времени функции; хранятся
+последние REQUEST_PROFILE_KEEP профилей.
+"""
+
+import os
+import pstats
+import uuid
+
+from django.conf import settings
+from django.utils import timezone
+
+from .consts import MAX_LENGTH_PROFILE_PATH
+from .models import RequestProfile
+
+
+def function_name(function):
+    """file:line(name) с путем от корня проекта или site-packages."""
+
+    filename, line, name = function
+    base_dir = str(settings.BASE_DIR)
+    if filename.startswith(base_dir):
+        filename = os.path.relpath(filename, base_dir)
+    else:
+        _, _, filename = filename.rpartition('site-packages/')
+    return pstats.func_std_string((filename, line, name))
+
+
+def top_functions(profiler, limit):
+    """Функции с наибольшим собственным временем в формате для JSON."""
+
+    rows = sorted(
+        pstats.Stats(profiler).stats.items(),
+        key=lambda item: item[1][2],
+        reverse=True,
+    )[:limit]
+    return [
+        {
+            'function': function_name(function),
+            'calls': calls,
+            'own_ms': round(own * 1000, 3),
+            'cumulative_ms': round(cumulative * 1000, 3),
+        }
+        for function, (_, calls, own, cumulative, _) in rows
+    ]
+
+
+def artifact_path(name):
+    return os.path.join(settings.REQUEST_PROFILE_DIR, name)
+
+
+def delete_artifact(name):
+    try:
+        os.remove(artifact_path(name))
+    except FileNotFoundError:
+        pass
+
+
+def save_profile(profiler, queries, request, response, user, duration):
+    """Сохраняет файл профиля и запись о нем, удаляет старые профили.
+
+    queries - [(sql, место вызова, секунды)], duration - в секундах.
+    """
+
+    os.makedirs(settings.REQUEST_PROFILE_DIR, exist_ok=True)
+    name = f'{timezone.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}.prof'
+    profiler.dump_stats(artifact_path(name))
+    profile = RequestProfile.objects.create(
+        user=user,
+        method=request.method,
+        path=request.get_full_path()[:MAX_LENGTH_PROFILE_PATH],
+        status_code=response.status_code,
+        duration=round(duration * 1000, 3),
+        query_count=len(queries),
+        query_time=round(sum(seconds for *_, seconds in queries) * 1000, 3),
+        queries=[
+            {'sql': sql, 'site': site, 'ms': round(seconds * 1000, 3)}
+            for sql, site, seconds in queries
+        ],
+        top_functions=top_functions(
+            profiler, settings.REQUEST_PROFILE_TOP_FUNCTIONS
+        ),
+        artifact=name,
+    )
+    RequestProfile.objects.filter(
+        pk__in=RequestProfile.objects.values('pk')[
+            settings.REQUEST_PROFILE_KEEP:
+        ]
+    ).delete()
+    return profile
@@ -0,0 +1,375 @@
+"""Кодирование QR-кода в байтовом режиме с уровнем коррекции M.
+
+Поддерживаются версии 1-13 (до 331 байта данных), этого хватает
+для номеров штрих-кодов карт.
+"""
+
+from .consts import ErrorMessage
+
+
+class QRCodeError(ValueError):
+    """Данные не помещаются в поддерживаемые версии QR-кода."""
+
+
+# Версия: (кодовых слов коррекции на блок,
+#          ((количество блоков, кодовых слов данных в блоке), ...)).
+EC_BLOCKS_M = {
+    1: (10, ((1, 16),)),
+    2: (16, ((1, 28),)),
+    3: (26, ((1, 44),)),
+    4: (18, ((2, 32),)),
+    5: (24, ((2, 43),)),
+    6: (16, ((4, 27),)),
+    7: (18, ((4, 31),)),
+    8: (22, ((2, 38), (2, 39))),
+    9: (22, ((3, 36), (2, 37))),
+    10: (26, ((4, 43), (1, 44))),
+    11: (30, ((1, 50), (4, 51))),
+    12: (22, ((6, 36), (2, 37))),
+    13: (22, ((8, 37), (1, 38))),
+}
+ALIGNMENT_POSITIONS = {
+    1: (),
+    2: (6, 18),
+    3: (6, 22),
+    4: (6, 26),
+    5: (6, 30),
+    6: (6, 34),
+    7: (6, 22, 38),
+    8: (6, 24, 42),
+    9: (6, 26, 46),
+    10: (6, 28, 50),
+    11: (6, 30, 54),
+    12: (6, 32, 58),
+    13: (6, 34, 62),
+}
+MODE_BYTE = 0b0100
+EC_LEVEL_M = 0b00
+FORMAT_GENERATOR = 0x537
+FORMAT_MASK = 0x5412
+VERSION_GENERATOR = 0x1F25
+PAD_BYTES = (0xEC, 0x11)
+
+MASKS = (
+    lambda x, y: (x + y) % 2 == 0,
+    lambda x, y: y % 2 == 0,
+    lambda x, y: x % 3 == 0,
+    lambda x, y: (x + y) % 3 == 0,
+    lambda x, y: (x // 3 + y // 2) % 2 == 0,
+    lambda x, y: x * y % 2 + x * y % 3 == 0,
+    lambda x, y: (x * y % 2 + x * y % 3) % 2 == 0,
+    lambda x, y: ((x + y) % 2 + x * y % 3) % 2 == 0,
+)
+FINDER_LIKE = (
+    (True, False, True, True, True, False, True, False, False, False, False),
+    (False, False, False, False, True, False, True, True, True, False, True),
+)
+
+
+def _gf_tables():
+    exp = [0] * 512
+    log = [0] * 256
+    value = 1
+    for power in range(255):
+        exp[power] = value
+        log[value] = power
+        value <<= 1
+        if value & 0x100:
+            value ^= 0x11D
+    for power in range(255, 512):
+        exp[power] = exp[power - 255]
+    return exp, log
+
+
+GF_EXP, GF_LOG = _gf_tables()
+
+
+def gf_multiply(first, second):
+    if first == 0 or second == 0:
+        return 0
+    return GF_EXP[GF_LOG[first] + GF_LOG[second]]
+
+
+def rs_generator(degree):
+    """Порождающий многочлен Рида-Соломона, старший коэффициент первый."""
+
+    generator = [1]
+    for power in range(degree):
+        generator = [
+            coefficient ^ gf_multiply(previous, GF_EXP[power])
+            for coefficient, previous in zip(
+                generator + [0], [0] + generator
+            )
+        ]
+    return generator
+
+
+def rs_remainder(data, degree):
+    """Кодовые слова коррекции ошибок для блока данных."""
+
+    generator = rs_generator(degree)
+    remainder = [0] * degree
+    for byte in data:
+        factor = byte ^ remainder.pop(0)
+        remainder.append(0)
+        for index in range(degree):
+            remainder[index] ^= gf_multiply(generator[index + 1], factor)
+    return remainder
+
+
+def size_of(version):
+    return version * 4 + 17
+
+
+def data_capacity(version):
+    _, blocks = EC_BLOCKS_M[version]
+    return sum(count * length for count, length in blocks)
+
+
+def count_bits(version):
+    return 8 if version < 10 else 16
+
+
+def choose_version(data):
+    for version in EC_BLOCKS_M:
+        needed = 4 + count_bits(version) + len(data) * 8
+        if needed <= data_capacity(version) * 8:
+            return version
+    raise QRCodeError(ErrorMessage.BARCODE_TOO_LONG)
+
+
+def encode_data(data, version):
+    """Биты режима, длины и данных, дополненные до емкости версии."""
+
+    bits = []
+
+    def append(value, length):
+        bits.extend(
+            (value >> shift) & 1 for shift in range(length - 1, -1, -1)
+        )
+
+    append(MODE_BYTE, 4)
+    append(len(data), count_bits(version))
+    for byte in data:
+        append(byte, 8)
+    capacity = data_capacity(version) * 8
+    append(0, min(4, capacity - len(bits)))
+    append(0, -len(bits) % 8)
+    codewords = [
+        int(''.join(map(str, bits[start:start + 8])), 2)
+        for start in range(0, len(bits), 8)
+    ]
+    pad = 0
+    while len(codewords) < capacity // 8:
+        codewords.append(PAD_BYTES[pad % 2])
+        pad += 1
+    return codewords
+
+
+def add_error_correction(codewords, version):
+    """Делит данные на блоки, добавляет коррекцию и перемежает."""
+
+    degree, groups = EC_BLOCKS_M[version]
+    blocks = []
+    position = 0
+    for count, length in groups:
+        for _ in range(count):
+            blocks.append(codewords[position:position + length])
+            position += length
+    ec_blocks = [rs_remainder(block, degree) for block in blocks]
+
+    result = []
+    for index in range(max(len(block) for block in blocks)):
+        result.extend(block[index] for block in blocks if index < len(block))
+    for index in range(degree):
+        result.extend(block[index] for block in ec_blocks)
+    return result
+
+
+class QRMatrix:
+    """Матрица модулей QR-кода и признаки служебных модулей."""
+
+    def __init__(self, version):
+        self.version = version
+        self.size = size_of(version)
+        self.modules = [[False] * self.size for _ in range(self.size)]
+        self.function = [[False] * self.size for _ in range(self.size)]
+        self.draw_function_patterns()
+
+    def set_function(self, x, y, dark):
+        self.modules[y][x] = dark
+        self.function[y][x] = True
+
+    def draw_function_patterns(self):
+        size = self.size
+        for index in range(size):
+            self.set_function(6, index, index % 2 == 0)
+            self.set_function(index, 6, index % 2 == 0)
+        for x, y in ((3, 3), (size - 4, 3), (3, size - 4)):
+            self.draw_finder(x, y)
+        positions = ALIGNMENT_POSITIONS[self.version]
+        last = len(positions) - 1
+        for i, x in enumerate(positions):
+            for j, y in enumerate(positions):
+                if (i, j) not in ((0, 0), (0, last), (last, 0)):
+                    self.draw_alignment(x, y)
+        self.draw_format(0)
+        self.draw_version()
+
+    def draw_finder(self, x, y):
+        for dy in range(-4, 5):
+            for dx in range(-4, 5):
+                xx, yy = x + dx, y + dy
+                if 0 <= xx < self.size and 0 <= yy < self.size:
+                    distance = max(abs(dx), abs(dy))
+                    self.set_function(xx, yy, distance not in (2, 4))
+
+    def draw_alignment(self, x, y):
+        for dy in range(-2, 3):
+            for dx in range(-2, 3):
+                self.set_function(
+                    x + dx, y + dy, max(abs(dx), abs(dy)) != 1
+                )
+
+    def draw_format(self, mask):
+        data = EC_LEVEL_M << 3 | mask
+        remainder = data
+        for _ in range(10):
+            remainder = (
+                (remainder << 1) ^ ((remainder >> 9) * FORMAT_GENERATOR)
+            )
+        bits = (data << 10 | remainder) ^ FORMAT_MASK
+        size = self.size
+
+        def bit(index):
+            return (bits >> index) & 1 == 1
+
+        for index in range(6):
+            self.set_function(8, index, bit(index))
+        self.set_function(8, 7, bit(6))
+        self.set_function(8, 8, bit(7))
+        self.set_function(7, 8, bit(8))
+        for index in range(9, 15):
+            self.set_function(14 - index, 8, bit(index))
+        for index in range(8):
+            self.set_function(size - 1 - index, 8, bit(index))
+        for index in range(8, 15):
+            self.set_function(8, size - 15 + index, bit(index))
+        self.set_function(8, size - 8, True)
+
+    def draw_version(self):
+        if self.version < 7:
+            return
+        remainder = self.version
+        for _ in range(12):
+            remainder = (
+                (remainder << 1) ^ ((remainder >> 11) * VERSION_GENERATOR)
+            )
+        bits = self.version << 12 | remainder
+        for index in range(18):
+            dark = (bits >> index) & 1 == 1
+            a = self.size - 11 + index % 3
+            b = index // 3
+            self.set_function(a, b, dark)
+            self.set_function(b, a, dark)
+
+    def draw_codewords(self, codewords):
+        size = self.size
+        bits = len(codewords) * 8
+        index = 0
+        right = size - 1
+        while right >= 1:
+            if right == 6:
+                right = 5
+            upward = (right + 1) & 2 == 0
+            for vertical in range(size):
+                y = size - 1 - vertical if upward else vertical
+                for x in (right, right - 1):
+                    if not self.function[y][x] and index < bits:
+                        byte = codewords[index >> 3]
+                        shift = 7 - (index & 7)
+                        self.modules[y][x] = (byte >> shift) & 1 == 1
+                        index += 1
+            right -= 2
+
+    def apply_mask(self, mask):
+        condition = MASKS[mask]
+        for y in range(self.size):
+            row = self.modules[y]
+            function = self.function[y]
+            for x in range(self.size):
+                if not function[x] and condition(x, y):
+                    row[x] = not row[x]
+
+    def penalty(self):
+        """Штраф маски по правилам стандарта: чем меньше, тем лучше."""
+
+        modules = self.modules
+        lines = (*modules, *(list(column) for column in zip(*modules)))
+        return (
+            sum(line_penalty(line) for line in lines)
+            + block_penalty(modules)
+            + balance_penalty(modules)
+        )
+
+
+def line_penalty(line):
+    """Штраф за ряды одного цвета и узоры, похожие на поисковые."""
+
+    score = 0
+    run = 1
+    for index in range(1, len(line) + 1):
+        if index < len(line) and line[index] == line[index - 1]:
+            run += 1
+            continue
+        if run >= 5:
+            score += run - 2
+        run = 1
+    padded = (False,) * 4 + tuple(line) + (False,) * 4
+    for start in range(len(padded) - 10):
+        if padded[start:start + 11] in FINDER_LIKE:
+            score += 40
+    return score
+
+
+def block_penalty(modules):
+    """Штраф за квадраты 2x2 одного цвета."""
+
+    score = 0
+    for upper, lower in zip(modules, modules[1:]):
+        for x in range(len(upper) - 1):
+            if upper[x] == upper[x + 1] == lower[x] == lower[x + 1]:
+                score += 3
+    return score
+
+
+def balance_penalty(modules):
+    """Штраф за отклонение доли темных модулей от половины."""
+
+    total = len(modules) ** 2
+    dark = sum(map(sum, modules))
+    return ((abs(dark * 20 - total * 10) + total - 1) // total - 1) * 10
+
+
+def encode_qr(data, mask=None):
+    """Матрица модулей QR-кода (True - темный) для байтов data.
+
+    Без mask выбирается маска с наименьшим штрафом.
+    """
+
+    if isinstance(data, str):
+        data = data.encode()
+    version = choose_version(data)
+    codewords = add_error_correction(encode_data(data, version), version)
+
+    best = None
+    masks = range(len(MASKS)) if mask is None else (mask,)
+    for mask in masks:
+        matrix = QRMatrix(version)
+        matrix.draw_codewords(codewords)
+        matrix.apply_mask(mask)
+        matrix.draw_format(mask)
+        penalty = matrix.penalty() if len(masks) > 1 else 0
+        if best is None or penalty < best[0]:
+            best = (penalty, matrix)
+    return best[1].modules
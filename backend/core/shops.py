@@ -0,0 +1,170 @@
+import threading
+from bisect import bisect_left
+from difflib import get_close_matches
+
+from .cache import get_catalog_version
+from .consts import SHOP_SUGGEST_PREFIX
+from .models import Shop, UserCards
+from .text import search_key, word_suffixes
+
+
+# Больше изменений за раз дешевле применить пересборкой списка.
+MAX_INCREMENTAL_CHANGES = 64
+
+
+class ShopIndex:
+    """Префиксный индекс названий проверенных магазинов в памяти процесса.
+
+    Хранит отсортированный список пар (ключ, id магазина) по каждому
+    слову названия; ключи приведены к латинице без учета регистра,
+    поэтому «пят», «Pyat» и «ПЯТ» находят «Пятёрочку». Поиск - бинарный
+    поиск по списку без обращений к базе. При смене версии каталога
+    из базы читаются только магазины с новым updated_at.
+
+    Для подсказок с опечатками хранятся и ключи полных названий в
+    отсортированном виде.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.shops = {}
+        self.entries = []
+        self.names = {}
+        self.sorted_names = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def shop_entries(shop_id, name):
+        return [(key, shop_id) for key in word_suffixes(search_key(name))]
+
+    def ensure_fresh(self):
+        version = get_catalog_version()
+        if version != self.version:
+            with self._lock:
+                if version != self.version:
+                    self.refresh()
+                    self.version = version
+
+    def refresh(self):
+        """Применяет к индексу изменения проверенных магазинов."""
+
+        current = dict(
+            Shop.objects.filter(validation=True)
+            .values_list('id', 'updated_at')
+        )
+        removed = [
+            shop_id for shop_id, (updated_at, _) in self.shops.items()
+            if current.get(shop_id) != updated_at
+        ]
+        changed = [
+            shop_id for shop_id, updated_at in current.items()
+            if shop_id not in self.shops
+            or self.shops[shop_id][0] != updated_at
+        ]
+        if not removed and not changed:
+            return
+
+        shops = dict(self.shops)
+        for shop_id in removed:
+            del shops[shop_id]
+        added = {}
+        for shop_id, name, updated_at in Shop.objects.filter(
+            pk__in=changed
+        ).values_list('id', 'name', 'updated_at'):
+            added[shop_id] = (updated_at, self.shop_entries(shop_id, name))
+        shops.update(added)
+
+        if len(removed) + len(added) > MAX_INCREMENTAL_CHANGES:
+            entries = sorted(
+                entry for _, shop_entries in shops.values()
+                for entry in shop_entries
+            )
+        else:
+            entries = list(self.entries)
+            for shop_id in removed:
+                for entry in self.shops[shop_id][1]:
+                    del entries[bisect_left(entries, entry)]
+            for _, shop_entries in added.values():
+                for entry in shop_entries:
+                    entries.insert(bisect_left(entries, entry), entry)
+        self.shops, self.entries = shops, entries
+        self.names = {
+            shop_entries[0][0]: shop_id
+            for shop_id, (_, shop_entries) in sorted(
+                shops.items(), reverse=True
+            )
+            if shop_entries
+        }
+        self.sorted_names = sorted(self.names)
+
+    def search(self, query, limit):
+        """Id магазинов, слово в названии которых начинается с query."""
+
+        prefix = search_key(query)
+        if not prefix:
+            return []
+        entries = self.entries
+        found = {}
+        position = bisect_left(entries, (prefix,))
+        while position < len(entries) and len(found) < limit:
+            key, shop_id = entries[position]
+            if not key.startswith(prefix):
+                break
+            found.setdefault(shop_id, None)
+            position += 1
+        return list(found)
+
+    def similar(self, query, limit, cutoff):
+        """Id магазинов с похожими названиями, начиная с самого похожего.
+
+        Сравниваются только названия с теми же первыми
+        SHOP_SUGGEST_PREFIX символами ключа: опечатка в начале названия
+        не находится, зато не перебираются все магазины.
+        """
+
+        key = search_key(query)
+        if not key:
+            return []
+        names, sorted_names = self.names, self.sorted_names
+        prefix = key[:SHOP_SUGGEST_PREFIX]
+        start = bisect_left(sorted_names, prefix)
+        end = bisect_left(sorted_names, prefix + '\uffff', start)
+        return [
+            names[match]
+            for match in get_close_matches(
+                key, sorted_names[start:end], limit, cutoff
+            )
+        ]
+
+
+shop_index = ShopIndex()
+
+
+def match_shop(name):
+    """Существующий магазин для названия, введенного пользователем.
+
+    Подходит только магазин с тем же нормализованным названием,
+    проверенный в первую очередь. Похожие названия не подставляются
+    автоматически: «Shop 10» и «Shop 11» - разные магазины. Их
+    предлагают подсказки (ShopIndex.similar).
+    """
+
+    return (
+        Shop.objects.filter(normalized_name=search_key(name))
+        .order_by('-validation', 'id')
+        .first()
+    )
+
+
+def is_shop_creator(shop, user):
+    """Пользователь - единственный владелец карт этого магазина.
+
+    Автор магазина не хранится, поэтому автором считается владелец
+    всех его карт. Только он может менять непроверенный магазин.
+    """
+
+    owners = set(
+        UserCards.objects.filter(card__shop=shop, owner=True)
+        .values_list('user_id', flat=True)
+    )
+    return owners == {user.pk}
@@ -0,0 +1,215 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from .cache import bump_catalog_version, bump_wallet_versions
+from .images import has_thumbnails, release_image, schedule_thumbnails
+from .models import Card, Group, RequestProfile, Shop, Tombstone, UserCards
+from .profiling import delete_artifact
+
+
+User = get_user_model()
+
+SHARED_BY_FIELDS = frozenset(('name', 'email'))
+IMAGE_FIELDS = {Card: 'image', Shop: 'logo'}
+
+catalog_changed = Signal()
+
+
+def invalidate_wallets(user_ids):
+    """Сбрасывает кэш списков карт сразу и повторно после коммита.
+
+    Повторный сброс закрывает гонку, когда параллельный запрос успел
+    закэшировать данные до фиксации транзакции.
+    """
+
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    bump_wallet_versions(user_ids)
+    transaction.on_commit(lambda: bump_wallet_versions(user_ids))
+
+
+def commit_catalog_change():
+    bump_catalog_version()
+    catalog_changed.send(sender=Shop)
+
+
+def invalidate_catalog():
+    bump_catalog_version()
+    transaction.on_commit(commit_catalog_change)
+
+
+def touch_shops(shop_ids):
+    """Отмечает магазины измененными, если поменялись их категории."""
+
+    Shop.objects.filter(pk__in=shop_ids).update(updated_at=timezone.now())
+
+
+def wallet_users_of_shops(shop_ids):
+    return (
+        UserCards.objects.filter(card__shop_id__in=shop_ids)
+        .values_list('user_id', flat=True)
+        .distinct()
+    )
+
+
+@receiver(post_save, sender=UserCards)
+@receiver(post_delete, sender=UserCards)
+def user_card_changed(sender, instance, **kwargs):
+    invalidate_wallets((instance.user_id,))
+
+
+def save_tombstones(card_id, user_ids):
+    """Отмечает удаление карты у пользователей одним запросом."""
+
+    Tombstone.objects.bulk_create(
+        [Tombstone(user_id=user_id, card_id=card_id) for user_id in user_ids],
+        update_conflicts=True,
+        unique_fields=('user_id', 'card_id'),
+        update_fields=('deleted_at',),
+    )
+
+
+@receiver(post_delete, sender=UserCards)
+def user_card_deleted(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Card):
+        return
+    save_tombstones(instance.card_id, (instance.user_id,))
+
+
+@receiver(pre_delete, sender=Card)
+def card_deleting(sender, instance, **kwargs):
+    """Отметки об удалении для всех списков с картой сразу.
+
+    Строки UserCards удаляются каскадом следом, их обработчик
+    отметки уже не создает.
+    """
+
+    save_tombstones(
+        instance.pk,
+        UserCards.objects.filter(card_id=instance.pk)
+        .values_list('user_id', flat=True),
+    )
+
+
+@receiver(post_save, sender=Card)
+@receiver(post_delete, sender=Card)
+def card_changed(sender, instance, **kwargs):
+    invalidate_wallets(
+        UserCards.objects.filter(card_id=instance.pk)
+        .values_list('user_id', flat=True)
+    )
+
+
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+def shop_changed(sender, instance, **kwargs):
+    invalidate_catalog()
+    invalidate_wallets(wallet_users_of_shops((instance.pk,)))
+
+
+def release_image_on_commit(name):
+    if name:
+        transaction.on_commit(lambda: release_image(name))
+
+
+@receiver(pre_save, sender=Card)
+@receiver(pre_save, sender=Shop)
+def remember_image(sender, instance, update_fields, **kwargs):
+    """Запоминает прежнее изображение, чтобы снять с него ссылку.
+
+    Новая загрузка еще не сохранена в хранилище (_committed ложно):
+    хранилище добавит ссылку, даже если содержимое и имя не изменились.
+    """
+
+    field = IMAGE_FIELDS[sender]
+    field_file = getattr(instance, field)
+    instance._image_uploaded = bool(field_file) and not field_file._committed
+    instance._previous_image = None
+    if instance.pk is None or (
+            update_fields is not None and field not in update_fields
+    ):
+        return
+    instance._previous_image = (
+        sender.objects.filter(pk=instance.pk)
+        .values_list(field, flat=True)
+        .first()
+    )
+
+
+@receiver(post_save, sender=Card)
+@receiver(post_save, sender=Shop)
+def image_saved(sender, instance, **kwargs):
+    """После коммита строит копии нового изображения в фоне.
+
+    Ссылка на замененное изображение снимается после коммита. После
+    загрузки она снимается и при том же имени: повторная загрузка того
+    же содержимого уже добавила к файлу вторую ссылку.
+    """
+
+    field_file = getattr(instance, IMAGE_FIELDS[sender])
+    name = field_file.name if field_file else None
+    if instance._image_uploaded or instance._previous_image != name:
+        release_image_on_commit(instance._previous_image)
+    if not name or has_thumbnails(name):
+        return
+    transaction.on_commit(lambda: schedule_thumbnails(name))
+
+
+@receiver(post_delete, sender=Card)
+@receiver(post_delete, sender=Shop)
+def image_deleted(sender, instance, **kwargs):
+    release_image_on_commit(getattr(instance, IMAGE_FIELDS[sender]).name)
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    shop_ids = Shop.group.through.objects.filter(
+        group_id=instance.pk
+    ).values('shop_id')
+    invalidate_catalog()
+    touch_shops(shop_ids)
+    invalidate_wallets(wallet_users_of_shops(shop_ids))
+
+
+@receiver(m2m_changed, sender=Shop.group.through)
+def shop_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        shop_ids = (instance.pk,)
+    elif pk_set is not None:
+        shop_ids = pk_set
+    else:
+        shop_ids = list(
+            instance.shop_set.values_list('pk', flat=True)
+        )
+    invalidate_catalog()
+    touch_shops(shop_ids)
+    invalidate_wallets(wallet_users_of_shops(shop_ids))
+
+
+@receiver(post_save, sender=User)
+def shared_by_user_changed(sender, instance, update_fields, **kwargs):
+    if update_fields is not None and not (
+            SHARED_BY_FIELDS & set(update_fields)
+    ):
+        return
+    shared = UserCards.objects.filter(shared_by=instance)
+    shared.update(updated_at=timezone.now())
+    invalidate_wallets(shared.values_list('user_id', flat=True))
+
+
+@receiver(post_delete, sender=RequestProfile)
+def request_profile_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: delete_artifact(instance.artifact))
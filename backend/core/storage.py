@@ -0,0 +1,109 @@
+"""Хранилище загрузок по хэшу содержимого.
+
+Одинаковые файлы хранятся один раз под именем из sha256 содержимого,
+поэтому адрес файла не меняется никогда и его можно кэшировать
+бессрочно. Число ссылок на файл ведется в модели Blob: файл удаляется
+вместе с последней ссылкой.
+"""
+
+import hashlib
+import os
+import tempfile
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+
+BLOB_DIR = 'blobs'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Файловое хранилище с дедупликацией и подсчетом ссылок."""
+
+    @staticmethod
+    def blob_model():
+        return apps.get_model('core', 'Blob')
+
+    def get_available_name(self, name, max_length=None):
+        """Имя определяется содержимым, поэтому суффиксы не нужны."""
+
+        return name
+
+    def _save(self, name, content):
+        """Пишет загрузку во временный файл, по пути считая хэш.
+
+        Файл переносится на место, только если такого содержимого
+        еще нет, и в любом случае получает новую ссылку.
+        """
+
+        directory = os.path.join(self.location, BLOB_DIR)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(dir=directory)
+        try:
+            digest = hashlib.sha256()
+            size = 0
+            with os.fdopen(descriptor, 'wb') as temp_file:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+                    size += len(chunk)
+            blob_name = self.blob_name(digest.hexdigest(), name)
+            with transaction.atomic():
+                self.add_reference(blob_name, size)
+                path = self.path(blob_name)
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(temp_path, path)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(path, self.file_permissions_mode)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return blob_name
+
+    @staticmethod
+    def blob_name(hexdigest, name):
+        _, extension = os.path.splitext(name)
+        return (
+            f'{BLOB_DIR}/{hexdigest[:2]}/{hexdigest}{extension.lower()}'
+        )
+
+    def add_reference(self, name, size, count=1):
+        blobs = self.blob_model().objects.filter(name=name)
+        if blobs.update(references=F('references') + count):
+            return
+        try:
+            with transaction.atomic():
+                self.blob_model().objects.create(
+                    name=name, size=size, references=count
+                )
+        except IntegrityError:
+            blobs.update(references=F('references') + count)
+
+    def delete(self, name):
+        """Снимает ссылку на файл, с последней ссылкой удаляет файл.
+
+        Файлы, сохраненные до перехода на это хранилище, не учтены
+        в Blob и не удаляются.
+        """
+
+        Blob = self.blob_model()
+        with transaction.atomic():
+            Blob.objects.filter(name=name, references__gt=0).update(
+                references=F('references') - 1
+            )
+            deleted, _ = Blob.objects.filter(name=name, references=0).delete()
+            if deleted:
+                super().delete(name)
+        return bool(deleted)
+
+
+blob_storage = ContentAddressedStorage()
+
+
+def get_blob_storage():
+    return blob_storage
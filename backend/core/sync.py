@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Tombstone, UserCards
+
+
+SYNC_TOKEN_SALT = 'core.sync'
+
+
+def make_sync_token(moment):
+    """Непрозрачный подписанный токен с моментом синхронизации."""
+
+    return signing.dumps(
+        int(moment.timestamp() * 1_000_000), salt=SYNC_TOKEN_SALT
+    )
+
+
+def parse_sync_token(token):
+    """Момент синхронизации из токена.
+
+    Для подделанного или испорченного токена бросает signing.BadSignature.
+    """
+
+    micros = signing.loads(token, salt=SYNC_TOKEN_SALT)
+    if not isinstance(micros, int):
+        raise signing.BadSignature('Malformed sync token')
+    return datetime.fromtimestamp(micros / 1_000_000, tz=dt_timezone.utc)
+
+
+def wallet_queryset(user):
+    return (
+        UserCards.objects.filter(user=user)
+        .select_related('card', 'card__shop', 'shared_by')
+        .prefetch_related('card__shop__group')
+    )
+
+
+def wallet_changes(user, since):
+    """Изменения списка карт пользователя после момента since.
+
+    Возвращает (полная выдача, записи UserCards, id удаленных карт).
+    Если since нет или он старше срока хранения отметок об удалении,
+    отдается весь список. Окно WALLET_SYNC_OVERLAP покрывает
+    транзакции, изменившие строки до выдачи токена, но
+    зафиксированные после нее; повторно присланные записи клиент
+    просто перезаписывает.
+    """
+
+    now = timezone.now()
+    if since is None or since < now - timedelta(
+            seconds=settings.WALLET_SYNC_TOMBSTONE_TTL
+    ):
+        return True, wallet_queryset(user), ()
+
+    since -= timedelta(seconds=settings.WALLET_SYNC_OVERLAP)
+    changed = wallet_queryset(user).filter(
+        Q(updated_at__gt=since)
+        | Q(card__updated_at__gt=since)
+        | Q(card__shop__updated_at__gt=since)
+    )
+    deleted = (
+        Tombstone.objects.filter(user=user, deleted_at__gt=since)
+        .exclude(
+            card_id__in=UserCards.objects.filter(user=user).values('card_id')
+        )
+        .values_list('card_id', flat=True)
+    )
+    return False, changed, deleted
+
+
+def purge_tombstones():
+    """Удаляет отметки старше срока, после которого нужна полная выдача."""
+
+    deleted, _ = Tombstone.objects.filter(
+        deleted_at__lt=timezone.now() - timedelta(
+            seconds=settings.WALLET_SYNC_TOMBSTONE_TTL
+        )
+    ).delete()
+    return deleted
@@ -0,0 +1,41 @@
+import re
+
+
+CYRILLIC_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l',
+    'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's',
+    'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch',
+    'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e',
+    'ю': 'yu', 'я': 'ya',
+}
+NON_WORD = re.compile(r'[\W_]+')
+
+
+def fold(text):
+    """Приводит строку к виду для сравнения.
+
+    Регистр, ё/е, знаки препинания и лишние пробелы не учитываются.
+    """
+
+    text = str(text).casefold().replace('ё', 'е')
+    return ' '.join(NON_WORD.sub(' ', text).split())
+
+
+def transliterate(text):
+    """Переводит кириллицу в латиницу, остальные символы не меняет."""
+
+    return ''.join(CYRILLIC_TO_LATIN.get(char, char) for char in text)
+
+
+def search_key(text):
+    """Ключ поиска: одинаков для «Пятёрочка» и «pyaterochka»."""
+
+    return transliterate(fold(text))
+
+
+def word_suffixes(key):
+    """Хвосты ключа с начала каждого слова: 'a b c', 'b c', 'c'."""
+
+    words = key.split(' ')
+    return tuple(' '.join(words[start:]) for start in range(len(words)))
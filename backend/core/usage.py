@@ -0,0 +1,303 @@
+import atexit
+import fcntl
+import glob
+import logging
+import os
+import threading
+import time
+import uuid
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Case, F, PositiveBigIntegerField, Q, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import UserCards
+from .signals import invalidate_wallets
+
+
+logger = logging.getLogger(__name__)
+
+USAGE_UPDATED = 'updated'
+USAGE_STALE = 'stale'
+USAGE_NOT_FOUND = 'not_found'
+
+WRITE_CHUNK_SIZE = 500
+
+
+def write_usage_counters(counters):
+    """Записывает счётчики {(id пользователя, id карты): значение}.
+
+    Обновление идет пачками одним UPDATE на пачку через
+    GREATEST(usage_counter, CASE ...), поэтому счётчик не уменьшается,
+    а повторная запись тех же значений ничего не меняет.
+    """
+
+    items = list(counters.items())
+    for start in range(0, len(items), WRITE_CHUNK_SIZE):
+        chunk = items[start:start + WRITE_CHUNK_SIZE]
+        UserCards.objects.filter(
+            reduce(
+                or_,
+                (
+                    Q(user_id=user_id, card_id=card_id)
+                    for (user_id, card_id), _ in chunk
+                ),
+            )
+        ).update(
+            updated_at=timezone.now(),
+            usage_counter=Greatest(
+                F('usage_counter'),
+                Case(
+                    *(
+                        When(user_id=user_id, card_id=card_id, then=value)
+                        for (user_id, card_id), value in chunk
+                    ),
+                    default=F('usage_counter'),
+                    output_field=PositiveBigIntegerField(),
+                ),
+            )
+        )
+    invalidate_wallets({user_id for user_id, _ in counters})
+
+
+def store_usage_counters(user_id, counters):
+    counters = {
+        (user_id, card_id): value for card_id, value in counters.items()
+    }
+    if settings.USAGE_BUFFER_ENABLED:
+        usage_buffer.record_many(counters)
+    else:
+        write_usage_counters(counters)
+
+
+def merge_buffered(user_id, current):
+    """Дополняет {id карты: значение из базы} значениями из буфера.
+
+    Несброшенные значения новее базы: flush запишет их через
+    GREATEST, и проверка нового значения должна с этим совпадать.
+    """
+
+    if settings.USAGE_BUFFER_ENABLED:
+        for card_id, value in usage_buffer.buffered(user_id, current):
+            current[card_id] = max(current[card_id], value)
+    return current
+
+
+def apply_usage_counters(user_id, counters):
+    """Обновляет счётчики использования карт пользователя.
+
+    counters - словарь {id карты: новое значение счётчика}. Счётчик
+    только растет: меньшие и равные значения игнорируются. Возвращает
+    словарь {id карты: (статус, итоговое значение счётчика)}.
+    """
+
+    current = dict(
+        UserCards.objects.filter(user_id=user_id, card_id__in=counters)
+        .values_list('card_id', 'usage_counter')
+    )
+    merge_buffered(user_id, current)
+    to_update = {
+        card_id: value
+        for card_id, value in counters.items()
+        if card_id in current and value > current[card_id]
+    }
+    if to_update:
+        store_usage_counters(user_id, to_update)
+
+    results = {}
+    for card_id, value in counters.items():
+        if card_id not in current:
+            results[card_id] = (USAGE_NOT_FOUND, None)
+        elif card_id in to_update:
+            results[card_id] = (USAGE_UPDATED, value)
+        else:
+            results[card_id] = (USAGE_STALE, current[card_id])
+    return results
+
+
+def read_journal(path):
+    counters = {}
+    with open(path, encoding='utf-8') as journal:
+        for line in journal:
+            try:
+                user_id, card_id, value = map(int, line.split())
+            except ValueError:
+                continue
+            key = (user_id, card_id)
+            counters[key] = max(counters.get(key, 0), value)
+    return counters
+
+
+def same_file(file, path):
+    """Открытый файл все еще лежит по пути path."""
+
+    try:
+        return os.stat(path).st_ino == os.fstat(file.fileno()).st_ino
+    except FileNotFoundError:
+        return False
+
+
+class UsageBuffer:
+    """Отложенная запись счётчиков использования карт.
+
+    Значения копятся в памяти процесса и сбрасываются в базу пачкой
+    раз в USAGE_BUFFER_FLUSH_INTERVAL секунд или после
+    USAGE_BUFFER_FLUSH_EVENTS событий. Каждое событие дописывается
+    в журнал процесса, заблокированный через flock: журналы упавших
+    процессов блокировка не держит, и их дочитывает recover().
+    Счётчики абсолютные и сливаются по максимуму, поэтому повторное
+    применение журнала безопасно.
+    """
+
+    def __init__(self, journal_dir=None):
+        self.journal_dir = journal_dir or settings.USAGE_BUFFER_JOURNAL_DIR
+        self.pending = {}
+        # Значения, которые flush сейчас записывает в базу.
+        self.flushing = {}
+        self.events = 0
+        self.last_flush = time.monotonic()
+        self._lock = threading.RLock()
+        self._journal = None
+        self._timer = None
+        self._closed = False
+
+    def _journal_path(self, suffix='journal'):
+        return os.path.join(
+            self.journal_dir,
+            f'usage-{os.getpid()}-{uuid.uuid4().hex}.{suffix}',
+        )
+
+    def _open_journal(self):
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self._journal = open(self._journal_path(), 'a', encoding='utf-8')
+        fcntl.flock(self._journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _start(self):
+        self.recover()
+        self._open_journal()
+        self._timer = threading.Thread(
+            target=self._run_timer, name='usage-buffer', daemon=True
+        )
+        self._timer.start()
+        atexit.register(self.close)
+
+    def _run_timer(self):
+        while not self._closed:
+            time.sleep(settings.USAGE_BUFFER_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Usage buffer flush failed')
+            finally:
+                connections.close_all()
+
+    def record_many(self, counters):
+        """Запоминает новые значения счётчиков {(пользователь, карта): n}."""
+
+        with self._lock:
+            if self._journal is None:
+                self._start()
+            self._journal.writelines(
+                f'{user_id} {card_id} {value}\n'
+                for (user_id, card_id), value in counters.items()
+            )
+            self._journal.flush()
+            for key, value in counters.items():
+                self.pending[key] = max(self.pending.get(key, 0), value)
+            self.events += len(counters)
+            if (
+                self.events >= settings.USAGE_BUFFER_FLUSH_EVENTS
+                or time.monotonic() - self.last_flush
+                >= settings.USAGE_BUFFER_FLUSH_INTERVAL
+            ):
+                self.flush()
+
+    def buffered(self, user_id, card_ids):
+        """Пары (карта, значение), еще не записанные в базу."""
+
+        with self._lock:
+            return [
+                (
+                    card_id,
+                    max(
+                        self.pending.get((user_id, card_id), 0),
+                        self.flushing.get((user_id, card_id), 0),
+                    ),
+                )
+                for card_id in card_ids
+                if (user_id, card_id) in self.pending
+                or (user_id, card_id) in self.flushing
+            ]
+
+    def flush(self):
+        """Записывает накопленные значения в базу."""
+
+        with self._lock:
+            self.last_flush = time.monotonic()
+            if not self.pending:
+                return 0
+            pending, self.pending, self.events = self.pending, {}, 0
+            self.flushing = pending
+            journal, self._journal = self._journal, None
+            self._open_journal()
+        try:
+            write_usage_counters(pending)
+        except Exception:
+            with self._lock:
+                for key, value in pending.items():
+                    self.pending[key] = max(self.pending.get(key, 0), value)
+                self.flushing = {}
+            journal.close()
+            raise
+        with self._lock:
+            self.flushing = {}
+        # Файл удаляется под блокировкой: после close его мог бы
+        # подхватить recover другого процесса.
+        os.remove(journal.name)
+        journal.close()
+        return len(pending)
+
+    def recover(self):
+        """Дописывает в базу журналы процессов, завершившихся без сброса."""
+
+        recovered = 0
+        for path in glob.glob(os.path.join(self.journal_dir, 'usage-*')):
+            if self._journal is not None and path == self._journal.name:
+                continue
+            try:
+                journal = open(path, encoding='utf-8')
+            except FileNotFoundError:
+                continue
+            with journal:
+                try:
+                    fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                if not same_file(journal, path):
+                    # Журнал уже разобран и удален другим процессом.
+                    continue
+                counters = read_journal(path)
+                if counters:
+                    write_usage_counters(counters)
+                    recovered += len(counters)
+                os.remove(path)
+        return recovered
+
+    def close(self):
+        """Сбрасывает буфер и удаляет журнал при штатной остановке."""
+
+        with self._lock:
+            self._closed = True
+            if self._journal is None:
+                return
+            self.flush()
+            os.remove(self._journal.name)
+            self._journal.close()
+            self._journal = None
+
+
+usage_buffer = UsageBuffer()
@@ -1,16 +1,186 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import DEFERRED
 from django.utils.translation import gettext_lazy as _
 from rest_framework import exceptions
 from rest_framework.authentication import TokenAuthentication
 
+from core.cache import CacheStats, bump_versions, get_version
+
+
+TOKEN_CACHE_KEY = 'auth:token:{digest}:{version}'
+TOKEN_VERSION_KEY = 'auth:token:version:{digest}'
+# В кэш попадают только эти поля пользователя, без хэша пароля.
+# Остальные поля отложены и читаются из базы при обращении.
+TOKEN_CACHE_USER_FIELDS = (
+    'id',
+    'email',
+    'is_active',
+    'is_staff',
+    'is_superuser',
+)
+TOKEN_CACHE_TOKEN_FIELDS = ('key', 'user_id', 'created')
+
+
+def restore_instance(model, field_names, values):
+    """Объект модели с полями field_names, остальные поля отложены."""
+
+    values = dict(zip(field_names, values))
+    return model.from_db(
+        model.objects.db,
+        field_names,
+        [
+            values.get(field.attname, DEFERRED)
+            for field in model._meta.concrete_fields
+        ],
+    )
+
+
+class TokenCache:
+    """Двухуровневый кэш токенов: LRU процесса и общий кэш.
+
+    Локальный уровень живет недолго (TOKEN_CACHE_LOCAL_TTL), поэтому
+    отзыв токена в другом процессе доходит до него не позже этого срока.
+    В текущем процессе и общем кэше запись удаляется сразу.
+
+    Запись в общем кэше привязана к версии токена, как кэш кошельков:
+    evict увеличивает версию, и значение, прочитанное из базы до отзыва,
+    записывается под старой версией, которую уже никто не читает.
+    """
+
+    def __init__(self):
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        # Счетчик отзывов в процессе: значение, прочитанное до отзыва,
+        # не попадает в локальный уровень.
+        self._evictions = 0
+        self.stats = CacheStats('auth_token')
+
+    @staticmethod
+    def digest(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @classmethod
+    def version_key(cls, key):
+        return TOKEN_VERSION_KEY.format(digest=cls.digest(key))
+
+    @classmethod
+    def shared_key(cls, key, version):
+        return TOKEN_CACHE_KEY.format(digest=cls.digest(key), version=version)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._local.move_to_end(key)
+                    self.stats.hit()
+                    return value
+                del self._local[key]
+
+        value = cache.get(
+            self.shared_key(key, get_version(self.version_key(key)))
+        )
+        if value is None:
+            self.stats.miss()
+            return None
+        self.stats.hit()
+        self._set_local(key, value, now)
+        return value
+
+    def stamp(self, key):
+        """Версия токена; берется до чтения из базы и передается в set."""
+
+        with self._lock:
+            evictions = self._evictions
+        return evictions, get_version(self.version_key(key))
+
+    def set(self, key, value, stamp):
+        evictions, version = stamp
+        cache.set(
+            self.shared_key(key, version),
+            value,
+            settings.TOKEN_CACHE_SHARED_TTL,
+        )
+        self._set_local(key, value, time.monotonic(), evictions)
+
+    def _set_local(self, key, value, now, evictions=None):
+        with self._lock:
+            if evictions is not None and evictions != self._evictions:
+                return
+            self._local[key] = (now + settings.TOKEN_CACHE_LOCAL_TTL, value)
+            self._local.move_to_end(key)
+            while len(self._local) > settings.TOKEN_CACHE_LOCAL_SIZE:
+                self._local.popitem(last=False)
+
+    def evict(self, *keys):
+        """Немедленно удаляет токены из обоих уровней кэша."""
+
+        with self._lock:
+            self._evictions += 1
+            for key in keys:
+                self._local.pop(key, None)
+        bump_versions(self.version_key(key) for key in keys)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+
+
+token_cache = TokenCache()
+
 
 class CustomTokenAuthentication(TokenAuthentication):
     """Разрешает запросы пользователям с неподтвержденной почтой."""
 
     def authenticate_credentials(self, key):
+        if not settings.TOKEN_CACHE_ENABLED:
+            return self.load_credentials(key)
+        cached = token_cache.get(key)
+        if cached is not None:
+            return self.restore_credentials(*cached)
+        stamp = token_cache.stamp(key)
+        user, token = self.load_credentials(key)
+        token_cache.set(
+            key,
+            (
+                tuple(getattr(user, name) for name in TOKEN_CACHE_USER_FIELDS),
+                tuple(
+                    getattr(token, name) for name in TOKEN_CACHE_TOKEN_FIELDS
+                ),
+            ),
+            stamp,
+        )
+        return (user, token)
+
+    def load_credentials(self, key):
         model = self.get_model()
         try:
             token = model.objects.select_related('user').get(key=key)
         except model.DoesNotExist:
             raise exceptions.AuthenticationFailed(_('Invalid token.'))
-
         return (token.user, token)
+
+    def restore_credentials(self, user_values, token_values):
+        """Пользователь и токен из значений кэша.
+
+        Каждый запрос получает новые объекты; поля, которых нет в кэше,
+        загружаются из базы при первом обращении.
+        """
+
+        user = restore_instance(
+            get_user_model(), TOKEN_CACHE_USER_FIELDS, user_values
+        )
+        token = restore_instance(
+            self.get_model(), TOKEN_CACHE_TOKEN_FIELDS, token_values
+        )
+        token.user = user
+        return (user, token)
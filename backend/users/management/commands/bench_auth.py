@@ -0,0 +1,69 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import (
+    CaptureQueriesContext,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from rest_framework.authtoken.models import Token
+
+from users.authentication import token_cache
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """Сравнение задержки авторизованных запросов с кэшем токенов и без."""
+
+    help = 'Benchmark token authenticated requests with and without cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--url', default='/api/v1/users/me/')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(
+                    email='bench-auth@example.com',
+                    password='BenchPass1',
+                    name='Bench',
+                    phone_number='9000000000',
+                )
+                token = Token.objects.create(user=user)
+                for enabled in (False, True):
+                    token_cache.evict(token.key)
+                    with override_settings(TOKEN_CACHE_ENABLED=enabled):
+                        self.report(
+                            'cache on' if enabled else 'cache off',
+                            *self.run_requests(token, options)
+                        )
+                transaction.set_rollback(True)
+        finally:
+            teardown_test_environment()
+
+    def run_requests(self, token, options):
+        client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(options['requests']):
+                started = time.perf_counter()
+                client.get(options['url'])
+                timings.append((time.perf_counter() - started) * 1000)
+        return timings, len(queries) / options['requests']
+
+    def report(self, title, timings, queries_per_request):
+        quantiles = statistics.quantiles(timings, n=100)
+        self.stdout.write(
+            f'{title}: p50={quantiles[49]:.3f}ms '
+            f'p95={quantiles[94]:.3f}ms '
+            f'mean={statistics.mean(timings):.3f}ms '
+            f'queries/request={queries_per_request:.2f}'
+        )
@@ -88,3 +88,16 @@ class User(AbstractUser):
 
     def __str__(self):
         return f'{self.name}({self.email})'
+
+    def refresh_from_db(self, using=None, fields=None):
+        """Первое обращение к отложенному полю загружает все остальные.
+
+        Пользователь из кэша токенов содержит только id и флаги, и без
+        этого каждое поле профиля читалось бы отдельным запросом.
+        """
+
+        if fields is not None:
+            deferred_fields = self.get_deferred_fields()
+            if deferred_fields.intersection(fields):
+                fields = deferred_fields.union(fields)
+        super().refresh_from_db(using, fields)
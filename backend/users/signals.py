@@ -0,0 +1,27 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_cache
+from .models import User
+
+
+LOGIN_ONLY_FIELDS = frozenset(('last_login',))
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    token_cache.evict(instance.key)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, update_fields, **kwargs):
+    """Смена пароля, деактивация и другие правки сбрасывают кэш токена."""
+
+    if update_fields is not None and LOGIN_ONLY_FIELDS >= set(update_fields):
+        return
+    keys = Token.objects.filter(user_id=instance.pk).values_list(
+        'key', flat=True
+    )
+    if keys:
+        token_cache.evict(*keys)